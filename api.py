@@ -1,23 +1,31 @@
 from taxsim.context import *
 import taxsim.taxsim as taxsim
 import taxsim.misc_funcs as misc_funcs
+import taxsim.result_cache as result_cache
+import taxsim.records as records
+import taxsim.batch as batch
+import taxsim.plans as plans
+import taxsim.microbatch as microbatch
+import taxsim.metrics as metrics
+import taxsim.jobs as jobs
 from collections import OrderedDict
 from datetime import datetime
-import copy
+import itertools
+import json
+import os
+import time
 
-from flask import Flask, abort, request, jsonify
+from flask import Flask, abort, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)
 
-tax_calc = taxsim.calc_federal_taxes
-policy = taxsim.current_law_policy
-policy_2019 = taxsim.current_law_2019_policy
-
-alt_tax_calc = taxsim.calc_senate_2018_taxes
-alt_policy = taxsim.senate_2018_policy
-alt_policy_2019 = taxsim.senate_2019_policy
-alt_policy_2019_ss = taxsim.senate_2019_ss_policy
+# Repeated households are answered from here; call cache.invalidate() after reloading a policy
+cache = result_cache.ResultCache(maxsize=4096)
+# Finished /taxcalc/tcja_submit responses, keyed by canonicalized request; see invalidate_plan()
+response_cache = result_cache.ResponseCache(maxsize=4096, ttl=3600)
+# Identical requests arriving while one is being calculated wait for and share its response
+in_flight = result_cache.SingleFlight()
 
 '''
 curl --request POST \
@@ -40,91 +48,614 @@ curl --request POST \
         "charity_contributions": 0,
         "other_itemized": 0
 }'
+
+Both endpoints calculate the plans listed in DEFAULT_PLANS unless the query
+string selects others, e.g. /taxcalc/tcja_submit?plans=tcja,ss2100&years=2019.
+Only the selected plans are calculated.
+
+Add fields=tax_burden,take_home_pay to return only those results. Marginal
+rates, which take two extra calculations per plan, are only calculated when
+marginal_income_tax_rate or marginal_business_income_tax_rate is requested.
 '''
 
 logger = taxsim.logging.getLogger()
 logger.disabled = True
 
 
+def read_plans(args):
+    """
+    Get the plans selected by the plans and years query parameters.
+
+    Raises:
+        ValueError: An unknown plan or year was requested.
+    """
+    ids = [plan_id for plan_id in args.get('plans', '').split(',') if plan_id]
+    try:
+        years = [int(year) for year in args.get('years', '').split(',') if year]
+    except ValueError:
+        raise ValueError("Years must be integers") from None
+    return plans.select_plans(ids, years)
+
+
+def read_fields(args):
+    """
+    Get the result fields selected by the fields query parameter.
+
+    Returns:
+        tuple: (fields, mrate). fields is None if every field was requested;
+            mrate is whether any requested field is a marginal rate.
+
+    Raises:
+        ValueError: An unknown result field was requested.
+    """
+    fields = [field for field in args.get('fields', '').split(',') if field]
+    if not fields:
+        return None, True
+    for field in fields:
+        if field not in records.RESULT_FIELDS:
+            raise ValueError("Unknown result field: " + field)
+    mrate = any(name in fields for name, _, _ in taxsim.MARGINAL_RATE_PERTURBATIONS)
+    return fields, mrate
+
+
+##### Metrics #####
+# Exported at /metrics in the Prometheus text format
+registry = metrics.Registry()
+requests_total = registry.counter(
+    'taxcalc_requests_total', "Requests handled, by endpoint and status code.", ['endpoint', 'status'])
+errors_total = registry.counter(
+    'taxcalc_errors_total', "Rejected requests and batch rows, by endpoint and cause.", ['endpoint', 'cause'])
+request_duration = registry.histogram(
+    'taxcalc_request_duration_seconds', "Time to handle a request.", ['endpoint'])
+request_stage_duration = registry.histogram(
+    'taxcalc_request_stage_duration_seconds', "Time spent in each stage of a request.", ['endpoint', 'stage'])
+plan_duration = registry.histogram(
+    'taxcalc_plan_duration_seconds', "Time to calculate a plan, cached or not.", ['endpoint', 'plan'])
+calc_stage_duration = registry.histogram(
+    'taxcalc_calc_stage_duration_seconds', "Time spent in each stage of an uncached calculation.", ['stage'])
+cache_lookups = registry.counter(
+    'taxcalc_cache_lookups_total', "Cache hits and misses since startup.", ['cache', 'outcome'])
+cache_size = registry.gauge(
+    'taxcalc_cache_size', "Entries in each cache.", ['cache'])
+coalesced_requests = registry.counter(
+    'taxcalc_coalesced_requests_total', "Requests answered by an identical request already being calculated.")
+coalescing_calls = registry.counter(
+    'taxcalc_coalescing_calculations_total', "Calculations run on behalf of one or more requests.")
+
+
+def observe_calc_stage(stage, seconds):
+    calc_stage_duration.observe(seconds, stage)
+
+
+taxsim.stage_observer = observe_calc_stage
+
+
+def endpoint_name():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def fail(status, cause):
+    """Count a rejected request by cause and abort it."""
+    errors_total.inc(endpoint_name(), cause)
+    abort(status)
+
+
+def record_stage(stage, start):
+    """Record a request stage that began at start (a perf_counter time); returns the time now."""
+    now = time.perf_counter()
+    request_stage_duration.observe(now - start, endpoint_name(), stage)
+    return now
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def count_request(response):
+    endpoint = endpoint_name()
+    requests_total.inc(endpoint, response.status_code)
+    if 'start' in g:
+        request_duration.observe(time.perf_counter() - g.start, endpoint)
+    return response
+
+
+@app.route("/metrics", methods=['GET'])
+def export_metrics():
+    for name, info in (('result', cache.info()), ('response', response_cache.info())):
+        cache_lookups.set_total(info.hits, name, 'hit')
+        cache_lookups.set_total(info.misses, name, 'miss')
+        cache_size.set(info.currsize, name)
+    info = in_flight.info()
+    coalesced_requests.set_total(info.coalesced)
+    coalescing_calls.set_total(info.calls)
+    return app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def preload():
+    """
+    Load every registered plan's policy and run each calc function once.
+
+    Called before serving, e.g. by application.py and serve.py, so policies,
+    numpy and the batch functions are ready before the first request. Under a
+    pre-fork server this runs once in the parent and the workers share the
+    result copy-on-write.
+    """
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['filing_status'] = 1
+    taxpayer['ordinary_income1'] = 50000
+    columns = batch.to_columns([taxpayer])
+    with app.test_request_context():
+        for plan in plans.PLANS.values():
+            policy = plans.policy(plan)
+            plan.calc(taxpayer, policy)
+            plan.batch_calc(columns, policy)
+            jsonify(plans.describe(plan))
+
+
+##### Micro-batching #####
+# Off unless enable_micro_batching() is called or TAXCALC_MICRO_BATCH_SIZE is
+# set. When on, concurrent /taxcalc/tcja_submit requests are held for up to
+# max_wait seconds and calculated together.
+micro_batcher = None
+
+
+def enable_micro_batching(max_batch_size=64, max_wait=0.002, min_batch_size=16):
+    """
+    Calculate concurrent single requests in batches, see microbatch.MicroBatcher.
+
+    Args:
+        max_batch_size (int): Most requests calculated together.
+        max_wait (float): Longest a request waits for others, in seconds.
+        min_batch_size (int): Smaller batches use the scalar calc functions.
+    """
+    global micro_batcher
+    micro_batcher = microbatch.MicroBatcher(max_batch_size, max_wait, min_batch_size, observe_micro_batch)
+
+
+def observe_micro_batch(calc, seconds):
+    # Runs in the request context of the batch's leader, a /taxcalc/tcja_submit request
+    for plan in plans.PLANS.values():
+        if plan.batch_calc is calc[0] and plans.policy(plan) is calc[1]:
+            plan_duration.observe(seconds, endpoint_name(), plan.id + '-' + str(plan.year))
+            return
+
+
+if os.environ.get('TAXCALC_MICRO_BATCH_SIZE'):
+    enable_micro_batching(int(os.environ['TAXCALC_MICRO_BATCH_SIZE']),
+                          float(os.environ.get('TAXCALC_MICRO_BATCH_WAIT_MS', 2)) / 1000)
+
+
+def invalidate_plan(plan):
+    """Drop cached results and responses for a plan, e.g. after its policy changes."""
+    cache.invalidate(plans.policy(plan))
+    response_cache.invalidate((plan.id, plan.year))
+
+
+def read_taxpayer(submission):
+    """
+    Build a taxpayer from a submitted JSON object, with values as submitted.
+
+    Raises:
+        KeyError: A taxpayer field is missing.
+        TypeError: A field is not a number.
+    """
+    taxpayer = misc_funcs.create_taxpayer()
+    for field in records.TAXPAYER_FIELDS:
+        value = submission[field]
+        # bool is an int subclass, but true and false aren't amounts
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError("Field must be a number: " + field)
+        taxpayer[field] = value
+    return taxpayer
+
+
+def canonical_results(result, fields):
+    """
+    Get the requested fields of a result, with every number a float.
+
+    Used with micro-batching: the scalar calc functions leave some results as
+    the int 0 while the batch calc functions give 0.0. Both fill the same
+    response_cache entry, so the body must not depend on which one did.
+    """
+    values = result.to_dict(fields)
+    for field, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[field] = float(value)
+    return values
+
+
+def response_key(taxpayer, selected_plans, fields, mrate):
+    # Field order and extra keys don't change the response; int and float
+    # spellings of a number do, see result_cache.taxpayer_key
+    return (result_cache.taxpayer_key(taxpayer),
+            tuple((plan.id, plan.year) for plan in selected_plans),
+            None if fields is None else tuple(fields),
+            mrate)
+
+
 @app.route("/taxcalc/tcja_submit", methods=['POST'])
 def hello():
+    start = stage_start = time.perf_counter()
     if not request.json:
         taxsim.logging.warn("Received non-json data from " + request.remote_addr)
-        abort(400)
+        fail(400, 'not_json')
+    try:
+        selected_plans = read_plans(request.args)
+        fields, mrate = read_fields(request.args)
+    except ValueError:
+        fail(400, 'bad_query')
     taxsim.logging.info("Received input taxpayer from " + request.remote_addr)
     taxsim.logging.debug(request.json)
-    submission = request.json
-    taxpayer = misc_funcs.create_taxpayer()
     try:
-        taxpayer['filing_status'] = submission['filing_status']
-        taxpayer['child_dep'] = submission['child_dep']
-        taxpayer['nonchild_dep'] = submission['nonchild_dep']
-        taxpayer['ordinary_income1'] = submission['ordinary_income1']
-        taxpayer['ordinary_income2'] = submission['ordinary_income2']
-        taxpayer['business_income'] = submission['business_income']
-        taxpayer['ss_income'] = submission['ss_income']
-        taxpayer['qualified_income'] = submission['qualified_income']
-        taxpayer['401k_contributions'] = submission['401k_contributions']
-        taxpayer['medical_expenses'] = submission['medical_expenses']
-        taxpayer['sl_income_tax'] = submission['sl_income_tax']
-        taxpayer['sl_property_tax'] = submission['sl_property_tax']
-        taxpayer['interest_paid'] = submission['interest_paid']
-        taxpayer['charity_contributions'] = submission['charity_contributions']
-        taxpayer['other_itemized'] = submission['other_itemized']
-        taxpayer['business_income_service'] = submission['business_income_service']
-    except KeyError:
+        taxpayer = read_taxpayer(request.json)
+        key = response_key(taxpayer, selected_plans, fields, mrate)
+    except (KeyError, TypeError, ValueError):
         taxsim.logging.warn("Received malformed json data from " + request.remote_addr)
-        abort(400)
-    try:
-        # Copy taxpayers
-        taxpayer1 = copy.deepcopy(taxpayer)
-        taxpayer2 = copy.deepcopy(taxpayer)
-        taxpayer3 = copy.deepcopy(taxpayer)
-        taxpayer4 = copy.deepcopy(taxpayer)
-        taxpayer5 = copy.deepcopy(taxpayer)
-        
-        # 2018
-        result = tax_calc(taxpayer1, policy)
-        alt_result = alt_tax_calc(taxpayer2, alt_policy)
-
-        # 2019
-        result_2019 = tax_calc(taxpayer3, policy_2019)
-        alt_result_2019 = alt_tax_calc(taxpayer4, alt_policy_2019)
-        alt_result_2019_ss = alt_tax_calc(taxpayer5, alt_policy_2019_ss)
+        fail(400, 'malformed_json')
+    stage_start = record_stage('parse', stage_start)
 
+    body = response_cache.get(key)
+    stage_start = record_stage('response_cache', stage_start)
+    if body is not None:
+        response_cache.record_latency(True, time.perf_counter() - start)
+        return app.response_class(body, mimetype='application/json')
+
+    try:
+        body, coalesced = in_flight.do(key, lambda: calc_response(key, taxpayer, selected_plans, fields, mrate))
     except BaseException:
         taxsim.logging.warn("Taxpayer failed input validation for " + request.remote_addr)
-        abort(400)
+        fail(400, 'invalid_taxpayer')
     taxsim.logging.info("Calculations complete for " + request.remote_addr)
+    response_cache.record_latency(False, time.perf_counter() - start)
+    return app.response_class(body, mimetype='application/json')
 
+
+def calc_response(key, taxpayer, selected_plans, fields, mrate):
+    """Calculate, serialize and cache the response body for a /taxcalc/tcja_submit request."""
+    stage_start = time.perf_counter()
+    if micro_batcher is not None:
+        plan_results = micro_batcher.calc(
+            taxpayer, [(plan.batch_calc, plans.policy(plan), plan.calc) for plan in selected_plans], mrate)
+    else:
+        plan_results = []
+        plan_start = stage_start
+        for plan in selected_plans:
+            plan_results.append(cache.calc(plan.calc, taxpayer, plans.policy(plan), mrate=mrate))
+            now = time.perf_counter()
+            plan_duration.observe(now - plan_start, endpoint_name(), plan.id + '-' + str(plan.year))
+            plan_start = now
     results = []
-    results.append({'plan': {
-        'id': 'pre-tcja',
-        'name': 'Previous Law',
-        'year': 2018},
-        'results': result})
-    results.append({'plan': {
-        'id': 'tcja',
-        'name': 'Tax Cuts and Jobs Act',
-        'year': 2018},
-        'results': alt_result})
-    results.append({'plan': {
-        'id': 'pre-tcja',
-        'name': 'Previous Law',
-        'year': 2019},
-        'results': result_2019})
-    results.append({'plan': {
-        'id': 'tcja',
-        'name': 'Tax Cuts and Jobs Act',
-        'year': 2019},
-        'results': alt_result_2019})
-    #results.append({'plan': {
-    #    'id': 'ss2100',
-    #    'name': 'Social Security 2100 Act',
-    #    'year': 2019},
-    #    'results': alt_result_2019_ss})
-
-    return jsonify(results)
+    for plan, result in zip(selected_plans, plan_results):
+        values = result.to_dict(fields) if micro_batcher is None else canonical_results(result, fields)
+        results.append({'plan': plans.describe(plan), 'results': values})
+    stage_start = record_stage('calculate', stage_start)
+
+    body = jsonify(results).get_data()
+    response_cache.put(key, body, tags=key[1])
+    record_stage('serialize', stage_start)
+    return body
+
+
+##### Batch #####
+# Largest batch accepted by /taxcalc/batch
+MAX_BATCH_ROWS = 100000
+# Rows calculated per chunk of a streamed (NDJSON) batch response
+STREAM_CHUNK_ROWS = 1000
+
+'''
+curl --request POST \
+  --url http://localhost:8080/taxcalc/batch \
+  --header 'content-type: application/x-ndjson' \
+  --data-binary @households.ndjson
+
+The body is either a JSON array of taxpayers or one taxpayer per line (NDJSON),
+each with the same fields as /taxcalc/tcja_submit. The response has one entry
+per row, in order: {"row": 0, "taxes": [...]} or {"row": 1, "error": "..."}.
+
+With --header 'accept: application/x-ndjson' the rows are instead streamed
+back one per line, STREAM_CHUNK_ROWS at a time, as they are calculated. An
+NDJSON body is then also read as it is calculated rather than up front, and a
+row beyond MAX_BATCH_ROWS ends the response with an error row instead of a 413.
+'''
+
+
+def read_batch(body):
+    """
+    Split a JSON array or NDJSON request body into rows.
+
+    Returns:
+        list: (submission, error) for each row. A line of NDJSON that does not
+            parse gives (None, error) rather than failing the whole batch.
+
+    Raises:
+        ValueError: The body is not a JSON array or NDJSON.
+    """
+    if body.lstrip().startswith('['):
+        submissions = json.loads(body)
+        if not isinstance(submissions, list):
+            raise ValueError("Expected a JSON array")
+        return [(submission, None) for submission in submissions]
+    return list(iter_ndjson(body.splitlines()))
+
+
+def iter_ndjson(lines):
+    """Yield (submission, error) for each non-blank line of NDJSON, str or bytes."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, "Invalid JSON: " + str(e)
+
+
+def iter_batch(stream):
+    """
+    Read rows from a JSON array or NDJSON request body as they are needed.
+
+    NDJSON is parsed a line at a time, so only the line being parsed is held.
+    A JSON array can only be parsed whole, so it is read up front.
+
+    Returns:
+        iterator: (submission, error) for each row, see read_batch.
+
+    Raises:
+        ValueError: The body is a JSON array that does not parse.
+    """
+    lines = iter(stream.readline, b'')
+    first = next((line for line in lines if line.strip()), None)
+    if first is None:
+        return iter(())
+    if first.lstrip().startswith(b'['):
+        rows = read_batch((first + stream.read()).decode('utf-8', 'replace'))
+        # Popped as they are taken, so rows already calculated are dropped
+        rows.reverse()
+        return (rows.pop() for _ in range(len(rows)))
+    return iter_ndjson(itertools.chain([first], lines))
+
+
+def limit_batch(rows, endpoint):
+    """Yield rows, ending with an error row in place of any beyond MAX_BATCH_ROWS."""
+    for i, row in enumerate(rows):
+        if i == MAX_BATCH_ROWS:
+            errors_total.inc(endpoint, 'batch_too_large')
+            yield None, "Batch too large: at most " + str(MAX_BATCH_ROWS) + " rows"
+            return
+        yield row
+
+
+def parse_taxpayer(submission):
+    """
+    Build and validate a taxpayer from a submitted JSON object.
+
+    Raises:
+        ValueError: With a message describing the first problem found.
+    """
+    if not isinstance(submission, dict):
+        raise ValueError("Expected a JSON object")
+    taxpayer = misc_funcs.create_taxpayer()
+    for field in records.TAXPAYER_FIELDS:
+        if field not in submission:
+            raise ValueError("Missing field: " + field)
+        value = submission[field]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("Field must be a number: " + field)
+        taxpayer[field] = value
+    if taxpayer['filing_status'] not in (0, 1, 2):
+        raise ValueError("filing_status must be 0, 1 or 2")
+    try:
+        misc_funcs.validate_taxpayer(taxpayer)
+    except ValueError:
+        raise ValueError("Invalid combination of filing_status, child_dep and nonchild_dep") from None
+    return taxpayer
+
+
+@app.route("/taxcalc/batch", methods=['POST'])
+def batch_submit():
+    stage_start = time.perf_counter()
+    try:
+        selected_plans = read_plans(request.args)
+        fields, mrate = read_fields(request.args)
+    except ValueError:
+        fail(400, 'bad_query')
+    endpoint = endpoint_name()
+    if request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson':
+        try:
+            rows = iter_batch(request.stream)
+        except ValueError:
+            taxsim.logging.warning("Received malformed batch from " + request.remote_addr)
+            fail(400, 'malformed_batch')
+        record_stage('parse', stage_start)
+        taxsim.logging.info("Streaming batch results to " + request.remote_addr)
+        # The body is read as the response is sent, so the request must outlive this view
+        return app.response_class(
+            stream_with_context(stream_batch(limit_batch(rows, endpoint), selected_plans, fields, mrate, endpoint)),
+            mimetype='application/x-ndjson')
+
+    try:
+        rows = read_batch(request.get_data(as_text=True))
+    except ValueError:
+        taxsim.logging.warning("Received malformed batch from " + request.remote_addr)
+        fail(400, 'malformed_batch')
+    if len(rows) > MAX_BATCH_ROWS:
+        fail(413, 'batch_too_large')
+    taxsim.logging.info("Received batch of " + str(len(rows)) + " taxpayers from " + request.remote_addr)
+    stage_start = record_stage('parse', stage_start)
+
+    responses = calc_batch(rows, 0, selected_plans, fields, mrate, endpoint)
+    taxsim.logging.info("Batch calculations complete for " + request.remote_addr)
+    stage_start = record_stage('calculate', stage_start)
+
+    response = jsonify(responses)
+    record_stage('serialize', stage_start)
+    return response
+
+
+def calc_batch(rows, start, selected_plans, fields, mrate, endpoint):
+    """
+    Calculate the responses for a run of batch rows.
+
+    Args:
+        rows (list): (submission, error) for each row, see read_batch.
+        start (int): Row number of the first row.
+        selected_plans (list): Plans to calculate, see read_plans.
+        fields (list): Result fields to return, or None for all of them.
+        mrate (bool): Also calculate marginal income tax rates.
+        endpoint (str): Endpoint label for metrics.
+
+    Returns:
+        list: {"row": ..., "taxes": [...]} or {"row": ..., "error": ...} for each row.
+    """
+    # Validate every row before calculating any of them
+    responses = []
+    taxpayers = []
+    valid_rows = []
+    for i, (submission, error) in enumerate(rows):
+        if error is None:
+            try:
+                taxpayers.append(parse_taxpayer(submission))
+                valid_rows.append(i)
+            except ValueError as e:
+                error = str(e)
+        if error is None:
+            responses.append(OrderedDict([('row', start + i), ('taxes', [])]))
+        else:
+            responses.append(OrderedDict([('row', start + i), ('error', error)]))
+    if len(taxpayers) < len(rows):
+        errors_total.inc(endpoint, 'invalid_row', amount=len(rows) - len(taxpayers))
+
+    # One batched calculation per plan covers every valid row
+    if taxpayers:
+        columns = batch.to_columns(taxpayers)
+        for plan in selected_plans:
+            plan_start = time.perf_counter()
+            plan_description = plans.describe(plan)
+            results = plan.batch_calc(columns, plans.policy(plan), mrate=mrate)
+            for i, result in zip(valid_rows, batch.to_rows(results, fields)):
+                responses[i]['taxes'].append({'plan': plan_description, 'results': result})
+            plan_duration.observe(time.perf_counter() - plan_start, endpoint, plan.id + '-' + str(plan.year))
+    return responses
+
+
+def ndjson_line(response):
+    """Serialize a batch response as one NDJSON line, the same for streamed batches and jobs."""
+    return json.dumps(response, sort_keys=True, separators=(',', ':')) + '\n'
+
+
+def stream_batch(rows, selected_plans, fields, mrate, endpoint):
+    """
+    Yield NDJSON lines of batch responses, calculating STREAM_CHUNK_ROWS rows at a time.
+
+    rows is an iterator, see iter_batch, taken from a chunk at a time so only
+    one chunk of rows and results is held.
+    """
+    start = 0
+    while True:
+        chunk = list(itertools.islice(rows, STREAM_CHUNK_ROWS))
+        if not chunk:
+            return
+        responses = calc_batch(chunk, start, selected_plans, fields, mrate, endpoint)
+        yield ''.join(ndjson_line(response) for response in responses)
+        start += len(chunk)
+
+
+##### Jobs #####
+# Batches too long for one request run in a local process pool, at most
+# MAX_RUNNING_JOBS at once across every server worker. Submissions
+# beyond MAX_RUNNING_JOBS + MAX_QUEUED_JOBS unfinished jobs get a 429.
+MAX_RUNNING_JOBS = 2
+MAX_QUEUED_JOBS = 8
+# Largest batch accepted by /taxcalc/jobs
+MAX_JOB_ROWS = 2000000
+
+job_queue = jobs.JobQueue(taxsim.JOBS_RESULTS_DIR, MAX_RUNNING_JOBS, MAX_QUEUED_JOBS)
+
+'''
+curl --request POST \
+  --url http://localhost:8080/taxcalc/jobs \
+  --header 'content-type: application/x-ndjson' \
+  --data-binary @households.ndjson
+
+Takes the same body and query parameters as /taxcalc/batch and returns
+{"id": ..., "status": "/taxcalc/jobs/<id>"} with status 202. Poll the status
+URL for the state (queued, running, done or failed) and the rows done, then
+download /taxcalc/jobs/<id>/result: the rows as /taxcalc/batch streams them.
+'''
+
+
+def run_batch_job(rows, plan_keys, fields, mrate, output_path, report):
+    """Job function writing a batch's NDJSON responses to output_path, see jobs.JobQueue."""
+    selected_plans = [plans.PLANS[key] for key in plan_keys]
+    with open(output_path, 'w') as f:
+        for start in range(0, len(rows), STREAM_CHUNK_ROWS):
+            responses = calc_batch(rows[start:start + STREAM_CHUNK_ROWS], start, selected_plans, fields, mrate, 'job')
+            for response in responses:
+                f.write(ndjson_line(response))
+            report(start + len(responses))
+
+
+@app.route("/taxcalc/jobs", methods=['POST'])
+def submit_job():
+    try:
+        selected_plans = read_plans(request.args)
+        fields, mrate = read_fields(request.args)
+    except ValueError:
+        fail(400, 'bad_query')
+    try:
+        rows = read_batch(request.get_data(as_text=True))
+    except ValueError:
+        taxsim.logging.warning("Received malformed job from " + request.remote_addr)
+        fail(400, 'malformed_batch')
+    if len(rows) > MAX_JOB_ROWS:
+        fail(413, 'batch_too_large')
+    try:
+        job_id = job_queue.submit(
+            run_batch_job, (rows, [(plan.id, plan.year) for plan in selected_plans], fields, mrate), len(rows))
+    except jobs.QueueFull:
+        fail(429, 'queue_full')
+    taxsim.logging.info("Queued job " + job_id + " of " + str(len(rows)) + " taxpayers from " + request.remote_addr)
+    response = jsonify({'id': job_id, 'status': '/taxcalc/jobs/' + job_id})
+    response.status_code = 202
+    response.headers['Location'] = '/taxcalc/jobs/' + job_id
+    return response
+
+
+@app.route("/taxcalc/jobs/<job_id>", methods=['GET'])
+def job_status(job_id):
+    try:
+        return jsonify(job_queue.status(job_id))
+    except KeyError:
+        fail(404, 'unknown_job')
+
+
+@app.route("/taxcalc/jobs/<job_id>/result", methods=['GET'])
+def job_result(job_id):
+    try:
+        path = job_queue.result_path(job_id)
+    except KeyError:
+        fail(404, 'unknown_job')
+    if path is None:
+        fail(409, 'job_not_done')
+    return send_file(os.path.abspath(path), mimetype='application/x-ndjson')
+
+
+@app.route("/taxcalc/jobs/<job_id>", methods=['DELETE'])
+def delete_job(job_id):
+    try:
+        forgotten = job_queue.forget(job_id)
+    except KeyError:
+        fail(404, 'unknown_job')
+    if not forgotten:
+        fail(409, 'job_running')
+    return '', 204
+
+
+@app.route("/taxcalc/plans", methods=['GET'])
+def list_plans():
+    return jsonify([dict(plans.describe(plan), default=key in plans.DEFAULT_PLANS)
+                    for key, plan in plans.PLANS.items()])
 
 
 if __name__ == "__main__":
@@ -1 +1,6 @@
 from api import app as application
+import api
+
+# Load policies before the first request; with a preloading server
+# (e.g. gunicorn --preload) this runs once and is shared by every worker
+api.preload()
@@ -1,12 +1,15 @@
 from taxsim.context import *
 import taxsim.taxsim as taxsim
 import taxsim.misc_funcs as misc_funcs
+import taxsim.result_cache as result_cache
 import taxsim.csv_parser as csv_parser
+import taxsim.plans as plans
 from collections import OrderedDict
 from datetime import datetime
-import copy
 import json
 
+taxsim.configure_logging()
+
 
 meta = []
 meta.append({
@@ -59,14 +62,8 @@ meta.append({
 })
 
 
-tax_calc = taxsim.calc_federal_taxes
-policy = taxsim.current_law_policy
-policy_2019 = taxsim.current_law_2019_policy
-
-alt_tax_calc = taxsim.calc_senate_2018_taxes
-alt_policy = taxsim.senate_2018_policy
-alt_policy_2019 = taxsim.senate_2019_policy
-alt_policy_2019_ss = taxsim.senate_2019_ss_policy
+# Repeated households are answered from here; call cache.invalidate() after reloading a policy
+cache = result_cache.ResultCache(maxsize=4096)
 
 
 taxpayers = csv_parser.load_taxpayers(taxsim.TAXPAYERS_FILE)
@@ -76,56 +73,20 @@ profiles = {"profiles": []}
 
 
 for i in range(len(taxpayers)):
+    taxpayer = taxpayers[i]
 
-    # Copy taxpayers
-    taxpayer1 = copy.deepcopy(taxpayers[i])
-    taxpayer2 = copy.deepcopy(taxpayers[i])
-    taxpayer3 = copy.deepcopy(taxpayers[i])
-    taxpayer4 = copy.deepcopy(taxpayers[i])
-    taxpayer5 = copy.deepcopy(taxpayers[i])
-
-    # 2018
-    result = tax_calc(taxpayer1, policy)
-    alt_result = alt_tax_calc(taxpayer2, alt_policy)
-
-    # 2019
-    result_2019 = tax_calc(taxpayer3, policy_2019)
-    alt_result_2019 = alt_tax_calc(taxpayer4, alt_policy_2019)
-    alt_result_2019_ss = alt_tax_calc(taxpayer5, alt_policy_2019_ss)
+    results = []
+    for plan in plans.select_plans():
+        result = cache.calc(plan.calc, taxpayer, plans.policy(plan))
+        results.append({'plan': plans.describe(plan),
+                        'results': result.to_dict()})
 
     desc = {"name": meta[i]["name"],
             "filingData": meta[i]["filingData"],
             "id": meta[i]["id"],
-            "income": result["gross_income"],
+            "income": results[0]["results"]["gross_income"],
             "tooltip": meta[i]["tooltip"]}
 
-    results = []
-    results.append({'plan': {
-        'id': 'pre-tcja',
-        'name': 'Previous Law',
-        'year': 2018},
-        'results': result})
-    results.append({'plan': {
-        'id': 'tcja',
-        'name': 'Tax Cuts and Jobs Act',
-        'year': 2018},
-        'results': alt_result})
-    results.append({'plan': {
-        'id': 'pre-tcja',
-        'name': 'Previous Law',
-        'year': 2019},
-        'results': result_2019})
-    results.append({'plan': {
-        'id': 'tcja',
-        'name': 'Tax Cuts and Jobs Act',
-        'year': 2019},
-        'results': alt_result_2019})
-    #results.append({'plan': {
-    #    'id': 'ss2100',
-    #    'name': 'Social Security 2100 Act',
-    #    'year': 2019},
-    #    'results': alt_result_2019_ss})
-
     temp_dict = {"description": desc,
                  "taxes": results}
 
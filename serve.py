@@ -0,0 +1,158 @@
+"""
+Pre-fork launcher for the tax calculator API.
+
+The parent process imports the API, loads every policy, runs each calc
+function once and opens the listening socket. It then forks the workers,
+which share everything loaded so far copy-on-write and accept connections on
+the inherited socket, so no worker starts cold. gc.freeze() moves the preloaded
+objects out of the garbage collector's reach, so collections in the workers
+don't write to (and copy) the shared pages.
+
+    python serve.py --workers 4 --port 8080
+
+Unix only (needs os.fork). Metrics at /metrics and the caches are per worker.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+from werkzeug.serving import make_server
+
+import api
+
+# A worker that exits within this many seconds of starting failed to start
+MIN_WORKER_UPTIME = 1.0
+# Seconds before restarting a worker after a fast exit, doubled for each
+# consecutive one up to RESPAWN_MAX_DELAY
+RESPAWN_DELAY = 0.1
+RESPAWN_MAX_DELAY = 5.0
+# Consecutive fast exits after which serve.py stops instead of restarting
+MAX_FAST_EXITS = 5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="serve the tax calculator API from preloaded worker processes")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on")
+    parser.add_argument('-w', '--workers', type=int, default=0, metavar='N',
+                        help="number of worker processes (0 uses every core)")
+    parser.add_argument('--backlog', type=int, default=128, help="listen backlog shared by the workers")
+    parser.add_argument('--micro-batch-size', type=int, default=0, metavar='N',
+                        help="batch up to N concurrent requests per worker (0 disables)")
+    parser.add_argument('--micro-batch-wait-ms', type=float, default=2, metavar='MS',
+                        help="longest a request waits for a micro-batch to fill")
+    return parser.parse_args(argv)
+
+
+def listen(host, port, backlog):
+    """Open the listening socket the workers share."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, host, port):
+    # Restore default signal handling; the parent stops workers with SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = make_server(host, port, api.app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def spawn(sock, host, port):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, host, port)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def respawn_delay(fast_exits):
+    """
+    Get how long to wait before replacing a worker that exited.
+
+    Args:
+        fast_exits (int): Consecutive workers that exited within
+            MIN_WORKER_UPTIME of starting, including this one.
+
+    Returns:
+        float: Seconds to wait, or None to stop serving.
+    """
+    if fast_exits >= MAX_FAST_EXITS:
+        return None
+    if fast_exits == 0:
+        return 0
+    return min(RESPAWN_DELAY * 2 ** (fast_exits - 1), RESPAWN_MAX_DELAY)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not hasattr(os, 'fork'):
+        sys.exit("serve.py needs os.fork; use application.py with a WSGI server instead")
+    workers = args.workers or os.cpu_count()
+
+    api.preload()
+    if args.micro_batch_size:
+        api.enable_micro_batching(args.micro_batch_size, args.micro_batch_wait_ms / 1000)
+    sock = listen(args.host, args.port, args.backlog)
+    gc.collect()
+    gc.freeze()
+
+    pids = dict((spawn(sock, args.host, args.port), time.monotonic()) for _ in range(workers))  # pid: start time
+    print("Serving on http://" + args.host + ":" + str(sock.getsockname()[1]) + " with " + str(workers) + " workers",
+          flush=True)
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Replace workers that die until asked to stop, backing off while they
+    # keep dying at startup (e.g. an import error) and giving up if they
+    # don't stop
+    fast_exits = 0
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = pids.pop(pid, None)
+        if started is None or stopping:
+            continue
+        fast_exits = fast_exits + 1 if time.monotonic() - started < MIN_WORKER_UPTIME else 0
+        delay = respawn_delay(fast_exits)
+        if delay is None:
+            print("Worker " + str(pid) + " exited with status " + str(status) + "; " + str(fast_exits) +
+                  " workers in a row exited at startup, stopping", flush=True)
+            stop(signal.SIGTERM, None)
+            continue
+        print("Worker " + str(pid) + " exited with status " + str(status) + ", restarting in " + str(delay) + "s",
+              flush=True)
+        time.sleep(delay)
+        if not stopping:
+            pids[spawn(sock, args.host, args.port)] = time.monotonic()
+    sock.close()
+    if fast_exits >= MAX_FAST_EXITS:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Adaptive sampling of curves that can't be split into exact linear pieces.
+
+breakpoints.py finds every breakpoint of a household's taxes, but only with a
+batch calc function and only for rates taken along the sweep's own income
+mix. Other curves fall outside that. Examples are a marginal rate taken
+across the mix, like the ordinary income rate of a qualified income sweep,
+or calc_house_2018_taxes, which has no batch version. sample() starts from a
+coarse grid. It keeps splitting the intervals where linear interpolation is
+furthest from the curve until every interval is within a tolerance or a
+point budget is spent. Flat stretches stay coarse, and the points go where
+rates change.
+
+    samples = adaptive.sample(evaluate, 25, 250000, tolerance=0.001, max_points=2000)
+    samples.income     # ascending, not evenly spaced
+    samples.converged  # False if the budget ran out first, or at an unknown jump
+
+Each round evaluates the new points of every interval it splits in one call.
+"""
+from collections import namedtuple
+import heapq
+
+import numpy as np
+
+# Largest difference between a curve and linear interpolation between samples,
+# in the units of the values (0.001 is a tenth of a percentage point of a rate)
+DEFAULT_TOLERANCE = 0.001
+DEFAULT_MAX_POINTS = 2000
+# Evenly spaced samples to start from
+DEFAULT_INITIAL_POINTS = 65
+# Closest two samples may be, in dollars
+DEFAULT_MIN_SPACING = 1.0
+
+Samples = namedtuple('Samples', ['income', 'values', 'converged'])
+Samples.__doc__ = """
+A curve sampled more densely where it bends or jumps.
+
+income (array): Sampled incomes, ascending.
+values (array): One row per income, one column per value.
+converged (bool): False if intervals were left further than the tolerance
+    from the curve, because the point budget ran out or because they got too
+    narrow to split, as at a jump that isn't between two knots.
+"""
+
+
+def sample(evaluate,
+           lo,
+           hi,
+           tolerance=DEFAULT_TOLERANCE,
+           max_points=DEFAULT_MAX_POINTS,
+           initial_points=DEFAULT_INITIAL_POINTS,
+           min_spacing=DEFAULT_MIN_SPACING,
+           max_spacing=None,
+           knots=()):
+    """
+    Sample a curve until linear interpolation between samples is within tolerance.
+
+    Every interval between samples has its midpoint evaluated, and its error is
+    how far the midpoint is from the straight line between its ends, in the
+    value that is furthest off. Each round splits the intervals with the
+    largest errors at their midpoints and evaluates the midpoints of the
+    halves. The worst intervals go first, so a budget that runs out is
+    spent where the curve bends or jumps most. Only midpoints are checked, so
+    a kink off the middle of an interval can leave up to about twice the
+    tolerance elsewhere in it.
+
+    Args:
+        evaluate (function): Takes an array of incomes and returns a 2D array
+            with one row per income and one column per value.
+        lo (float): Lowest income.
+        hi (float): Highest income.
+        tolerance (float): Error an interval may be left with.
+        max_points (int): Most incomes to evaluate.
+        initial_points (int): Evenly spaced incomes to start from, lo and hi
+            included. Their midpoints are evaluated too.
+        min_spacing (float): Intervals are not split into samples closer
+            than this.
+        max_spacing (float): Start from more points if needed to be no
+            further apart than this. A feature narrower than the starting
+            intervals can fall between their ends and midpoints and never be
+            seen, so this should be about the width of the narrowest one.
+        knots (iterable): Incomes to start from as well, such as where the
+            curve is known to change. Knots may be closer together than
+            min_spacing, e.g. either side of a known jump; the interval
+            between them is then never split, and its error doesn't count
+            against converged.
+
+    Returns:
+        Samples: Every income evaluated, with its values.
+
+    Raises:
+        ValueError: hi is not greater than lo, or max_points is too small for
+            the initial points, knots and their midpoints.
+    """
+    if not hi > lo:
+        raise ValueError("hi must be greater than lo")
+    if max_spacing is not None:
+        initial_points = max(initial_points, int(np.ceil((hi - lo) / max_spacing)) + 1)
+    if initial_points < 2:
+        raise ValueError("initial_points must be at least 2")
+    knots = np.asarray(list(knots), dtype=float)
+    grid = np.unique(np.concatenate([np.linspace(lo, hi, initial_points), knots]))
+    grid = [float(x) for x in grid[(grid >= lo) & (grid <= hi)]]
+    if max_points < 2 * len(grid) - 1:
+        raise ValueError("max_points must be at least twice the initial points and knots")
+    points = {}
+
+    def fetch(incomes):
+        points.update(zip(incomes, np.asarray(evaluate(np.array(incomes)), dtype=float)))
+
+    def error(a, b):
+        return float(np.max(np.abs(points[(a + b) / 2] - (points[a] + points[b]) / 2)))
+
+    intervals = list(zip(grid, grid[1:]))
+    fetch(grid + [(a + b) / 2 for a, b in intervals])
+    # Worst interval first
+    heap = [(-error(a, b), a, b) for a, b in intervals]
+    heapq.heapify(heap)
+    # Largest error of an interval too narrow to split, other than between two knots
+    knots = set(float(x) for x in knots)
+    unsplit_error = 0.0
+
+    while heap and -heap[0][0] > tolerance:
+        # Use at most a quarter of the remaining budget per round, on the worst intervals
+        splits = []
+        limit = max(1, (max_points - len(points)) // 8)
+        while heap and -heap[0][0] > tolerance and len(splits) < limit and len(points) + 2 * len(splits) + 2 <= max_points:
+            negative_error, a, b = heapq.heappop(heap)
+            if b - a >= 4 * min_spacing:
+                splits.append((a, b))
+            elif a not in knots or b not in knots:
+                unsplit_error = max(unsplit_error, -negative_error)
+        if not splits:
+            break
+        halves = [half for a, b in splits for half in ((a, (a + b) / 2), ((a + b) / 2, b))]
+        fetch([(a + b) / 2 for a, b in halves])
+        for a, b in halves:
+            heapq.heappush(heap, (-error(a, b), a, b))
+
+    incomes = sorted(points)
+    converged = (not heap or -heap[0][0] <= tolerance) and unsplit_error <= tolerance
+    return Samples(np.array(incomes), np.array([points[x] for x in incomes]), converged)
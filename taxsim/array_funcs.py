@@ -0,0 +1,501 @@
+"""
+Vectorized counterparts of the functions in tax_funcs.py and misc_funcs.py.
+
+Every function takes a columnar set of taxpayers (a mapping of field name to
+NumPy array, see batch.to_columns) instead of a single taxpayer dict, and
+returns arrays with one element per taxpayer. The arithmetic deliberately
+mirrors the scalar functions line by line so that both paths agree to the cent.
+"""
+
+import logging
+
+import numpy as np
+
+from . import tax_funcs
+
+
+def py_round(values, ndigits=0):
+    """
+    Round an array the same way Python's built-in round() rounds a float.
+
+    np.round scales, rounds half to even and scales back, which can disagree
+    with round() when the scaled value lands within rounding error of a half.
+    Those few elements are re-rounded with round() itself.
+
+    Args:
+        values (ndarray): Values to round.
+        ndigits (int): Number of decimal places.
+
+    Returns:
+        ndarray: Rounded values.
+    """
+    values = np.asarray(values, dtype=float)
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    rounded = np.rint(scaled) / scale
+    ties = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if ties.any():
+        rounded[ties] = [round(value, ndigits) for value in values[ties].tolist()]
+    return rounded
+
+
+def by_status(parameter, filing_status):
+    """Look up a [single, married, head_of_household] policy parameter per taxpayer."""
+    return np.asarray(parameter, dtype=float)[filing_status]
+
+
+def bracket_status(taxpayers):
+    """Index of the bracket schedule used by each taxpayer, as in tax_funcs.get_brackets."""
+    filing_status = taxpayers['filing_status']
+    return np.where(filing_status == 0, 0, np.where(filing_status == 1, 1, 2))
+
+
+BRACKET_KEYS = ("single_brackets", "married_brackets", "hoh_brackets")
+
+
+def validate_taxpayers(taxpayers):
+    """
+    Vectorized misc_funcs.validate_taxpayer.
+
+    Args:
+        taxpayers (dict): Columnar taxpayers.
+
+    Returns:
+        ndarray: Boolean mask, True for every taxpayer that fails validation.
+    """
+    filing_status = taxpayers['filing_status']
+    child_dep = taxpayers['child_dep']
+    nonchild_dep = taxpayers['nonchild_dep']
+    invalid = (child_dep % 1 != 0) | (nonchild_dep % 1 != 0)
+    invalid |= (filing_status == 2) & (child_dep == 0) & (nonchild_dep == 0)
+    invalid |= (filing_status == 0) & (child_dep > 0)
+    return invalid
+
+
+def sched_se(policy, taxpayers):
+    bus_inc = taxpayers["business_income"] * 0.9235
+    sched_se_tax = np.where(
+        bus_inc < policy["ss_wage_base"],
+        bus_inc * 0.153,
+        (bus_inc * 0.029) + (policy["ss_wage_base"] * 0.124))
+    sched_se_tax = np.where(bus_inc < 400, 0, sched_se_tax)
+    return sched_se_tax, (sched_se_tax / 2)
+
+
+def fed_payroll(policy, taxpayers):
+    """
+    Vectorized tax_funcs.fed_payroll.
+
+    Args:
+        policy (dict): A set of policy parameters, parsed from CSV.
+        taxpayers (dict): Columnar taxpayers.
+
+    Returns:
+        dict: Arrays of payroll tax values for employee and employer.
+    """
+    payroll_taxes = {
+        "employee": 0,
+        "employer": 0}
+
+    # Withholding Taxes
+    for party in payroll_taxes:
+        for income in [taxpayers['ordinary_income1'], taxpayers['ordinary_income2']]:
+            social_security = (
+                policy['ss_withholding_rate_{party}'.format(party=party)] *
+                np.minimum(income, policy['ss_wage_base']))
+            medicare = (
+                policy['medicare_withholding_rate_{party}'.format(party=party)] *
+                np.minimum(income, policy['medicare_wage_base']))
+            payroll_taxes[party] = payroll_taxes[party] + (social_security + medicare)
+
+    return payroll_taxes
+
+
+def medsurtax_niit(policy, taxpayers, agi):
+    filing_status = taxpayers['filing_status']
+    combined_ordinary_income = taxpayers['ordinary_income1'] + taxpayers['ordinary_income2']
+    investment_income = taxpayers['qualified_income']
+
+    # Additional Medicare Tax
+    threshold = by_status(policy['additional_medicare_tax_threshold'], filing_status)
+    medicare_surtax = np.where(
+        combined_ordinary_income > threshold,
+        (combined_ordinary_income - threshold) * policy['additional_medicare_tax_rate'],
+        0)
+
+    # Net Investment Income Tax https://www.irs.gov/pub/irs-pdf/f8960.pdf
+    line15 = np.maximum(agi - threshold, 0)
+    line16 = np.minimum(investment_income, line15)
+    niit = line16 * policy["niit_rate"]
+
+    return medicare_surtax, niit
+
+
+def fed_agi(policy, taxpayers, ordinary_income_after_401k, sched_se_ded):
+    """
+    Vectorized tax_funcs.fed_agi, including the IRS Publication 915 worksheet.
+
+    Args:
+        policy (dict): A set of policy parameters, parsed from CSV.
+        taxpayers (dict): Columnar taxpayers.
+        ordinary_income_after_401k (ndarray): Combined income, less 401k contributions.
+        sched_se_ded (ndarray): Deductible part of self-employment tax.
+
+    Returns:
+        ndarray: Federal adjusted gross income, including any taxable social security.
+    """
+    filing_status = taxpayers['filing_status']
+    agi = ordinary_income_after_401k + taxpayers['business_income'] + taxpayers['qualified_income']
+    agi = agi - sched_se_ded
+
+    # Social security worksheet, see tax_funcs.fed_agi
+    line1 = taxpayers['ss_income']
+    line2 = line1 / 2
+    line8 = agi + line2
+    line9 = by_status(policy["taxable_ss_base_threshold"], filing_status)
+    line10 = np.maximum(0, line8 - line9)
+    line11 = by_status(policy["taxable_ss_top_threshold"], filing_status) - line9
+    line12 = np.maximum(0, line10 - line11)
+    line13 = np.minimum(line10, line11)
+    line14 = line13 * policy["taxable_ss_base_amt"]
+    line15 = np.minimum(line14, line2)
+    line16 = np.maximum(0, line12 * policy["taxable_ss_top_amt"])
+    line17 = line15 + line16
+    line18 = line1 * policy["taxable_ss_top_amt"]
+    line19 = np.minimum(line17, line18)
+
+    return np.where((line1 > 0) & (line10 > 0), agi + line19, agi)
+
+
+def _personal_exemption(policy, taxpayers, agi, filers):
+    exemptions_claimed = filers + taxpayers["child_dep"] + taxpayers["nonchild_dep"]
+    personal_exemption = policy["personal_exemption"] * exemptions_claimed
+    phaseout_threshold = by_status(policy["personal_exemption_po_threshold"], taxpayers['filing_status'])
+    line6 = np.ceil((agi - phaseout_threshold) / policy["personal_exemption_po_amt"])
+    line7 = py_round(line6 * policy["personal_exemption_po_rate"], 3)
+    line8 = personal_exemption * line7
+    phased_out = np.maximum(0, personal_exemption - line8)
+    return personal_exemption, np.where(agi > phaseout_threshold, phased_out, personal_exemption)
+
+
+def _deductions(policy, taxpayers, agi, filers):
+    filing_status = taxpayers['filing_status']
+
+    # Standard deduction
+    standard_deduction = by_status(policy["standard_deduction"], filing_status)
+    standard_deduction = np.where(
+        taxpayers["ss_income"] > 0,
+        standard_deduction + filers * by_status(policy["additional_standard_deduction"], filing_status),
+        standard_deduction)
+
+    # Itemized deductions
+    itemized_total = (
+        taxpayers["medical_expenses"] +
+        taxpayers["sl_income_tax"] +
+        taxpayers["sl_property_tax"] +
+        taxpayers["interest_paid"] +
+        taxpayers["charity_contributions"] +
+        taxpayers["other_itemized"])
+    # Itemized Deductions Worksheet—Line 29 https://www.irs.gov/pub/irs-pdf/i1040sca.pdf
+    line1 = itemized_total
+    line2 = taxpayers["medical_expenses"]
+    line4 = (line1 - line2) * policy["itemized_limitation_amt"]
+    line6 = by_status(policy["itemized_limitation_threshold"], filing_status)
+    with np.errstate(invalid='ignore'):
+        line8 = (agi - line6) * policy["itemized_limitation_rate"]
+    limited = (line2 < line1) & (line6 < agi)
+    pease_limitation = np.where(limited, np.minimum(line4, line8), 0)
+    itemized_total = np.where(limited, line1 - pease_limitation, itemized_total)
+
+    deductions = np.maximum(itemized_total, standard_deduction)
+    deduction_type = np.where(deductions == standard_deduction, "standard", "itemized")
+
+    return deduction_type, deductions, pease_limitation
+
+
+def fed_taxable_income(policy, taxpayers, agi):
+    """
+    Vectorized tax_funcs.fed_taxable_income.
+
+    Returns:
+        Same tuple as the scalar function, one array per element.
+    """
+    filers = np.where(taxpayers["filing_status"] == 1, 2, 1)
+    personal_exemption = _personal_exemption(policy, taxpayers, agi, filers)[1]
+    deduction_type, deductions, pease_limitation = _deductions(policy, taxpayers, agi, filers)
+    taxable_income = np.maximum(0, agi - personal_exemption - deductions)
+
+    return taxable_income, deduction_type, deductions, personal_exemption, pease_limitation
+
+
+def senate_2018_taxable_income(policy, taxpayers, agi):
+    """
+    Vectorized tax_funcs.senate_2018_taxable_income, including the 199A deduction.
+
+    Returns:
+        Same tuple as the scalar function, one array per element.
+    """
+    filing_status = taxpayers["filing_status"]
+    filers = np.where(filing_status == 1, 2, 1)
+    personal_exemption_amt, phased_out = _personal_exemption(policy, taxpayers, agi, filers)
+    # The scalar function phases out from a zero starting amount, see tax_funcs
+    phaseout_threshold = by_status(policy["personal_exemption_po_threshold"], filing_status)
+    personal_exemption_amt = np.where(agi > phaseout_threshold, 0, personal_exemption_amt)
+    deduction_type, deductions, pease_limitation_amt = _deductions(policy, taxpayers, agi, filers)
+
+    taxable_income_before = np.maximum(0, agi - personal_exemption_amt - deductions)
+
+    # Section 199A qualified business income deduction
+    qualified_business_income = taxpayers['business_income'] * policy["199a_rate"]
+    taxable_income_limit = taxable_income_before * policy["199a_rate"]
+
+    po_start = by_status(policy["199a_po_start"], filing_status)
+    po_length = by_status(policy["199a_po_length"], filing_status)
+    taxable_income_over = taxable_income_before - po_start
+    multiplier = 1 - (taxable_income_over / po_length)
+    phasing_out = (taxable_income_before > po_start) & (taxpayers['business_income_service'] == 1)
+    qualified_business_income = np.where(
+        phasing_out,
+        np.where(taxable_income_over > po_length, 0, qualified_business_income * multiplier),
+        qualified_business_income)
+
+    business_income_deduction = np.minimum(qualified_business_income, taxable_income_limit)
+    deductions = deductions + business_income_deduction
+
+    taxable_income = np.maximum(0, agi - personal_exemption_amt - deductions)
+
+    return taxable_income, deduction_type, deductions, personal_exemption_amt, pease_limitation_amt, taxable_income_before, agi, business_income_deduction
+
+
+def schedule_tax(schedule, taxable_income):
+    """Vectorized tax_funcs.schedule_tax on a compiled BracketSchedule."""
+    thresholds = np.asarray(schedule.thresholds, dtype=float)
+    i = np.searchsorted(thresholds, taxable_income, side='left') - 1
+    bracket = np.maximum(i, 0)
+    tax = (taxable_income - thresholds[bracket]) * np.asarray(schedule.rates, dtype=float)[bracket]
+    # Whole brackets below each taxpayer's top one, added top down as in tax_funcs.schedule_tax
+    for k in reversed(range(len(schedule.bracket_tax))):
+        tax = np.where(k < i, tax + schedule.bracket_tax[k], tax)
+    return np.where(i < 0, 0, tax)
+
+
+def fed_ordinary_income_tax(policy, taxpayers, taxable_income):
+    ordinary_income_tax = np.zeros_like(taxable_income)
+    status = bracket_status(taxpayers)
+    for index, key in enumerate(BRACKET_KEYS):
+        mask = status == index
+        if mask.any():
+            schedule = tax_funcs.compile_brackets(tuple(policy[key]), tuple(policy["income_tax_rates"]))
+            ordinary_income_tax[mask] = schedule_tax(schedule, taxable_income[mask])
+    return py_round(ordinary_income_tax, 2)
+
+
+def _ctc_worksheet(policy, taxpayers, agi):
+    # Child Tax Credit Worksheet https://www.irs.gov/pub/irs-pdf/p972.pdf
+    line1 = taxpayers["child_dep"] * policy["ctc_credit"]
+    line5 = by_status(policy["ctc_po_threshold"], taxpayers['filing_status'])
+    line6 = np.where(agi > line5, np.ceil((agi - line5) / 1000) * 1000, 0)
+    line7 = line6 * policy["ctc_po_rate"]
+    line8 = np.where(line1 > line7, line1 - line7, 0)
+
+    # Additional Child Tax Credit
+    actc_line2 = taxpayers['ordinary_income1'] + taxpayers['ordinary_income2']  # Earned income
+    actc_line4 = np.where(
+        actc_line2 > policy['additional_ctc_threshold'],
+        (actc_line2 - policy['additional_ctc_threshold']) * policy['additional_ctc_rate'],
+        0)
+    return line1, line8, actc_line4
+
+
+def _warn_actc(policy, line1, line8, actc_line4, refundable):
+    uncertain = refundable & (line1 >= policy['additional_ctc_threshold']) & (actc_line4 < line8)
+    if uncertain.any():
+        logging.warning(str(int(uncertain.sum())) + " taxpayer(s) may NOT be eligible for the additional child tax credit")
+
+
+def fed_ctc(policy, taxpayers, agi, tax_liability):
+    line1, line8, actc_line4 = _ctc_worksheet(policy, taxpayers, agi)
+    refundable = line8 > tax_liability
+    ctc = np.where(refundable, np.maximum(0, line8 - actc_line4), line8)
+    actc = np.where(refundable, np.minimum(line8, actc_line4), 0)
+    _warn_actc(policy, line1, line8, actc_line4, refundable)
+    return ctc, actc
+
+
+def fed_ctc_actc_limited(policy, taxpayers, agi, actc_limit, tax_liability):
+    line1, line8, actc_line4 = _ctc_worksheet(policy, taxpayers, agi)
+    refundable = line8 > tax_liability
+    ctc = np.maximum(0, line8 - actc_line4)
+    actc = np.minimum(line8, actc_line4)
+
+    # Excess ACTC over the per-child limit moves back to the nonrefundable CTC
+    actc_limit = taxpayers["child_dep"] * actc_limit
+    overage = actc - actc_limit
+    over_limit = actc > actc_limit
+    ctc = np.where(over_limit, ctc + overage, ctc)
+    actc = np.where(over_limit, actc - overage, actc)
+
+    _warn_actc(policy, line1, line8, actc_line4, refundable)
+    return np.where(refundable, ctc, line8), np.where(refundable, actc, 0)
+
+
+def fed_eitc(policy, taxpayers):
+    # Publication 596 https://www.irs.gov/pub/irs-pdf/p596.pdf
+    income = taxpayers["ordinary_income1"] + taxpayers["ordinary_income2"]  # earned income
+    dependent_count = np.minimum(taxpayers["child_dep"], 3).astype(int)
+    married = taxpayers["filing_status"] == 1
+    eitc_threshold = np.asarray(policy["eitc_threshold"], dtype=float)[dependent_count]
+    eitc_max = np.asarray(policy["eitc_max"], dtype=float)[dependent_count]
+    eitc_phaseout = np.where(
+        married,
+        np.asarray(policy["eitc_phaseout_married"], dtype=float)[dependent_count],
+        np.asarray(policy["eitc_phaseout_single"], dtype=float)[dependent_count])
+    eitc_max_income = np.where(
+        married,
+        np.asarray(policy["eitc_max_income_married"], dtype=float)[dependent_count],
+        np.asarray(policy["eitc_max_income_single"], dtype=float)[dependent_count])
+
+    eitc = np.select(
+        [income < eitc_threshold, income <= eitc_phaseout],
+        [income * (eitc_max / eitc_threshold), eitc_max],
+        np.maximum(0, eitc_max + (
+            (eitc_phaseout - income) *
+            (eitc_max / (eitc_max_income - eitc_phaseout)))))
+    return py_round(eitc, 2)
+
+
+def fed_amt(policy, taxpayers, deduction_type, deductions, agi, pease_limitation, income_tax_before_credits, taxable_income):
+    # Form 6251 https://www.irs.gov/pub/irs-pdf/f6251.pdf
+    filing_status = taxpayers['filing_status']
+    qualified_income = taxpayers["qualified_income"]
+
+    # Step 1: Define AMT income
+    line1 = agi - deductions
+    line2 = np.where(taxpayers["ss_income"] > 0, taxpayers["medical_expenses"], 0)
+    line3 = taxpayers["sl_income_tax"] + taxpayers["sl_property_tax"]
+    line5 = taxpayers["other_itemized"]
+    line6 = np.where(
+        agi < by_status(policy["itemized_limitation_threshold"], filing_status),
+        0,
+        -pease_limitation)
+    amt_income = np.where(
+        deduction_type == "itemized",
+        line1 + line2 + line3 + line5 + line6,
+        agi)
+
+    # Step 2: Calculate AMT Exemption
+    amt_exemption = by_status(policy["amt_exemption"], filing_status)
+    amt_exemption_po_threshold = by_status(policy["amt_exemption_po_threshold"], filing_status)
+    line29 = np.where(
+        amt_income > amt_exemption_po_threshold,
+        np.maximum(0, amt_exemption - (amt_income - amt_exemption_po_threshold) * policy["amt_exemption_po_rate"]),
+        amt_exemption)
+    amt_taxable_income = np.maximum(0, amt_income - line29)  # line 30
+
+    # Step 3: Calculate AMT
+    amt_rate_threshold = policy["amt_rate_threshold"]
+    amt_rates = policy["amt_rates"]
+    rate_diff = (
+        (amt_rate_threshold * amt_rates[1]) -
+        (amt_rate_threshold * amt_rates[0]))
+
+    # No qualified income: lines 31 and 33 of form 6251
+    amt_ordinary = np.where(
+        amt_taxable_income < amt_rate_threshold,
+        amt_taxable_income * amt_rates[0],
+        amt_taxable_income * amt_rates[1] - rate_diff)
+
+    # Tax Computation Using Maximum Capital Gains Rate
+    line36 = amt_taxable_income
+    line37 = np.maximum(qualified_income, 0)
+    line40 = np.minimum(line36, line37)
+    line41 = line36 - line40
+    line42 = np.where(
+        line41 <= amt_rate_threshold,
+        line41 * amt_rates[0],
+        line41 * amt_rates[1] - rate_diff)
+    line43 = by_status(policy["cap_gains_lower_threshold"], filing_status)
+    line44 = np.maximum(taxable_income - qualified_income, 0)
+    line45 = np.maximum(line43 - line44, 0)
+    line46 = np.minimum(line36, line37)
+    line47 = np.minimum(line45, line46)
+    line48 = line46 - line47
+    line49 = by_status(policy["cap_gains_upper_threshold"], filing_status)
+    line52 = line45 + line44
+    line53 = np.maximum(line49 - line52, 0)
+    line54 = np.minimum(line48, line53)
+    line55 = line54 * policy["cap_gains_lower_rate"]
+    line56 = line47 + line54
+    # math.isclose with its default relative tolerance
+    close = np.abs(line56 - line36) <= 1e-09 * np.maximum(np.abs(line56), np.abs(line36))
+    line58 = np.where(close, 0, (line46 - line56) * policy["cap_gains_upper_rate"])
+    line62 = line42 + line55 + line58
+    line63 = np.where(
+        line36 <= amt_rate_threshold,
+        line36 * amt_rates[0],
+        line36 * amt_rates[1] - rate_diff)
+    amt_qualified = np.minimum(line62, line63)
+
+    amt = np.where(qualified_income == 0, amt_ordinary, amt_qualified)
+    amt = np.maximum(0, amt - income_tax_before_credits)  # aka line35
+
+    return amt, amt_taxable_income
+
+
+def fed_qualified_income(policy, taxpayers, taxable_income, income_tax_before_credits):
+    # Qualified Dividends and Capital Gain Tax Worksheet—Line 44, Form 1040
+    filing_status = taxpayers['filing_status']
+    line1 = taxable_income
+    line6 = np.maximum(0, taxpayers["qualified_income"])
+    line7 = np.maximum(0, line1 - line6)
+    line8 = by_status(policy["cap_gains_lower_threshold"], filing_status)
+    line9 = np.minimum(line1, line8)
+    line10 = np.minimum(line7, line9)
+    line11 = line9 - line10  # this amount is taxed at 0%
+    line12 = np.minimum(line1, line6)
+    line14 = line12 - line11
+    line15 = by_status(policy["cap_gains_upper_threshold"], filing_status)
+    line16 = np.minimum(line15, line1)
+    line17 = line7 + line11
+    line18 = np.maximum(0, line16 - line17)
+    line19 = np.minimum(line14, line18)
+    line20 = line19 * policy["cap_gains_lower_rate"]
+    line21 = line11 + line19
+    line22 = line12 - line21
+    line23 = line22 * policy["cap_gains_upper_rate"]
+    line24 = fed_ordinary_income_tax(policy, taxpayers, line7)  # tax on line7
+    line25 = line20 + line23 + line24
+    return np.minimum(line25, income_tax_before_credits)
+
+
+def get_gross_income(taxpayers,
+                     incomes=("ordinary_income1",
+                              "ordinary_income2",
+                              "business_income",
+                              "ss_income",
+                              "qualified_income")):
+    income = 0
+    for income_type in incomes:
+        income = income + taxpayers[income_type]
+    return income
+
+
+def calc_effective_rates(income_tax_after_credits, payroll_taxes, gross_income, results):
+    """Vectorized misc_funcs.calc_effective_rates."""
+    results['total_payroll_tax'] = payroll_taxes["employee"] + payroll_taxes["employer"]
+    results['cash_income'] = gross_income + payroll_taxes["employer"]
+    results['tax_burden'] = income_tax_after_credits + payroll_taxes["employee"]
+    results['tax_wedge'] = income_tax_after_credits + payroll_taxes["employee"] + payroll_taxes["employer"]
+    results['take_home_pay'] = results['cash_income'] - results['tax_wedge']
+
+    # Rates are 0 wherever the scalar function would hit a ZeroDivisionError
+    undefined = (results['cash_income'] == 0) | (gross_income == 0)
+    if undefined.any():
+        logging.warning(str(int(undefined.sum())) + " taxpayer(s) have gross_income of $0. Potential refund not reflected in rates.")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['avg_effective_tax_rate'] = np.where(
+            undefined, 0, results['tax_wedge'] / results['cash_income'])
+        results['avg_effective_tax_rate_wo_payroll'] = np.where(
+            undefined, 0, income_tax_after_credits / gross_income)
+
+    return results
@@ -0,0 +1,403 @@
+"""
+Batch (columnar) versions of the tax calculation functions in taxsim.py.
+
+Instead of one taxpayer dict per call, these functions take a columnar set of
+taxpayers, one array per field from misc_funcs.create_taxpayer, and run every
+stage of the return as whole-array operations. Results come back as an
+OrderedDict of arrays with the same keys, in the same order, as the scalar
+functions produce.
+
+    columns = batch.to_columns(csv_parser.load_taxpayers("taxpayers.csv"))
+    results = batch.calc_federal_taxes_batch(columns, taxsim.current_law_policy)
+    rows = batch.to_rows(results)
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from . import array_funcs
+from . import misc_funcs
+from .taxsim import ASSUMED_MORTGAGE_RATE, MARGINAL_RATE_PERTURBATIONS
+
+TAXPAYER_FIELDS = tuple(misc_funcs.create_taxpayer().keys())
+
+
+def to_columns(taxpayers):
+    """
+    Convert an iterable of taxpayer dicts into columnar taxpayers.
+
+    Args:
+        taxpayers (iterable): Taxpayer dicts, as returned by misc_funcs.create_taxpayer
+            or csv_parser.load_taxpayers.
+
+    Returns:
+        OrderedDict: One float array per taxpayer field (filing_status is an int array).
+    """
+    taxpayers = list(taxpayers)
+    columns = OrderedDict()
+    for field in TAXPAYER_FIELDS:
+        columns[field] = [taxpayer[field] for taxpayer in taxpayers]
+    return as_columns(columns)
+
+
+def as_columns(taxpayers):
+    """
+    Normalize a mapping of taxpayer field to sequence (dict of lists, DataFrame,
+    dict of arrays) into the arrays used by the batch functions.
+
+    Raises:
+        KeyError: A taxpayer field is missing.
+        ValueError: A field is not numeric or the columns differ in length.
+    """
+    columns = OrderedDict()
+    for field in TAXPAYER_FIELDS:
+        columns[field] = np.asarray(taxpayers[field], dtype=float).reshape(-1)
+    if len(set(len(column) for column in columns.values())) > 1:
+        raise ValueError("Taxpayer columns must all have the same length")
+    if np.any(columns['filing_status'] % 1 != 0):
+        raise ValueError("filing_status must be an integer")
+    columns['filing_status'] = columns['filing_status'].astype(int)
+    return columns
+
+
+def income_sweep(filing_status, child_dep, income_ratios, income):
+    """
+    Build columnar taxpayers of one household shape at each of several incomes.
+
+    Args:
+        filing_status (int): 0 (single), 1 (married) or 2 (head of household).
+        child_dep (int): Number of children.
+        income_ratios (dict): Share of income that is ordinary, business, ss
+            and qualified income.
+        income (array): Gross income of each taxpayer.
+
+    Returns:
+        OrderedDict: Columnar taxpayers, see as_columns.
+    """
+    income = np.asarray(income, dtype=float)
+    columns = OrderedDict((field, np.zeros(len(income))) for field in TAXPAYER_FIELDS)
+    columns['filing_status'] = np.full(len(income), filing_status, dtype=int)
+    columns['child_dep'] = np.full(len(income), child_dep, dtype=float)
+    columns['ordinary_income1'] = income * income_ratios["ordinary"]
+    columns['business_income'] = income * income_ratios["business"]
+    columns['ss_income'] = income * income_ratios["ss"]
+    columns['qualified_income'] = income * income_ratios["qualified"]
+    return columns
+
+
+def to_rows(results, fields=None):
+    """
+    Convert columnar results back into a list of per-taxpayer OrderedDicts.
+
+    The rows hold plain Python values and can be passed to csv_parser.write_results
+    or serialized as JSON.
+
+    Args:
+        results (dict): Columnar results, as returned by the batch calc functions.
+        fields (iterable): Only convert these fields, in this order. Fields
+            missing from results are left out.
+    """
+    keys = list(results.keys()) if fields is None else [key for key in fields if key in results]
+    columns = [np.asarray(results[key]).tolist() for key in keys]
+    return [OrderedDict(zip(keys, row)) for row in zip(*columns)]
+
+
+def _perturb(taxpayers, perturbations):
+    # Stack one copy of the taxpayers per perturbation into a single batch
+    stacked = OrderedDict()
+    for field, column in taxpayers.items():
+        copies = []
+        for name, perturbed_field, step in perturbations:
+            copies.append(column + step if field == perturbed_field else column)
+        stacked[field] = np.concatenate(copies)
+    return stacked
+
+
+def _marginal_rates(calc_function, taxpayers, policy, results, perturbations=MARGINAL_RATE_PERTURBATIONS):
+    # Marginal rate calculations use tax_burden, NOT income_tax_after_credits
+    perturbations = list(perturbations)
+    count = len(results["tax_burden"])
+    perturbed_results = calc_function(_perturb(taxpayers, perturbations), policy, mrate=False)
+    tax_burden = perturbed_results["tax_burden"]
+    for i, (name, field, step) in enumerate(perturbations):
+        results[name] = (tax_burden[i * count:(i + 1) * count] - results["tax_burden"]) / step
+    return results
+
+
+def calc_marginal_rates_batch(calc_function, taxpayers, policy, perturbations=MARGINAL_RATE_PERTURBATIONS):
+    """
+    Calculate several marginal rates (income types and step sizes) for columnar
+    taxpayers, evaluating every perturbation in one stacked batch.
+
+    Args:
+        calc_function (function): calc_federal_taxes_batch or calc_senate_2018_taxes_batch.
+        taxpayers (dict): Columnar taxpayers, see as_columns.
+        policy (dict): A set of policy parameters, parsed from CSV.
+        perturbations (iterable): (result name, taxpayer field, step) tuples,
+            see taxsim.MARGINAL_RATE_PERTURBATIONS.
+
+    Returns:
+        OrderedDict: One array of marginal rates per perturbation, keyed by result name.
+    """
+    taxpayers = as_columns(taxpayers)
+    results = calc_function(taxpayers, policy, mrate=False)
+    rates = _marginal_rates(calc_function, taxpayers, policy, OrderedDict(tax_burden=results["tax_burden"]), perturbations)
+    del rates["tax_burden"]
+    return rates
+
+
+def from_scalar(calc_function):
+    """
+    Wrap a scalar calc function so it takes and returns columns like the batch functions.
+
+    For calc functions with no batch version, such as taxsim.calc_house_2018_taxes.
+    Each taxpayer is still calculated on its own, so this is no faster than
+    calling calc_function in a loop.
+
+    Args:
+        calc_function (function): Takes a taxpayer, a policy and mrate and
+            returns a records.Result.
+
+    Returns:
+        function: calc(taxpayers, policy, mrate=True) returning an OrderedDict
+            of result arrays.
+    """
+    def calc(taxpayers, policy, mrate=True):
+        rows = to_rows(as_columns(taxpayers))
+        results = []
+        for row in rows:
+            # Dependents are counts, and the scalar functions index by them
+            row['child_dep'] = int(row['child_dep'])
+            row['nonchild_dep'] = int(row['nonchild_dep'])
+            results.append(calc_function(misc_funcs.create_taxpayer(row), policy, mrate=mrate).to_dict())
+        fields = list(results[0].keys()) if results else []
+        return OrderedDict((field, np.array([result[field] for result in results])) for field in fields)
+    return calc
+
+
+def _validate(taxpayers):
+    invalid = array_funcs.validate_taxpayers(taxpayers)
+    if invalid.any():
+        rows = np.flatnonzero(invalid)
+        raise ValueError("Invalid taxpayer(s) at row(s): " + ", ".join(str(row) for row in rows[:10]))
+
+
+##### Current Law #####
+def calc_federal_taxes_batch(taxpayers, policy, mrate=True):
+    """
+    Batch version of taxsim.calc_federal_taxes.
+
+    Args:
+        taxpayers (dict): Columnar taxpayers, see as_columns.
+        policy (dict): A set of policy parameters, parsed from CSV.
+        mrate (bool): Also calculate marginal income tax rates.
+
+    Returns:
+        OrderedDict: One array per result field of calc_federal_taxes.
+    """
+    taxpayers = as_columns(taxpayers)
+    _validate(taxpayers)
+    working = OrderedDict(taxpayers)
+    results = OrderedDict()
+    working["interest_paid"] = np.minimum(policy['mortgage_interest_cap'] * ASSUMED_MORTGAGE_RATE, working["interest_paid"])
+
+    # Gross income
+    results["gross_income"] = array_funcs.get_gross_income(working)
+
+    # Payroll taxes
+    payroll_taxes = array_funcs.fed_payroll(policy, working)
+    results["employee_payroll_tax"] = payroll_taxes['employee']
+    results["employer_payroll_tax"] = payroll_taxes['employer']
+
+    sched_se_tax, sched_se_ded = array_funcs.sched_se(policy, working)
+
+    # Income after tax-deferred retirement contributions
+    ordinary_income_after_401k = (
+        working['ordinary_income1'] +
+        working['ordinary_income2'] -
+        working['401k_contributions'])
+    results["ordinary_income_after_401k"] = ordinary_income_after_401k
+
+    # AGI
+    agi = array_funcs.fed_agi(policy, working, ordinary_income_after_401k, sched_se_ded)
+    results["agi"] = agi
+
+    medical_threshold = policy["medical_expense_threshold"] * agi
+    working["medical_expenses"] = np.where(
+        medical_threshold > working["medical_expenses"], 0, working["medical_expenses"] - medical_threshold)
+    working["charity_contributions"] = np.minimum(policy['charitable_cont_limit'] * agi, working["charity_contributions"])
+
+    # Taxable income
+    taxable_income, deduction_type, deductions, personal_exemption_amt, pease_limitation_amt = array_funcs.fed_taxable_income(policy, working, agi)
+    results["taxable_income"] = taxable_income
+    results["deduction_type"] = deduction_type
+    results["deductions"] = deductions
+    results["personal_exemption_amt"] = personal_exemption_amt
+    results["pease_limitation_amt"] = pease_limitation_amt
+    results['qbi_ded'] = np.zeros_like(agi)
+
+    # Ordinary income tax
+    income_tax_before_credits = array_funcs.fed_ordinary_income_tax(policy, working, taxable_income)
+    results["income_tax_before_credits"] = income_tax_before_credits
+
+    # Qualified income/capital gains
+    qualified_income_tax = array_funcs.fed_qualified_income(policy, working, taxable_income, income_tax_before_credits)
+    income_tax_before_credits = np.minimum(income_tax_before_credits, qualified_income_tax)
+    results["qualified_income_tax"] = qualified_income_tax
+    results["selected_tax_before_credits"] = income_tax_before_credits  # form1040_line44
+
+    # AMT
+    amt, amt_taxable_income = array_funcs.fed_amt(policy, working, deduction_type, deductions, agi, pease_limitation_amt, income_tax_before_credits, taxable_income)
+    results['amt_taxable_income'] = amt_taxable_income
+    results["amt"] = amt
+
+    income_tax_before_credits = income_tax_before_credits + amt
+    results["income_tax_before_credits_with_amt"] = income_tax_before_credits
+
+    # CTC
+    ctc, actc = array_funcs.fed_ctc(policy, working, agi, income_tax_before_credits)
+    results["ctc"] = ctc
+    results["actc"] = actc
+
+    # EITC
+    eitc = array_funcs.fed_eitc(policy, working)
+    results["eitc"] = eitc
+
+    results["dep_credit"] = np.zeros_like(agi)
+
+    # Tax after nonrefundable credits
+    income_tax_after_nonrefundable_credits = array_funcs.py_round(np.maximum(0, income_tax_before_credits - ctc), 2)
+    results["income_tax_after_nonrefundable_credits"] = income_tax_after_nonrefundable_credits
+
+    # Other taxes
+    medicare_surtax, niit = array_funcs.medsurtax_niit(policy, working, agi)
+    results["medicare_surtax"] = medicare_surtax
+    results["niit"] = niit
+    results["sched_se_tax"] = sched_se_tax
+    results["income_tax_after_other_taxes"] = income_tax_after_nonrefundable_credits + medicare_surtax + niit + sched_se_tax
+
+    # Tax after ALL credits (payments)
+    results["income_tax_after_credits"] = array_funcs.py_round(results["income_tax_after_other_taxes"] - actc - eitc, 2)
+
+    results = array_funcs.calc_effective_rates(results["income_tax_after_credits"],
+                                               payroll_taxes,
+                                               results["gross_income"], results)
+
+    if mrate is True:
+        results = _marginal_rates(calc_federal_taxes_batch, taxpayers, policy, results)
+
+    return results
+
+
+##### Senate 2018 #####
+def calc_senate_2018_taxes_batch(taxpayers, policy, mrate=True):
+    """
+    Batch version of taxsim.calc_senate_2018_taxes (TCJA), including the SALT cap,
+    the section 199A deduction and the ACTC limit.
+
+    Args:
+        taxpayers (dict): Columnar taxpayers, see as_columns.
+        policy (dict): A set of policy parameters, parsed from CSV.
+        mrate (bool): Also calculate marginal income tax rates.
+
+    Returns:
+        OrderedDict: One array per result field of calc_senate_2018_taxes.
+    """
+    taxpayers = as_columns(taxpayers)
+    _validate(taxpayers)
+    working = OrderedDict(taxpayers)
+    results = OrderedDict()
+
+    # sl_income_tax will be included in sl_property_tax
+    working["sl_property_tax"] = np.minimum(policy["taxes_paid_deduction_limit"], working["sl_property_tax"] + working["sl_income_tax"])
+    working["sl_income_tax"] = np.zeros_like(working["sl_income_tax"])
+    working["interest_paid"] = np.minimum(policy['mortgage_interest_cap'] * ASSUMED_MORTGAGE_RATE, working["interest_paid"])
+
+    # Gross income
+    results["gross_income"] = array_funcs.get_gross_income(working)
+
+    # Payroll taxes
+    payroll_taxes = array_funcs.fed_payroll(policy, working)
+    results["employee_payroll_tax"] = payroll_taxes['employee']
+    results["employer_payroll_tax"] = payroll_taxes['employer']
+
+    sched_se_tax, sched_se_ded = array_funcs.sched_se(policy, working)
+
+    # Income after tax-deferred retirement contributions
+    ordinary_income_after_401k = working['ordinary_income1'] + working['ordinary_income2'] - working['401k_contributions']
+    results["ordinary_income_after_401k"] = ordinary_income_after_401k
+
+    # AGI
+    agi = array_funcs.fed_agi(policy, working, ordinary_income_after_401k, sched_se_ded)
+    results["agi"] = agi
+
+    medical_threshold = policy["medical_expense_threshold"] * agi
+    working["medical_expenses"] = np.where(
+        medical_threshold > working["medical_expenses"], 0, working["medical_expenses"] - medical_threshold)
+    working["charity_contributions"] = np.minimum(policy['charitable_cont_limit'] * agi, working["charity_contributions"])
+
+    # Taxable income
+    taxable_income, deduction_type, deductions, personal_exemption_amt, pease_limitation_amt, taxable_income_before, new_agi, business_income_deduction = array_funcs.senate_2018_taxable_income(policy, working, agi)
+    results["taxable_income"] = taxable_income
+    results["deduction_type"] = deduction_type
+    results["deductions"] = deductions
+    results["personal_exemption_amt"] = personal_exemption_amt
+    results["pease_limitation_amt"] = pease_limitation_amt
+    agi = new_agi
+    results['agi'] = new_agi
+    results['qbi_ded'] = business_income_deduction
+
+    # Ordinary income tax
+    income_tax_before_credits = array_funcs.fed_ordinary_income_tax(policy, working, taxable_income)
+    results["income_tax_before_credits"] = income_tax_before_credits
+
+    # Qualified income/capital gains
+    qualified_income_tax = array_funcs.fed_qualified_income(policy, working, taxable_income, income_tax_before_credits)
+    income_tax_before_credits = np.minimum(income_tax_before_credits, qualified_income_tax)
+    results["qualified_income_tax"] = qualified_income_tax
+    results["selected_tax_before_credits"] = income_tax_before_credits  # form1040_line44
+
+    # AMT
+    amt, amt_taxable_income = array_funcs.fed_amt(policy, working, deduction_type, deductions, agi, pease_limitation_amt, income_tax_before_credits, taxable_income)
+    results['amt_taxable_income'] = amt_taxable_income
+    results["amt"] = amt
+
+    income_tax_before_credits = income_tax_before_credits + amt
+    results["income_tax_before_credits_with_amt"] = income_tax_before_credits
+
+    # CTC
+    ctc, actc = array_funcs.fed_ctc_actc_limited(policy, working, agi, policy["actc_limit"], income_tax_before_credits)
+    results["ctc"] = ctc
+    results["actc"] = actc
+
+    # EITC
+    eitc = array_funcs.fed_eitc(policy, working)
+    results["eitc"] = eitc
+
+    # $500 nonrefundable credit for qualifying dependents other than qualifying children
+    dep_credit = policy["nonchild_dep_credit"] * working["nonchild_dep"]
+    results["dep_credit"] = dep_credit
+
+    # Tax after nonrefundable credits
+    income_tax_after_nonrefundable_credits = array_funcs.py_round(np.maximum(0, income_tax_before_credits - ctc - dep_credit), 2)
+    results["income_tax_after_nonrefundable_credits"] = income_tax_after_nonrefundable_credits
+
+    # Other taxes
+    medicare_surtax, niit = array_funcs.medsurtax_niit(policy, working, agi)
+    results["medicare_surtax"] = medicare_surtax
+    results["niit"] = niit
+    results["sched_se_tax"] = sched_se_tax
+    results["income_tax_after_other_taxes"] = income_tax_after_nonrefundable_credits + medicare_surtax + niit + sched_se_tax
+
+    # Tax after ALL credits (payments)
+    results["income_tax_after_credits"] = array_funcs.py_round(results["income_tax_after_other_taxes"] - actc - eitc, 2)
+
+    results = array_funcs.calc_effective_rates(results["income_tax_after_credits"],
+                                               payroll_taxes,
+                                               results["gross_income"], results)
+
+    if mrate is True:
+        results = _marginal_rates(calc_senate_2018_taxes_batch, taxpayers, policy, results)
+
+    return results
@@ -0,0 +1,477 @@
+"""
+Exact breakpoints of tax as a function of income.
+
+For a fixed household shape (filing status, children and income mix) every
+dollar amount the batch engine calculates is piecewise linear in income.
+Slopes change at bracket thresholds, the EITC and CTC phase-ins and
+phaseouts, the taxable Social Security worksheet and the AMT exemption
+phaseout. The CTC and personal exemption phaseouts round up to whole steps
+with np.ceil, which adds jumps. Between breakpoints the return is linear, so
+the return evaluated at the breakpoints alone gives every value in between by
+linear interpolation.
+
+    curve = breakpoints.household_curve(batch.calc_federal_taxes_batch, taxsim.current_law_policy,
+                                        0, 0, {"ordinary": 1.0, "business": 0.0, "ss": 0.0, "qualified": 0.0},
+                                        25, 250000)
+    curve.income  # breakpoints, ascending, with lo and hi
+    curve.jumps   # (income below, income above) around each cliff
+
+The dollar thresholds of the policy, mapped to income through the
+household's AGI and taxable income, seed the search, so most breakpoints are
+evaluated directly. find_breakpoints then checks every interval between known
+points against two probes at its thirds. When an interval is not linear, the
+line through its left end and first probe is intersected with the line
+through its second probe and right end. If the return at that income lies on
+both lines, the interval has a single kink there ("kink repair"). Parallel
+lines mean a jump, located by bisection to within the resolution. Anything
+else is split at the probes and checked again. Pieces inferred this way are
+checked at their thirds too, and finally each kink is moved onto the
+intersection of the pieces either side. Every round of probes is one batch
+calculation.
+"""
+from collections import OrderedDict, namedtuple
+import math
+
+import numpy as np
+
+from . import array_funcs
+from . import batch
+
+# Results the breakpoints are found for. Every rate graphed is a ratio of two
+# of these or, for marginal rates, a difference of one.
+CURVE_FIELDS = ('gross_income', 'income_tax_after_credits', 'tax_burden', 'tax_wedge', 'cash_income')
+# Results policy thresholds are measured against, mapped back to income to seed the search
+THRESHOLD_BASES = ('gross_income', 'agi', 'taxable_income', 'amt_taxable_income')
+# Phaseouts that round up to whole steps of AGI: (threshold parameter, step
+# parameter or amount, reduction per step parameter, phased out amount parameter)
+STEPPED_PHASEOUTS = (
+    ('ctc_po_threshold', 1000, 'ctc_po_rate', 'ctc_credit'),
+    ('personal_exemption_po_threshold', 'personal_exemption_po_amt', 'personal_exemption_po_rate', None))
+
+# Largest difference in a dollar result treated as rounding, not a change of slope
+DEFAULT_TOLERANCE = 0.05
+# Jumps are located to within this much income
+DEFAULT_RESOLUTION = 0.01
+# Evenly spaced incomes evaluated before the search, so features between
+# policy thresholds are seen too
+DEFAULT_GRID_POINTS = 128
+
+Curve = namedtuple('Curve', ['income', 'values', 'jumps', 'evaluations'])
+Curve.__doc__ = """
+A piecewise linear curve through its breakpoints.
+
+income (array): Breakpoints, ascending. A jump appears as two incomes no more
+    than the resolution apart.
+values (OrderedDict): One array per field, at each breakpoint.
+jumps (list): (income below, income above) around each discontinuity.
+evaluations (int): Incomes the return was evaluated at to find them.
+"""
+
+
+def _line(x0, y0, x1, y1):
+    # (x0, y0, slope) through two points; y0 and the slope are arrays, one entry per field
+    return x0, y0, (y1 - y0) / (x1 - x0)
+
+
+def _on_line(line, x, y, tolerance):
+    if line is None:
+        return False
+    x0, y0, slope = line
+    return bool(np.all(np.abs(y - (y0 + slope * (x - x0))) <= tolerance))
+
+
+def _intersection(left, right, lo, hi, tolerance):
+    # Income where the lines meet, from the field whose slope changes most, or
+    # None for (nearly) parallel lines
+    change = np.abs(left[2] - right[2])
+    field = int(np.argmax(change))
+    if change[field] * (hi - lo) <= tolerance:
+        return None
+    x = (right[1][field] - left[1][field] + left[2][field] * left[0] - right[2][field] * right[0]) / \
+        (left[2][field] - right[2][field])
+    return x if lo < x < hi else None
+
+
+def _search_round(tasks, points, fetch, checked, found, jumps, tolerance, resolution):
+    # One batch of probes for every task. Pieces that pass a check at their
+    # thirds are added to checked, pieces inferred from a bracket to found and
+    # discontinuities to jumps; the tasks still unresolved are returned.
+    # ('interval', a, b): nothing is known between a and b
+    # ('bracket', lo, hi, left, right, settled): the function is on the line
+    # left up to lo and on right from hi, with a single kink or jump between;
+    # settled pieces are linear if that is so
+    probes = []
+    for task in tasks:
+        if task[0] == 'interval':
+            a, b = task[1:3]
+            probes.append((a + (b - a) / 3, a + 2 * (b - a) / 3) if b > a + resolution else ())
+        else:
+            _, a, b, left, right, _ = task
+            if b <= a + resolution:
+                probes.append(())
+            elif left is None:
+                # Rounded-up phaseouts jump just above their thresholds, which are knots
+                probes.append((a + resolution,))
+            else:
+                x = _intersection(left, right, a, b, tolerance) if right is not None else None
+                probes.append((x if x is not None else (a + b) / 2,))
+    fetch([x for task_probes in probes for x in task_probes])
+
+    next_tasks = []
+    for task, task_probes in zip(tasks, probes):
+        if task[0] == 'interval':
+            a, b = task[1:3]
+            if not task_probes:
+                (jumps if np.any(np.abs(points[b] - points[a]) > tolerance + 2 * resolution) else checked).append((a, b))
+                continue
+            p1, p2 = task_probes
+            chord = _line(a, points[a], b, points[b])
+            if _on_line(chord, p1, points[p1], tolerance) and _on_line(chord, p2, points[p2], tolerance):
+                checked.append((a, b))
+                continue
+            head = _line(a, points[a], p2, points[p2])
+            tail = _line(p1, points[p1], b, points[b])
+            if _on_line(head, p1, points[p1], tolerance):
+                next_tasks.append(('bracket', p2, b, head, None, [(a, p2)]))
+            elif _on_line(tail, p2, points[p2], tolerance):
+                next_tasks.append(('bracket', a, p1, None, tail, [(p1, b)]))
+            else:
+                next_tasks.append(('bracket', p1, p2, _line(a, points[a], p1, points[p1]),
+                                   _line(p2, points[p2], b, points[b]), [(a, p1), (p2, b)]))
+            continue
+
+        _, a, b, left, right, settled = task
+        if not task_probes:
+            found.extend(settled)
+            (jumps if np.any(np.abs(points[b] - points[a]) > tolerance + 2 * resolution) else checked).append((a, b))
+            continue
+        x = task_probes[0]
+        on_left = _on_line(left, x, points[x], tolerance)
+        on_right = _on_line(right, x, points[x], tolerance)
+        if on_left and on_right:
+            # A single kink at x
+            found.extend(settled + [(a, x), (x, b)])
+        elif on_left:
+            next_tasks.append(('bracket', x, b, left, right, settled + [(a, x)]))
+        elif on_right:
+            next_tasks.append(('bracket', a, x, left, right, settled + [(x, b)]))
+        else:
+            # More than one feature; check everything again
+            next_tasks.extend(('interval', c, d) for c, d in settled + [(a, x), (x, b)])
+    return next_tasks
+
+
+def _prune(incomes, points, tolerance):
+    # Keep only the incomes where the slope changes or the function jumps
+    kept = [incomes[0]]
+    dropped = []
+    for x, following in zip(incomes[1:-1], incomes[2:]):
+        chord = _line(kept[-1], points[kept[-1]], following, points[following])
+        if all(_on_line(chord, y, points[y], tolerance) for y in dropped + [x]):
+            dropped.append(x)
+        else:
+            kept.append(x)
+            dropped = []
+    kept.append(incomes[-1])
+    return kept
+
+
+def _repair_kinks(kept, jumps, points, fetch, tolerance):
+    # A kink found by bisection is only known to within tolerance. Move each
+    # onto the intersection of the lines through the thirds of the pieces
+    # either side, which is exact when both are linear away from the kink.
+    in_jump = set(x for jump in jumps for x in jump)
+    pieces = [(a, b) for a, b in zip(kept, kept[1:]) if (a, b) not in jumps]
+    thirds = dict(((a, b), (a + (b - a) / 3, a + 2 * (b - a) / 3)) for a, b in pieces)
+    fetch([x for third in thirds.values() for x in third])
+    lines = dict((piece, _line(p1, points[p1], p2, points[p2])) for piece, (p1, p2) in thirds.items())
+    moves = OrderedDict()
+    for i in range(1, len(kept) - 1):
+        left, right = (kept[i - 1], kept[i]), (kept[i], kept[i + 1])
+        if kept[i] in in_jump or left not in lines or right not in lines:
+            continue
+        x = _intersection(lines[left], lines[right], thirds[left][1], thirds[right][0], tolerance)
+        if x is not None and x != kept[i]:
+            moves[i] = x
+    fetch(list(moves.values()))
+    repaired = list(kept)
+    for i, x in moves.items():
+        if _on_line(lines[(kept[i - 1], kept[i])], x, points[x], tolerance) and \
+                _on_line(lines[(kept[i], kept[i + 1])], x, points[x], tolerance):
+            repaired[i] = x
+    return repaired
+
+
+def find_breakpoints(evaluate,
+                     lo,
+                     hi,
+                     knots=(),
+                     tolerance=DEFAULT_TOLERANCE,
+                     resolution=DEFAULT_RESOLUTION):
+    """
+    Find where a piecewise linear function of income changes slope or jumps.
+
+    Args:
+        evaluate (function): Takes an array of incomes and returns a 2D array
+            with one row per income and one column per value.
+        lo (float): Lowest income.
+        hi (float): Highest income.
+        knots (iterable): Incomes to evaluate first, e.g. policy thresholds
+            mapped to income. Knots outside lo and hi are ignored.
+        tolerance (float): Largest difference in any value treated as
+            rounding rather than a change of slope.
+        resolution (float): Jumps are located to within this much income.
+
+    Returns:
+        tuple: (incomes, values, jumps, evaluations). incomes are the
+            breakpoints in ascending order, including lo and hi; values is a
+            2D array of the function at each; jumps and evaluations are as in
+            Curve.
+
+    Raises:
+        ValueError: hi is not greater than lo.
+    """
+    if not hi > lo:
+        raise ValueError("hi must be greater than lo")
+    points = {}
+
+    def fetch(incomes):
+        new = sorted(set(incomes).difference(points))
+        if new:
+            points.update(zip(new, np.asarray(evaluate(np.array(new)), dtype=float)))
+
+    knots = sorted(set([float(lo), float(hi)] + [float(knot) for knot in knots if lo < knot < hi]))
+    fetch(knots)
+    unchecked = list(zip(knots, knots[1:]))
+    checked = []
+    jumps = []
+    while unchecked:
+        # Pieces inferred from a bracket are only assumed linear, so they are
+        # checked at their thirds like everything else before being kept
+        tasks = [('interval', a, b) for a, b in unchecked]
+        unchecked = []
+        while tasks:
+            tasks = _search_round(tasks, points, fetch, checked, unchecked, jumps, tolerance, resolution)
+    kept = _prune(sorted(set(x for segment in checked + jumps for x in segment)), points, tolerance)
+    kept_set = set(kept)
+    jumps = sorted(set(jump for jump in jumps if jump[0] in kept_set and jump[1] in kept_set))
+    kept = _repair_kinks(kept, jumps, points, fetch, tolerance)
+    return np.array(kept), np.array([points[x] for x in kept]), jumps, len(points)
+
+
+def policy_thresholds(policy, filing_status, child_dep):
+    """
+    Get the dollar amounts in a policy that apply to a household.
+
+    Parameters by filing status contribute the household's entry, EITC
+    parameters the entry for its number of children and bracket thresholds
+    only its own schedule's. Rates (1 or less) and unlimited amounts are left
+    out. Where each amount falls depends on what it is measured against; see
+    household_curve.
+
+    Returns:
+        list: Amounts, ascending.
+    """
+    amounts = set()
+    for name, value in policy.items():
+        if name == 'year':
+            continue
+        values = value if isinstance(value, list) else [value]
+        if name in array_funcs.BRACKET_KEYS:
+            if name != array_funcs.BRACKET_KEYS[filing_status]:
+                continue
+        elif name.startswith('eitc'):
+            values = values[min(int(child_dep), len(values) - 1):][:1]
+        elif len(values) == 3:
+            values = [values[filing_status]]
+        amounts.update(amount for amount in values if 1 < amount < float('inf'))
+    return sorted(amounts)
+
+
+def stepped_thresholds(policy, filing_status, child_dep):
+    """
+    Get the AGI above which each step of a rounded-up phaseout is lost, see STEPPED_PHASEOUTS.
+
+    Returns:
+        list: Amounts of AGI, ascending.
+    """
+    amounts = []
+    for threshold, step, rate, phased_out in STEPPED_PHASEOUTS:
+        threshold = array_funcs.by_status(policy[threshold], filing_status)
+        step = policy[step] if isinstance(step, str) else step
+        if not 0 < threshold < float('inf') or not policy[rate] > 0:
+            continue
+        if phased_out is None:
+            # A share of the amount is lost per step
+            steps = math.ceil(1 / policy[rate])
+        else:
+            steps = math.ceil(policy[phased_out] * child_dep / (policy[rate] * step))
+        amounts.extend(float(threshold + i * step) for i in range(steps + 1))
+    return sorted(amounts)
+
+
+def _incomes_at(grid, base, amounts):
+    # Invert a nondecreasing result along the grid with linear interpolation
+    base = np.maximum.accumulate(base)
+    incomes = []
+    for amount in amounts:
+        i = int(np.searchsorted(base, amount))
+        if 0 < i < len(grid) and base[i] > base[i - 1]:
+            incomes.append(grid[i - 1] + (amount - base[i - 1]) * (grid[i] - grid[i - 1]) / (base[i] - base[i - 1]))
+    return incomes
+
+
+def threshold_incomes(calc_function, policy, filing_status, child_dep, income_ratios, grid):
+    """
+    Estimate the incomes at which a household crosses its policy thresholds.
+
+    Each threshold of policy_thresholds and stepped_thresholds is found on a
+    result it applies to (see THRESHOLD_BASES) by interpolating along the grid,
+    so the incomes are only as exact as the grid is fine.
+
+    Args:
+        calc_function (function): calc_federal_taxes_batch or calc_senate_2018_taxes_batch.
+        grid (array): Ascending incomes to calculate and interpolate between.
+
+    Returns:
+        list: Incomes within the grid, unsorted.
+    """
+    results = calc_function(batch.income_sweep(filing_status, child_dep, income_ratios, grid), policy, mrate=False)
+    thresholds = policy_thresholds(policy, filing_status, child_dep)
+    incomes = []
+    for base in THRESHOLD_BASES:
+        incomes.extend(_incomes_at(grid, results[base], thresholds))
+    incomes.extend(_incomes_at(grid, results['agi'], stepped_thresholds(policy, filing_status, child_dep)))
+    return incomes
+
+
+def step_edges(calc_function, policy, filing_status, child_dep, income_ratios, grid, shifts=(),
+               resolution=DEFAULT_RESOLUTION):
+    """
+    Locate the incomes at which a household's AGI crosses each of its stepped_thresholds.
+
+    Taxes jump where AGI crosses a step of a stepped phaseout. A marginal rate
+    taken by increasing a field jumps where the increased return's AGI does
+    too, i.e. where AGI is the step less that increase's effect on AGI. Each
+    crossing is bracketed on the grid, then bisected to within resolution;
+    every round of bisection is one batch calculation.
+
+    Args:
+        calc_function (function): calc_federal_taxes_batch or calc_senate_2018_taxes_batch.
+        grid (array): Ascending incomes to bracket crossings between.
+        shifts (iterable): (taxpayer field, amount) increases whose crossings
+            are found as well, e.g. those of taxsim.MARGINAL_RATE_PERTURBATIONS.
+        resolution (float): Widest a crossing is left bracketed.
+
+    Returns:
+        list: (income below, income above) around each crossing within the
+            grid, unsorted.
+    """
+    amounts = np.array(stepped_thresholds(policy, filing_status, child_dep))
+    if not len(amounts):
+        return []
+    grid = np.asarray(grid, dtype=float)
+    shifts = [(None, 0)] + list(shifts)
+
+    def agi(income, shift):
+        columns = batch.income_sweep(filing_status, child_dep, income_ratios, income)
+        for k, (field, amount) in enumerate(shifts):
+            if field is not None:
+                columns[field] = columns[field] + np.where(shift == k, amount, 0)
+        return np.asarray(calc_function(columns, policy, mrate=False)['agi'], dtype=float)
+
+    # Bracket each amount between the last grid income with AGI at or below it
+    # and the next, under every shift
+    levels = agi(np.tile(grid, len(shifts)), np.repeat(np.arange(len(shifts)), len(grid))).reshape(len(shifts), -1)
+    lo, hi, shift, target = [], [], [], []
+    for k, level in enumerate(levels):
+        i = np.searchsorted(np.maximum.accumulate(level), amounts, side='right')
+        inside = (i > 0) & (i < len(grid))
+        lo.append(grid[i[inside] - 1])
+        hi.append(grid[i[inside]])
+        shift.append(np.full(inside.sum(), k))
+        target.append(amounts[inside])
+    lo, hi, shift, target = (np.concatenate(values) for values in (lo, hi, shift, target))
+
+    while True:
+        wide = hi - lo > resolution
+        if not wide.any():
+            break
+        mid = (lo[wide] + hi[wide]) / 2
+        crossed = agi(mid, shift[wide]) > target[wide]
+        lo[wide] = np.where(crossed, lo[wide], mid)
+        hi[wide] = np.where(crossed, mid, hi[wide])
+    return list(zip(lo.tolist(), hi.tolist()))
+
+
+def household_curve(calc_function,
+                    policy,
+                    filing_status,
+                    child_dep,
+                    income_ratios,
+                    lo,
+                    hi,
+                    fields=CURVE_FIELDS,
+                    tolerance=DEFAULT_TOLERANCE,
+                    resolution=DEFAULT_RESOLUTION,
+                    grid_points=DEFAULT_GRID_POINTS):
+    """
+    Find the breakpoints of a household's taxes between two incomes.
+
+    Args:
+        calc_function (function): calc_federal_taxes_batch or calc_senate_2018_taxes_batch.
+        policy (dict): A set of policy parameters, parsed from CSV.
+        filing_status (int): 0 (single), 1 (married) or 2 (head of household).
+        child_dep (int): Number of children.
+        income_ratios (dict): Share of income that is ordinary, business, ss
+            and qualified income.
+        lo (float): Lowest gross income.
+        hi (float): Highest gross income.
+        fields (iterable): Dollar results to find the breakpoints of.
+        tolerance (float): See find_breakpoints.
+        resolution (float): See find_breakpoints.
+        grid_points (int): Evenly spaced intervals evaluated as well as the
+            policy thresholds.
+
+    Returns:
+        Curve: The breakpoints of every field.
+    """
+    fields = tuple(fields)
+
+    def evaluate(income):
+        results = calc_function(batch.income_sweep(filing_status, child_dep, income_ratios, income), policy, mrate=False)
+        return np.column_stack([results[field] for field in fields])
+
+    grid = np.linspace(lo, hi, grid_points + 1)
+    knots = list(grid) + threshold_incomes(calc_function, policy, filing_status, child_dep, income_ratios, grid)
+
+    income, values, jumps, evaluations = find_breakpoints(evaluate, lo, hi, knots, tolerance, resolution)
+    return Curve(income,
+                 OrderedDict((field, values[:, i]) for i, field in enumerate(fields)),
+                 jumps,
+                 evaluations + len(grid))
+
+
+def rate_incomes(curve, lo, hi, steps):
+    """
+    Get the incomes between which a household's marginal rates are linear.
+
+    A marginal rate over a step of income is (tax(income + step) - tax(income)) / step,
+    so it changes slope at the breakpoints and at each breakpoint less the
+    step. The curve must run to at least hi plus the largest step. Exact for
+    rates whose step is along the curve's income mix, e.g. the ordinary income
+    marginal rate of an ordinary income sweep.
+
+    Args:
+        curve (Curve): See household_curve.
+        lo (float): Lowest income.
+        hi (float): Highest income.
+        steps (iterable): The marginal rate steps, see taxsim.MARGINAL_RATE_PERTURBATIONS.
+
+    Returns:
+        array: Incomes, ascending, including lo and hi.
+    """
+    incomes = [curve.income] + [curve.income - step for step in steps]
+    incomes = np.unique(np.concatenate(incomes + [np.array([lo, hi], dtype=float)]))
+    return incomes[(incomes >= lo) & (incomes <= hi)]
+
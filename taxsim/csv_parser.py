@@ -1,7 +1,7 @@
 from collections import OrderedDict
-import pandas as pd
 import csv
 from . import misc_funcs
+from . import records
 
 
 def load_policy(file_location):
@@ -19,15 +19,21 @@ def load_policy(file_location):
     return policy
 
 
-def load_taxpayers(file_location):
-    taxpayers = []
+def iter_taxpayers(file_location):
+    """
+    Read taxpayers from a CSV file one row at a time.
+
+    Columns that aren't taxpayer fields, such as an id or notes, are ignored.
+    """
     with open(file_location) as csvfile:
         reader = csv.DictReader(csvfile, dialect='excel')
+        fields = [field for field in reader.fieldnames or () if field in records.TAXPAYER_FIELDS]
         for row in reader:
-            for key in row:
-                row[key] = int(row[key])
-            taxpayers.append(row)
-    return taxpayers
+            yield misc_funcs.create_taxpayer((field, int(row[field])) for field in fields)
+
+
+def load_taxpayers(file_location):
+    return list(iter_taxpayers(file_location))
 
 
 def write_results(results_list, results_file):
@@ -41,7 +47,41 @@ def write_results(results_list, results_file):
         print("PermissionError: Results file in use. Please close '" + results_file + "' and try again.")
 
 
+class ResultsWriter(object):
+    """
+    Write results to a CSV file incrementally.
+
+    The header is taken from the keys of the first row written. Use as a
+    context manager so the file is closed when the run ends:
+
+        with ResultsWriter(results_file) as writer:
+            for chunk in chunks:
+                writer.write(calc_chunk(chunk))
+    """
+
+    def __init__(self, results_file):
+        self.csvfile = open(results_file, 'w', newline='')
+        self.writer = None
+
+    def write(self, results_list):
+        for row in results_list:
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.csvfile, fieldnames=list(row.keys()), dialect='excel')
+                self.writer.writeheader()
+            self.writer.writerow(row)
+
+    def close(self):
+        self.csvfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def gen_csv(filename):
+    import pandas as pd
     taxpayers = []
     default_taxpayer = misc_funcs.create_taxpayer()
     taxpayers.append(default_taxpayer)
@@ -1,22 +1,297 @@
+import numpy as np
 import pandas as pd
 import matplotlib
-matplotlib.use('agg', warn=False, force=True)
+matplotlib.use('agg', force=True)
 from matplotlib import pyplot as plt
 from matplotlib.ticker import FuncFormatter
 from collections import OrderedDict
 from tqdm import tqdm
+import filecmp
+import functools
+import hashlib
 import logging
 import json
+import multiprocessing
+import os
+import shutil
+import time
 
 from . import taxsim
 from . import misc_funcs
+from . import records
+from . import csv_parser
+from . import tax_funcs
+from . import batch
+from . import array_funcs
+from . import breakpoints
+from . import adaptive
 
 plt.style.use('ggplot')
 
-with open('average_graphs.json') as infile:
-    average_graphs = json.load(infile)
-with open('marginal_graphs.json') as infile:
-    marginal_graphs = json.load(infile)
+# Graph specifications for each plot type, read when rendering
+GRAPH_FILES = {
+    "average": 'average_graphs.json',
+    "marginal": 'marginal_graphs.json'}
+
+# Policies each graph plots, as (name in graph data file names, policy file, batch calc function)
+GRAPH_POLICIES = (
+    ("current_law", taxsim.CURRENT_LAW_FILE, batch.calc_federal_taxes_batch),
+    ("senate_2018", taxsim.SENATE_2018_FILE, batch.calc_senate_2018_taxes_batch))
+# Modules whose source, along with ENGINE_VERSION and this module's own source
+# (its sampling code and constants), identifies the engine in graph
+# fingerprints: everything graph data is calculated with, from policy parsing
+# and taxpayer fields to the constants taxsim.py gives the batch engine
+ENGINE_MODULES = (taxsim, misc_funcs, records, csv_parser, tax_funcs, batch, array_funcs, breakpoints, adaptive)
+# Most graph data files kept in GRAPH_CACHE_DIR, two per graph; the least
+# recently used beyond this are deleted after each render_graphs
+GRAPH_CACHE_MAX_FILES = 400
+# How a graph's incomes are chosen: every step from start to stop, only the
+# breakpoints of each policy's taxes between them (see breakpoints.py), or
+# more densely where each policy's rates bend or jump (see adaptive.py)
+SAMPLINGS = ("uniform", "breakpoints", "adaptive")
+# Rates adaptive sampling refines until they are within adaptive.DEFAULT_TOLERANCE
+# of linear interpolation between the incomes sampled
+ADAPTIVE_FIELDS = ("avg_effective_tax_rate", "avg_effective_tax_rate_wo_payroll",
+                   "marginal_income_tax_rate", "marginal_business_income_tax_rate")
+# A jump in taxes shows up in marginal rates as a bump MARG_RATE_BOUND wide, so
+# adaptive sampling starts from points no further apart than that, plus the
+# policy thresholds, and its point budget leaves room to refine the longest
+# graphs from there
+ADAPTIVE_MAX_SPACING = taxsim.MARG_RATE_BOUND
+ADAPTIVE_MAX_POINTS = 6000
+# Jumps that aren't step edges, like the self-employment tax starting, are
+# split down to within this much income, as breakpoints locates jumps
+ADAPTIVE_MIN_SPACING = breakpoints.DEFAULT_RESOLUTION
+# Average rates, as the results they are a ratio of. Between breakpoints both
+# are linear, so the rates can be drawn exactly from the breakpoints alone.
+AVERAGE_RATE_PARTS = {
+    "avg_effective_tax_rate": ("tax_wedge", "cash_income"),
+    "avg_effective_tax_rate_wo_payroll": ("income_tax_after_credits", "gross_income")}
+# Incomes an average rate curve is drawn through, besides the breakpoints
+CURVE_PLOT_POINTS = 2000
+
+
+def load_graphs(plot_type):
+    with open(GRAPH_FILES[plot_type]) as infile:
+        return json.load(infile)
+
+
+def graph_taxpayers(filing_status, child_dep, income_ratios, step, start=1, stop=10000):
+    """
+    Build the taxpayers along a graph's income sweep as columns.
+
+    Args:
+        filing_status (int): 0 (single), 1 (married) or 2 (head of household).
+        child_dep (int): Number of children.
+        income_ratios (dict): Share of income that is ordinary, business, ss
+            and qualified income.
+        step (int): Income between points.
+        start (int): First point; its income is start * step.
+        stop (int): Points run up to, but not including, stop * step.
+
+    Returns:
+        OrderedDict: Columnar taxpayers, see batch.as_columns.
+    """
+    return batch.income_sweep(filing_status, child_dep, income_ratios, np.arange(start, stop) * float(step))
+
+
+def engine_fingerprint():
+    """Hash ENGINE_VERSION and the source of ENGINE_MODULES and graph.py; computed once per process."""
+    global _engine_fingerprint
+    if _engine_fingerprint is None:
+        digest = hashlib.sha256(taxsim.ENGINE_VERSION.encode('utf-8'))
+        for path in [module.__file__ for module in ENGINE_MODULES] + [__file__]:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _engine_fingerprint = digest.hexdigest()
+    return _engine_fingerprint
+
+
+_engine_fingerprint = None
+
+
+def graph_fingerprint(filing_status, child_dep, income_ratios, step, start=1, stop=10000, sampling="uniform"):
+    """
+    Get the content address of a graph's data.
+
+    Covers everything the data depends on: the income sweep and how it is
+    sampled, the contents of each GRAPH_POLICIES policy file and the engine.
+    Titles, file names and rate types only change the plot, so they are left
+    out.
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    spec = {'filing_status': filing_status, 'child_dep': child_dep, 'income_ratios': income_ratios,
+            'step': step, 'start': start, 'stop': stop, 'sampling': sampling}
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8'))
+    digest.update(engine_fingerprint().encode('utf-8'))
+    for _, policy_file, _ in GRAPH_POLICIES:
+        with open(taxsim.PARAMS_DIR + policy_file, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def graph_data(filing_status, child_dep, income_ratios, step, start=1, stop=10000, use_cache=True, sampling="uniform"):
+    """
+    Calculate a graph's data under each of GRAPH_POLICIES, or load it from GRAPH_CACHE_DIR.
+
+    With sampling="breakpoints" each policy is calculated only at the
+    breakpoints of its taxes and marginal rates from start * step to
+    (stop - 1) * step (see breakpoints.rate_incomes), so the incomes differ
+    between policies and are not evenly spaced. With sampling="adaptive" each
+    policy is sampled by adaptive.sample on ADAPTIVE_FIELDS instead, which
+    also covers marginal rates taken across the graph's income mix.
+
+    Returns:
+        tuple: (OrderedDict of policy name: graph data CSV path, True if it
+            came from the cache). With use_cache=False the CSVs are written to
+            a fingerprint-named file in GRAPH_CACHE_DIR all the same, so a
+            later cached run can use them.
+
+    Raises:
+        ValueError: sampling is not one of SAMPLINGS.
+    """
+    if sampling not in SAMPLINGS:
+        raise ValueError("sampling must be one of: " + ", ".join(SAMPLINGS))
+    fingerprint = graph_fingerprint(filing_status, child_dep, income_ratios, step, start, stop, sampling)
+    misc_funcs.require_dir(taxsim.GRAPH_CACHE_DIR)
+    paths = OrderedDict((name, taxsim.GRAPH_CACHE_DIR + fingerprint + '-' + name + '.csv')
+                        for name, _, _ in GRAPH_POLICIES)
+    if use_cache and all(os.path.exists(path) for path in paths.values()):
+        # Marked as used, so prune_cache keeps it
+        for path in paths.values():
+            os.utime(path)
+        return paths, True
+
+    # Uniform sampling calculates every income point in one batch per policy;
+    # the sweep is only built for it, and once for all policies
+    taxpayers = None
+    for name, policy_file, batch_calc in GRAPH_POLICIES:
+        policy = csv_parser.load_policy(taxsim.PARAMS_DIR + policy_file)
+        if sampling == "breakpoints":
+            rate_steps = set(perturbation[2] for perturbation in taxsim.MARGINAL_RATE_PERTURBATIONS)
+            curve = breakpoints.household_curve(batch_calc, policy, filing_status, child_dep, income_ratios,
+                                                start * step, (stop - 1) * step + max(rate_steps))
+            logging.info("Found " + str(len(curve.income)) + " " + name + " breakpoints in " +
+                         str(curve.evaluations) + " evaluations")
+            incomes = breakpoints.rate_incomes(curve, start * step, (stop - 1) * step, rate_steps)
+            results = pd.DataFrame(batch_calc(batch.income_sweep(filing_status, child_dep, income_ratios, incomes), policy))
+        elif sampling == "adaptive":
+            results = adaptive_results(batch_calc, policy, filing_status, child_dep, income_ratios,
+                                       start * step, (stop - 1) * step)
+            logging.info("Sampled " + str(len(results)) + " " + name + " incomes adaptively")
+        else:
+            if taxpayers is None:
+                taxpayers = graph_taxpayers(filing_status, child_dep, income_ratios, step, start, stop)
+            results = pd.DataFrame(batch_calc(taxpayers, policy))
+        # Written under a temporary name and renamed, so parallel renders never read a partial file
+        temp_path = paths[name] + '.' + str(os.getpid()) + '.tmp'
+        results.to_csv(temp_path, index=False)
+        os.replace(temp_path, paths[name])
+    return paths, False
+
+
+def adaptive_results(batch_calc, policy, filing_status, child_dep, income_ratios, lo, hi):
+    """
+    Calculate a graph's results at the incomes adaptive.sample picks for ADAPTIVE_FIELDS.
+
+    Sampling starts from the incomes at each policy threshold and at each
+    threshold less every marginal rate step (see breakpoints.threshold_incomes).
+    It also starts from either side of every jump of a stepped phaseout, in
+    the household's taxes and in its marginal rates (see
+    breakpoints.step_edges). Every step edge is then an initial knot, and the
+    curve between knots has no jumps left to miss.
+
+    Args:
+        batch_calc (function): A batch calc function, or a scalar one wrapped
+            with batch.from_scalar.
+
+    Returns:
+        DataFrame: Every result at each sampled income, ascending.
+    """
+    calculated = []
+
+    def evaluate(income):
+        results = pd.DataFrame(batch_calc(batch.income_sweep(filing_status, child_dep, income_ratios, income), policy))
+        results.insert(0, "income", income)
+        calculated.append(results)
+        return results[list(ADAPTIVE_FIELDS)].values
+
+    rate_steps = set(perturbation[2] for perturbation in taxsim.MARGINAL_RATE_PERTURBATIONS)
+    grid = np.linspace(lo, hi + max(rate_steps), breakpoints.DEFAULT_GRID_POINTS + 1)
+    thresholds = breakpoints.threshold_incomes(batch_calc, policy, filing_status, child_dep, income_ratios, grid)
+    edges = breakpoints.step_edges(batch_calc, policy, filing_status, child_dep, income_ratios, grid,
+                                   [perturbation[1:] for perturbation in taxsim.MARGINAL_RATE_PERTURBATIONS])
+    knots = [threshold - rate_step for threshold in thresholds for rate_step in rate_steps] + thresholds
+    knots += [income for edge in edges for income in edge]
+    samples = adaptive.sample(evaluate, lo, hi, max_points=ADAPTIVE_MAX_POINTS, min_spacing=ADAPTIVE_MIN_SPACING,
+                              max_spacing=ADAPTIVE_MAX_SPACING, knots=knots)
+    if not samples.converged:
+        # Either the point budget ran out or there is a jump step_edges doesn't know of
+        logging.warning("Adaptive sampling left some rates further than tolerance from linear between samples")
+    results = pd.concat(calculated, ignore_index=True).sort_values("income", kind="mergesort")
+    return results.drop(columns="income").reset_index(drop=True)
+
+
+def prune_cache(max_files=GRAPH_CACHE_MAX_FILES):
+    """
+    Delete the least recently used graph data in GRAPH_CACHE_DIR beyond max_files.
+
+    Returns:
+        int: Files deleted.
+    """
+    try:
+        names = [name for name in os.listdir(taxsim.GRAPH_CACHE_DIR) if name.endswith('.csv')]
+    except OSError:
+        return 0
+    used = []
+    for name in names:
+        try:
+            used.append((os.path.getmtime(taxsim.GRAPH_CACHE_DIR + name), name))
+        except OSError:
+            # Pruned by another process
+            pass
+    used.sort(reverse=True)
+    deleted = 0
+    for _, name in used[max_files:]:
+        try:
+            os.remove(taxsim.GRAPH_CACHE_DIR + name)
+            deleted += 1
+        except OSError:
+            pass
+    return deleted
+
+
+def publish(cached_path, path):
+    """Copy cached graph data to its results path, unless an identical file is already there."""
+    if not (os.path.exists(path) and filecmp.cmp(cached_path, path, shallow=False)):
+        shutil.copyfile(cached_path, path)
+
+
+def plot_rates(ax, df, graph_rate_type, drawstyle, sampling, label):
+    """
+    Plot one policy's rates from its graph data.
+
+    Uniformly sampled data is drawn point to point. Data sampled at
+    breakpoints is drawn exactly: marginal rates are linear between them, and
+    average rates are the ratio of two results that are linear between them,
+    interpolated at CURVE_PLOT_POINTS incomes. Adaptively sampled data is
+    drawn as straight lines between its points, which is what it was refined
+    to be within tolerance of.
+    """
+    if sampling == "uniform":
+        ax.plot(df["gross_income"], df[graph_rate_type], drawstyle=drawstyle, label=label)
+    elif sampling == "breakpoints" and graph_rate_type in AVERAGE_RATE_PARTS:
+        income = df["gross_income"].values
+        numerator, denominator = AVERAGE_RATE_PARTS[graph_rate_type]
+        curve_income = np.union1d(income, np.linspace(income[0], income[-1], CURVE_PLOT_POINTS))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.interp(curve_income, income, df[numerator].values) / \
+                np.interp(curve_income, income, df[denominator].values)
+        ax.plot(curve_income, rates, label=label)
+    else:
+        ax.plot(df["gross_income"], df[graph_rate_type], label=label)
 
 
 def make_graph(main_income_type,
@@ -28,60 +303,25 @@ def make_graph(main_income_type,
                step,
                start=1,
                stop=10000,
-               rate_type="average"):
-
-    current_law_result_list = []
-    #house_2018_result_list = []
-    senate_2018_result_list = []
-
-    for i in range(start, stop):
-        income = i * step
-        default_taxpayer = misc_funcs.create_taxpayer()
-        default_taxpayer['filing_status'] = filing_status
-        default_taxpayer['child_dep'] = child_dep
-        default_taxpayer['ordinary_income1'] = income * income_ratios["ordinary"]
-        default_taxpayer['business_income'] = income * income_ratios["business"]
-        default_taxpayer['ss_income'] = income * income_ratios["ss"]
-        default_taxpayer['qualified_income'] = income * income_ratios["qualified"]
-
-        current_law_result = taxsim.calc_federal_taxes(
-            default_taxpayer, taxsim.current_law_policy)
-        current_law_result_list.append(current_law_result)
-
-        '''
-        house_2018_result = taxsim.calc_house_2018_taxes(
-            default_taxpayer, taxsim.house_2018_policy)
-        house_2018_result_list.append(house_2018_result)
-        '''
-
-        senate_2018_result = taxsim.calc_senate_2018_taxes(
-            default_taxpayer, taxsim.senate_2018_policy)
-        senate_2018_result_list.append(senate_2018_result)
-
-    current_law_df = pd.DataFrame(current_law_result_list)
-    '''
-    house_2018_df = pd.DataFrame(house_2018_result_list)
-    '''
-    senate_2018_df = pd.DataFrame(senate_2018_result_list)
-
-    # Save CSVs
-    current_law_df.to_csv(
-        taxsim.GRAPH_DATA_RESULTS_DIR +
-        file_name +
-        '-current_law_graph_data.csv',
-        index=False)
-    '''
-    house_2018_df.to_csv(
-        taxsim.GRAPH_DATA_RESULTS_DIR +
-        file_name +
-        '-house_2018_graph_data.csv',
-        index=False)
-    '''
-    senate_2018_df.to_csv(
-        taxsim.GRAPH_DATA_RESULTS_DIR +
-        file_name +
-        '-senate_2018_graph_data.csv',
-        index=False)
+               rate_type="average",
+               use_cache=True,
+               sampling="uniform"):
+    """
+    Save a graph's data CSVs to GRAPH_DATA_RESULTS_DIR and its plot to RESULTS_DIR.
+
+    Args:
+        sampling (str): One of SAMPLINGS, see graph_data.
+
+    Returns:
+        bool: True if the data came from the graph data cache.
+    """
+    # House 2018 is no longer graphed. calc_house_2018_taxes has no batch version,
+    # but batch.from_scalar makes one that can be added to GRAPH_POLICIES.
+    paths, cached = graph_data(filing_status, child_dep, income_ratios, step, start, stop, use_cache, sampling)
+    for name, cached_path in paths.items():
+        publish(cached_path, taxsim.GRAPH_DATA_RESULTS_DIR + file_name + '-' + name + '_graph_data.csv')
+    current_law_df = pd.read_csv(paths["current_law"])
+    senate_2018_df = pd.read_csv(paths["senate_2018"])
 
     filing_status_string = "Single"
     if filing_status == 1:
@@ -119,11 +359,7 @@ def make_graph(main_income_type,
     ax.xaxis.set_major_formatter(FuncFormatter('${:,.0f}'.format))
 
     # Current Law
-    ax.plot(
-        current_law_df["gross_income"],
-        current_law_df[graph_rate_type],
-        drawstyle=drawstyle_string,
-        label='Pre-TCJA')
+    plot_rates(ax, current_law_df, graph_rate_type, drawstyle_string, sampling, 'Pre-TCJA')
     '''
     # House 2018 Proposal
     ax.plot(
@@ -133,11 +369,7 @@ def make_graph(main_income_type,
         label='House 2018 Proposal')
     '''
     # Senate 2018 Proposal
-    ax.plot(
-        senate_2018_df["gross_income"],
-        senate_2018_df[graph_rate_type],
-        drawstyle=drawstyle_string,
-        label='TCJA')
+    plot_rates(ax, senate_2018_df, graph_rate_type, drawstyle_string, sampling, 'TCJA')
 
     ax.legend(loc='upper left')
     ax.set_title(
@@ -153,25 +385,98 @@ def make_graph(main_income_type,
     fig.set_size_inches(12, 6)
     fig.savefig(taxsim.RESULTS_DIR + file_name + ".png", dpi=100)
     # plt.show()  # Uncomment to debug plots
+    # Release the figure; pyplot keeps every open figure alive otherwise
+    plt.close(fig)
+    return cached
+
+
+def render_graph(graph, use_cache=True):
+    """
+    Render one graph from its specification.
+
+    Args:
+        graph (dict): A graph from average_graphs.json or marginal_graphs.json.
+        use_cache (bool): Reuse cached graph data, see graph_data.
+
+    Returns:
+        tuple: (file name, seconds taken, True if the data was cached).
+    """
+    start_time = time.perf_counter()
+    logging.info("Rendering: " + graph["file_name"])
+    cached = make_graph(graph["main_income_type"],
+                        graph["file_name"],
+                        graph["filing_status"],
+                        graph["child_dep"],
+                        graph["income_ratios"],
+                        graph["payroll"],
+                        graph["step"],
+                        graph["start"],
+                        graph["stop"],
+                        graph["rate_type"],
+                        use_cache,
+                        graph.get("sampling", "uniform"))
+    return graph["file_name"], time.perf_counter() - start_time, cached
+
+
+def _init_worker():
+    # Each worker renders off-screen with its own Agg backend
+    matplotlib.use('agg', force=True)
 
 
-def render_graphs(plot_type):
-    logging.info("Begining graph calculations. This should reasonably take 1-5 seconds per graph.")
-
-    if plot_type == "marginal":
-        graphs = marginal_graphs
-    elif plot_type == "average":
-        graphs = average_graphs
-
-    for graph in tqdm(graphs, desc='Rendering graphs', unit='graph'):
-        logging.info("Rendering: " + graph["file_name"])
-        make_graph(graph["main_income_type"],
-                   graph["file_name"],
-                   graph["filing_status"],
-                   graph["child_dep"],
-                   graph["income_ratios"],
-                   graph["payroll"],
-                   graph["step"],
-                   graph["start"],
-                   graph["stop"],
-                   graph["rate_type"])
+def render_graphs(plot_type, jobs=1, use_cache=True):
+    """
+    Render every graph of a plot type, reporting how long each took.
+
+    Graph data whose specification, policy files and engine are unchanged
+    since an earlier run is loaded from GRAPH_CACHE_DIR instead of being
+    recalculated; every graph is still plotted. Afterwards the cache is
+    pruned to GRAPH_CACHE_MAX_FILES, see prune_cache.
+
+    Args:
+        plot_type (str): "average" or "marginal", see GRAPH_FILES.
+        jobs (int): Worker processes to spread the graphs across.
+        use_cache (bool): Reuse cached graph data. Recalculate everything if False.
+
+    Returns:
+        list: (file name, seconds taken, True if the data was cached) for each
+            graph, in the order they finished.
+    """
+    logging.info("Begining graph calculations. This should reasonably take well under a second per graph.")
+
+    graphs = load_graphs(plot_type)
+    misc_funcs.require_dir(taxsim.GRAPH_DATA_RESULTS_DIR)
+    jobs = max(1, min(jobs, len(graphs)))
+
+    start_time = time.perf_counter()
+    timings = []
+    pool = None
+    if jobs == 1:
+        rendered = map(functools.partial(render_graph, use_cache=use_cache), graphs)
+    else:
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker)
+        rendered = pool.imap_unordered(functools.partial(render_graph, use_cache=use_cache), graphs)
+    try:
+        for file_name, seconds, cached in tqdm(rendered, total=len(graphs), desc='Rendering graphs', unit='graph'):
+            logging.info("Rendered " + file_name + " in " + "{:.2f}".format(seconds) + "s" + (" from cached data" if cached else ""))
+            timings.append((file_name, seconds, cached))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - start_time
+
+    slowest = max(timings, key=lambda timing: timing[1]) if timings else ("none", 0)
+    report = "Rendered {count} graphs ({cached} from cached data) in {elapsed:.2f}s ({total:.2f}s of graph time, slowest {name} at {slowest:.2f}s, {jobs} job(s))".format(
+        count=len(timings),
+        cached=sum(1 for timing in timings if timing[2]),
+        elapsed=elapsed,
+        total=sum(timing[1] for timing in timings),
+        name=slowest[0],
+        slowest=slowest[1],
+        jobs=jobs)
+    logging.info(report)
+    print(report)
+    pruned = prune_cache()
+    if pruned:
+        logging.info("Deleted " + str(pruned) + " least recently used graph data files from the cache")
+    return timings
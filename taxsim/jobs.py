@@ -0,0 +1,356 @@
+"""
+Local background job queue for calculations too long for one HTTP request.
+
+A JobQueue runs job functions in a process pool on this machine. Each job
+writes its output to a file in the queue's directory and keeps its status
+(state and progress) in a small JSON file next to it. Status is read from
+these files rather than from memory, so every JobQueue on the same directory,
+e.g. one per pre-fork server worker, sees every job, whichever worker it was
+submitted to.
+
+The limits are per directory too. submit() counts unfinished jobs from the
+status files while holding a lock file, and a job only starts running once
+it holds one of max_running slot files, so each worker's pool can't add its
+own max_running. Both are flock()ed, so a process that dies releases them;
+where fcntl is missing (Windows) the limits are per JobQueue.
+
+    queue = jobs.JobQueue('./results/jobs/', max_running=2, max_queued=8)
+    job_id = queue.submit(calc_rows, (rows,), total=len(rows))
+    queue.status(job_id)  # {'id': ..., 'state': 'running', 'done': 3000, 'total': 100000, ...}
+    queue.result_path(job_id)  # once state is 'done'
+
+A job function is called as function(*args, output_path=..., report=...). It
+writes its output to output_path and calls report(done) as it goes.
+
+Finished jobs are deleted, files and all, ttl seconds after they finish, and
+the oldest are deleted early when more than max_finished have piled up.
+Cleanup runs on each submit.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import misc_funcs
+
+STATES = ('queued', 'running', 'done', 'failed')
+# Seconds a finished job's status and result are kept
+DEFAULT_TTL = 24 * 3600
+# Most finished jobs kept; the oldest are deleted first
+DEFAULT_MAX_FINISHED = 100
+# Fields of a status file returned by JobQueue.status, in order
+STATUS_FIELDS = ('id', 'state', 'done', 'total', 'submitted', 'error')
+# Ids made by submit; anything else can't name a job's files
+JOB_ID = re.compile('[0-9a-f]{32}$')
+# Seconds a queued job waits between tries for a free running slot
+SLOT_POLL_INTERVAL = 0.05
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_running + max_queued jobs are unfinished."""
+
+
+def write_status(path, status):
+    """Atomically replace a job's status file."""
+    # The pool process and the submitting process may both write a status
+    temp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(temp_path, path)
+
+
+def read_status(path):
+    """Get a job's status as an OrderedDict, or None if there is no such job."""
+    try:
+        with open(path) as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+    except (OSError, ValueError):
+        return None
+
+
+def finish_status(status, error=None):
+    status['state'] = 'failed' if error is not None else 'done'
+    if error is None:
+        status['done'] = status['total']
+    else:
+        status['error'] = str(error) or type(error).__name__
+    status['finished'] = time.time()
+    return status
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive flock on path, created if missing, for the with block."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def take_slot(slot_paths):
+    """Get an open, flocked slot file, or None if every slot is held."""
+    for path in slot_paths:
+        f = open(path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except OSError:
+            f.close()
+    return None
+
+
+def run_job(function, args, output_path, status_path, slot_paths):
+    # Runs in a pool process. Output goes to a temporary file that is renamed
+    # when complete, so a result file is never seen half written.
+    slot = None
+    while fcntl is not None and slot is None:
+        slot = take_slot(slot_paths)
+        if slot is None:
+            if not os.path.exists(status_path):
+                return
+            time.sleep(SLOT_POLL_INTERVAL)
+    try:
+        _run_job(function, args, output_path, status_path)
+    finally:
+        if slot is not None:
+            slot.close()
+
+
+def _run_job(function, args, output_path, status_path):
+    status = read_status(status_path)
+    if status is None:
+        # Forgotten while queued
+        return
+    status['state'] = 'running'
+    write_status(status_path, status)
+
+    def report(done):
+        status['done'] = done
+        write_status(status_path, status)
+
+    temp_path = output_path + '.part'
+    try:
+        function(*args, output_path=temp_path, report=report)
+        os.replace(temp_path, output_path)
+    except BaseException as e:
+        write_status(status_path, finish_status(status, e))
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    write_status(status_path, finish_status(status))
+
+
+class JobQueue(object):
+    """
+    Runs jobs in a local process pool, at most max_running at once.
+
+    Args:
+        directory (str): Where status and result files are written. Created
+            on first use.
+        max_running (int): Jobs run at once by all JobQueues on directory;
+            also the size of each one's process pool.
+        max_queued (int): Jobs waiting to run. submit() raises QueueFull
+            beyond this.
+        ttl (float): Seconds a finished job is kept.
+        max_finished (int): Most finished jobs kept.
+    """
+
+    def __init__(self, directory, max_running=2, max_queued=8, ttl=DEFAULT_TTL, max_finished=DEFAULT_MAX_FINISHED):
+        if max_running < 1:
+            raise ValueError("max_running must be at least 1")
+        self.directory = directory
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._futures = OrderedDict()  # id: Future, for jobs unfinished in this process's pool
+        self._slot_paths = [os.path.join(directory, '.running-' + str(i) + '.lock') for i in range(max_running)]
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # Created on first use, and again in a forked child, which can't use
+        # its parent's pool. Pool processes are spawned, not forked, as
+        # forking a threaded server worker can copy another thread's held locks.
+        if self._pid != os.getpid():
+            self._pool = ProcessPoolExecutor(self.max_running, mp_context=multiprocessing.get_context('spawn'))
+            self._pid = os.getpid()
+            self._futures.clear()
+        return self._pool
+
+    def _path(self, job_id, suffix):
+        if not JOB_ID.match(job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.directory, job_id + suffix)
+
+    def _statuses(self):
+        # Every job's status, read from its file
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        statuses = []
+        for name in names:
+            job_id, suffix = os.path.splitext(name)
+            if suffix != '.status' or not JOB_ID.match(job_id):
+                continue
+            status = read_status(os.path.join(self.directory, name))
+            if status is not None:
+                statuses.append(status)
+        return statuses
+
+    def unfinished(self):
+        """Number of jobs queued or running in every JobQueue on this directory."""
+        return sum(1 for status in self._statuses() if status['state'] not in ('done', 'failed'))
+
+    def submit(self, function, args, total):
+        """
+        Queue a job.
+
+        Args:
+            function (function): A module level job function, see the module docstring.
+            args (tuple): Arguments for function; they are pickled to the pool.
+            total (int): Units of work in the job, for progress reporting.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            QueueFull: Too many jobs are unfinished.
+        """
+        self.cleanup()
+        misc_funcs.require_dir(self.directory)
+        with self._lock:
+            executor = self._executor()
+            # Counted and claimed under the lock, so concurrent submits on other
+            # workers can't both take the last place
+            with locked(os.path.join(self.directory, '.queue.lock')):
+                if self.unfinished() >= self.max_running + self.max_queued:
+                    raise QueueFull("Too many unfinished jobs")
+                job_id = uuid.uuid4().hex
+                status_path = self._path(job_id, '.status')
+                write_status(status_path, OrderedDict([('id', job_id), ('state', 'queued'), ('done', 0),
+                                                       ('total', total), ('submitted', time.time())]))
+            future = executor.submit(run_job, function, args, self._path(job_id, '.ndjson'), status_path,
+                                     self._slot_paths)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda future: self._job_ended(job_id, future))
+        return job_id
+
+    def _job_ended(self, job_id, future):
+        with self._lock:
+            if self._futures.get(job_id) is future:
+                del self._futures[job_id]
+        if future.cancelled() or future.exception() is None:
+            return
+        # run_job records its own failures; this catches a pool process that died
+        status_path = self._path(job_id, '.status')
+        status = read_status(status_path)
+        if status is not None and status['state'] not in ('done', 'failed'):
+            write_status(status_path, finish_status(status, future.exception()))
+
+    def _read(self, job_id):
+        status = read_status(self._path(job_id, '.status'))
+        if status is None:
+            raise KeyError(job_id)
+        return status
+
+    def status(self, job_id):
+        """
+        Get a job's state and progress.
+
+        Returns:
+            OrderedDict: id, state (one of STATES), done, total, submitted (a
+                Unix time) and, for failed jobs, error.
+
+        Raises:
+            KeyError: No such job.
+        """
+        status = self._read(job_id)
+        return OrderedDict((field, status[field]) for field in STATUS_FIELDS if field in status)
+
+    def result_path(self, job_id):
+        """
+        Get the result file of a finished job.
+
+        Returns:
+            str: The path, or None if the job has not finished successfully.
+
+        Raises:
+            KeyError: No such job.
+        """
+        if self._read(job_id)['state'] != 'done':
+            return None
+        return self._path(job_id, '.ndjson')
+
+    def forget(self, job_id):
+        """
+        Cancel a job if it has not started, and delete its files and status.
+
+        Returns:
+            bool: False if the job is running and was left alone.
+
+        Raises:
+            KeyError: No such job.
+        """
+        status = self._read(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if status['state'] == 'running':
+            return False
+        if future is not None:
+            future.cancel()
+        # A queued job already in a pool process, here or on another worker,
+        # finds its status gone and doesn't run
+        self._delete(job_id)
+        return True
+
+    def _delete(self, job_id):
+        for suffix in ('.status', '.ndjson', '.ndjson.part'):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except OSError:
+                pass
+
+    def cleanup(self, now=None):
+        """
+        Delete finished jobs more than ttl seconds old, then the oldest beyond
+        max_finished. Unfinished jobs whose status hasn't changed in ttl
+        seconds were lost with the worker running them, and are deleted too,
+        so they stop counting against the limits.
+
+        Returns:
+            int: Jobs deleted.
+        """
+        now = time.time() if now is None else now
+        finished = []
+        expired = []
+        for status in self._statuses():
+            if status['state'] in ('done', 'failed'):
+                finished.append((status['finished'], status['id']))
+                continue
+            try:
+                if now - os.path.getmtime(self._path(status['id'], '.status')) > self.ttl:
+                    expired.append(status['id'])
+            except OSError:
+                pass
+        finished.sort(reverse=True)
+        expired += [job_id for i, (ended, job_id) in enumerate(finished)
+                    if now - ended > self.ttl or i >= self.max_finished]
+        for job_id in expired:
+            self._delete(job_id)
+        return len(expired)
@@ -1,65 +1,73 @@
 from . import taxsim
 from . import misc_funcs
+from . import result_cache
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import math
+import logging
 from tqdm import tqdm
 
 
+# Single-filer sub-returns repeat across the number of children, so every
+# child count is calculated for each cell before moving on to the next one
+RESULT_CACHE_SIZE = 256
+
+
 def gen_datasets():
     print("Generating datasets")
     policies = [
         (taxsim.calc_senate_2018_taxes, taxsim.senate_2018_policy, "tcja"),
         (taxsim.calc_federal_taxes, taxsim.current_law_policy, "pre-tcja")
     ]
+    PERCENTAGE_PRECISION = 4
+    INCOME_UPPER_BOUND = 6
+    INCOME_LOWER_BOUND = 4
+    DATASET_SIZE = 400  # aka the resolution (default 400)
+    CHILDREN_RANGE = range(0, 3)
+
+    misc_funcs.require_dir(taxsim.MARRIAGE_PENALTY_RESULTS_DIR)
+    cache = result_cache.ResultCache(maxsize=RESULT_CACHE_SIZE)
     for tax_calc_function, policy_object, name in tqdm(policies):
-        for CHILDREN in tqdm(range(0, 3), leave=False):
 
-            PERCENTAGE_PRECISION = 4
-            INCOME_UPPER_BOUND = 6
-            INCOME_LOWER_BOUND = 4
-            DATASET_SIZE = 400  # aka the resolution (default 400)
+        def tax_burden(taxpayer):
+            return cache.calc(tax_calc_function, taxpayer, policy_object, mrate=False)['tax_burden']
 
-            list_of_columns = []
-            # This loop is for horizontal rows
-            for total_income in tqdm(np.logspace(INCOME_LOWER_BOUND, INCOME_UPPER_BOUND, num=DATASET_SIZE, base=10, dtype='int', endpoint=True), leave=False):
-                total_income = float(total_income)
-                column = []
+        list_of_columns = {CHILDREN: [] for CHILDREN in CHILDREN_RANGE}
+        # This loop is for horizontal rows
+        for total_income in tqdm(np.logspace(INCOME_LOWER_BOUND, INCOME_UPPER_BOUND, num=DATASET_SIZE, base=10, dtype='int', endpoint=True), leave=False):
+            total_income = float(total_income)
+            column = {CHILDREN: [] for CHILDREN in CHILDREN_RANGE}
 
-                # This loop is for vertical columns
-                for i in range(0, DATASET_SIZE):
+            # This loop is for vertical columns
+            for i in range(0, DATASET_SIZE):
 
-                    # Split incomes
-                    ratio = (i / (DATASET_SIZE - 1)) / 2  # Ratios range from 0.0 to 0.5
-                    income1 = total_income * (1 - ratio)
-                    income2 = total_income * ratio
-                    assert math.isclose(income1 + income2, total_income)  # Helpful, but optional
+                # Split incomes
+                ratio = (i / (DATASET_SIZE - 1)) / 2  # Ratios range from 0.0 to 0.5
+                income1 = total_income * (1 - ratio)
+                income2 = total_income * ratio
+                assert math.isclose(income1 + income2, total_income)  # Helpful, but optional
 
+                for CHILDREN in CHILDREN_RANGE:
                     # Create married taxpayer
                     married_taxpayer = misc_funcs.create_taxpayer()
                     married_taxpayer['filing_status'] = 1
                     married_taxpayer['child_dep'] = CHILDREN
                     married_taxpayer['ordinary_income1'] = income1
                     married_taxpayer['ordinary_income2'] = income2
-                    married_results = tax_calc_function(married_taxpayer, policy_object, mrate=False)
-
-                    married_tax_burden = married_results['tax_burden']
+                    married_tax_burden = tax_burden(married_taxpayer)
 
                     # Create single taxpayers
                     if CHILDREN == 0:
                         single_taxpayer1_nokids = misc_funcs.create_taxpayer()
                         single_taxpayer1_nokids['filing_status'] = 0
                         single_taxpayer1_nokids['ordinary_income1'] = income1
-                        single_result1 = tax_calc_function(single_taxpayer1_nokids, policy_object, mrate=False)
 
                         single_taxpayer2_nokids = misc_funcs.create_taxpayer()
                         single_taxpayer2_nokids['filing_status'] = 0
                         single_taxpayer2_nokids['ordinary_income1'] = income2
-                        single_result2 = tax_calc_function(single_taxpayer2_nokids, policy_object, mrate=False)
 
-                        unmarried_tax_burden = single_result1['tax_burden'] + single_result2['tax_burden']
+                        unmarried_tax_burden = tax_burden(single_taxpayer1_nokids) + tax_burden(single_taxpayer2_nokids)
                     # Separate logic if taxpayers have kids
                     else:
                         # Option A (Child with 1st taxpayer)
@@ -67,28 +75,24 @@ def gen_datasets():
                         single_taxpayer1['filing_status'] = 2
                         single_taxpayer1['ordinary_income1'] = income1
                         single_taxpayer1['child_dep'] = CHILDREN
-                        single_result1 = tax_calc_function(single_taxpayer1, policy_object, mrate=False)
 
                         single_taxpayer2 = misc_funcs.create_taxpayer()
                         single_taxpayer2['filing_status'] = 0
                         single_taxpayer2['ordinary_income1'] = income2
-                        single_result2 = tax_calc_function(single_taxpayer2, policy_object, mrate=False)
 
-                        option_a = single_result1['tax_burden'] + single_result2['tax_burden']
+                        option_a = tax_burden(single_taxpayer1) + tax_burden(single_taxpayer2)
 
                         # Option B (Child with 2nd taxpayer)
                         single_taxpayer3 = misc_funcs.create_taxpayer()
                         single_taxpayer3['filing_status'] = 0
                         single_taxpayer3['ordinary_income1'] = income1
-                        single_result3 = tax_calc_function(single_taxpayer3, policy_object, mrate=False)
 
                         single_taxpayer4 = misc_funcs.create_taxpayer()
                         single_taxpayer4['filing_status'] = 2
                         single_taxpayer4['ordinary_income1'] = income2
                         single_taxpayer4['child_dep'] = CHILDREN
-                        single_result4 = tax_calc_function(single_taxpayer4, policy_object, mrate=False)
 
-                        option_b = single_result3['tax_burden'] + single_result4['tax_burden']
+                        option_b = tax_burden(single_taxpayer3) + tax_burden(single_taxpayer4)
 
                         if CHILDREN == 2:
                             # Option C (Children split evenly)
@@ -96,15 +100,13 @@ def gen_datasets():
                             single_taxpayer5['filing_status'] = 2
                             single_taxpayer5['ordinary_income1'] = income1
                             single_taxpayer5['child_dep'] = 1
-                            single_result5 = tax_calc_function(single_taxpayer5, policy_object, mrate=False)
 
                             single_taxpayer6 = misc_funcs.create_taxpayer()
                             single_taxpayer6['filing_status'] = 2
                             single_taxpayer6['ordinary_income1'] = income2
                             single_taxpayer6['child_dep'] = 1
-                            single_result6 = tax_calc_function(single_taxpayer6, policy_object, mrate=False)
 
-                            option_c = single_result5['tax_burden'] + single_result6['tax_burden']
+                            option_c = tax_burden(single_taxpayer5) + tax_burden(single_taxpayer6)
                         else:
                             option_c = option_b
 
@@ -116,23 +118,30 @@ def gen_datasets():
 
                     penalty_percent = round(penalty_percent, PERCENTAGE_PRECISION)
 
-                    column.append(penalty_percent)
+                    column[CHILDREN].append(penalty_percent)
 
-                list_of_columns.append(column)
+            for CHILDREN in CHILDREN_RANGE:
+                list_of_columns[CHILDREN].append(column[CHILDREN])
 
-            df = pd.DataFrame(list_of_columns)
+        for CHILDREN in CHILDREN_RANGE:
+            df = pd.DataFrame(list_of_columns[CHILDREN])
             df = df.transpose()
-            df.to_csv("results/marriage_penalty/" + name + "_" + str(CHILDREN) + "children.csv", index=False, header=False)
+            df.to_csv(taxsim.MARRIAGE_PENALTY_RESULTS_DIR + name + "_" + str(CHILDREN) + "children.csv", index=False, header=False)
+        logging.info("Marriage penalty result cache for " + name + ": " + str(cache.info()))
 
 
 def plot_datasets():
+    import matplotlib
+    matplotlib.use('agg', force=True)
+    import matplotlib.pyplot as plt
+
     print("Plotting datasets")
     policy_names = ["tcja", "pre-tcja", "diff"]
 
     for policy in tqdm(policy_names):
         for children in tqdm(range(0, 3), leave=False):
 
-            filename = "results/marriage_penalty/" + policy + "_" + str(children) + "children"
+            filename = taxsim.MARRIAGE_PENALTY_RESULTS_DIR + policy + "_" + str(children) + "children"
 
             data = pd.read_csv(filename + ".csv")
 
@@ -0,0 +1,171 @@
+"""
+Counters, gauges and histograms rendered in the Prometheus text format.
+
+Just enough of a metrics client to export request counts and latencies from
+the API without adding a dependency. Updates take a lock and a dict lookup,
+cheap enough to leave on in production.
+
+    registry = metrics.Registry()
+    requests = registry.counter('requests_total', "Requests handled.", ['status'])
+    latency = registry.histogram('request_duration_seconds', "Request latency.")
+    requests.inc('200')
+    latency.observe(0.004)
+    registry.render()  # text for a /metrics endpoint
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+import threading
+
+# Upper bounds in seconds, from 100us (a cached response) to 2.5s (a large batch)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def format_labels(names, values, extra=()):
+    """Format label names and values as {name="value",...}, or '' if there are none."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(name + '="' + value + '"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+    Base class for a metric with a fixed set of label names.
+
+    Args:
+        name (str): Metric name, e.g. 'taxcalc_requests_total'.
+        documentation (str): Help text.
+        labelnames (iterable): Label names; every update gives one value per name.
+    """
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = OrderedDict()  # label values: value
+        self._lock = threading.Lock()
+
+    def _check(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(self.name + " takes labels " + ", ".join(self.labelnames))
+        return tuple(str(value) for value in labelvalues)
+
+    def samples(self):
+        """Yield (name suffix, label values, extra labels, value) for each sample."""
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield '', labelvalues, (), value
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.documentation,
+                 '# TYPE ' + self.name + ' ' + self.type_name]
+        for suffix, labelvalues, extra, value in self.samples():
+            lines.append(self.name + suffix + format_labels(self.labelnames, labelvalues, extra) + ' ' + format_value(value))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """A count that only goes up, e.g. requests handled."""
+    type_name = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        labelvalues = self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def set_total(self, value, *labelvalues):
+        """
+        Set the count to a total kept elsewhere, e.g. a cache's hits.
+
+        The total must only go up, as a counter does, except when whatever
+        keeps it starts over.
+        """
+        labelvalues = self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def value(self, *labelvalues):
+        with self._lock:
+            return self._values.get(self._check(labelvalues), 0)
+
+
+class Gauge(Metric):
+    """A value that is set, e.g. the current size of a cache."""
+    type_name = 'gauge'
+
+    def set(self, value, *labelvalues):
+        labelvalues = self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram(Metric):
+    """
+    Observations counted into cumulative buckets, e.g. request latencies.
+
+    Args:
+        buckets (iterable): Increasing bucket upper bounds. A +Inf bucket is
+            always added.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, *labelvalues):
+        labelvalues = self._check(labelvalues)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                # [count per bucket (not cumulative), sum]
+                entry = self._values[labelvalues] = [[0] * len(self.buckets), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._values.items()]
+        for labelvalues, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', labelvalues, (('le', format_value(bound)),), cumulative
+            yield '_sum', labelvalues, (), total
+            yield '_count', labelvalues, (), cumulative
+
+
+class Registry(object):
+    """The metrics exported together by one endpoint, in registration order."""
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Duplicate metric: " + metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        return ''.join(metric.render() for metric in self.metrics.values())
@@ -0,0 +1,178 @@
+"""
+Micro-batching of concurrent scalar calculations.
+
+A server handling many small requests at once spends much of its time in
+per-call interpreter overhead. A MicroBatcher holds concurrent submissions for
+up to max_wait seconds (or until max_batch_size have arrived), runs each
+calc function and policy they ask for once over all of them and hands each
+caller its own rows.
+
+    batcher = microbatch.MicroBatcher(max_batch_size=64, max_wait=0.002)
+    calcs = [(batch.calc_federal_taxes_batch, taxsim.current_law_policy)]
+    [results] = batcher.calc(taxpayer, calcs)  # records.Results, as calc_federal_taxes returns
+
+There is no worker thread: the first caller to arrive while no batch is being
+collected leads the batch, calculating it on its own thread, so results never
+wait on a thread handoff. A leader calculates one batch and then stops
+leading, and a caller still waiting on its results takes over, so under
+steady load no caller is held calculating everyone else's batches. Batch calc
+functions have a fixed cost of around a millisecond, so groups smaller than
+min_batch_size fall back to the scalar calc function, when calcs gives one,
+rather than paying it.
+
+Submissions are validated on the caller's thread, so one bad taxpayer raises
+for its own caller and never fails the batch it would have joined.
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import threading
+import time
+
+from . import batch
+from . import misc_funcs
+from . import records
+
+
+def validate_submission(taxpayer):
+    """
+    Check a taxpayer can be calculated in a batch.
+
+    Raises:
+        ValueError: A field is not a number, filing_status is not 0, 1 or 2,
+            or the taxpayer fails misc_funcs.validate_taxpayer.
+    """
+    for field in records.TAXPAYER_FIELDS:
+        try:
+            float(taxpayer[field])
+        except (TypeError, ValueError):
+            raise ValueError("Field must be a number: " + field) from None
+    if taxpayer['filing_status'] not in (0, 1, 2):
+        raise ValueError("filing_status must be 0, 1 or 2")
+    misc_funcs.validate_taxpayer(taxpayer)
+
+
+class MicroBatcher(object):
+    """
+    Collects concurrent calculations into batches.
+
+    Args:
+        max_batch_size (int): Most submissions calculated together.
+        max_wait (float): Longest the leader of a batch waits for others to
+            join it, in seconds.
+        min_batch_size (int): Groups smaller than this use the scalar calc
+            function, when the submission gives one.
+        observer (function): Called as observer(calc, seconds) on the leader's
+            thread after each group calculates, with the group's calcs entry
+            and how long it took, e.g. to record per policy timings.
+    """
+
+    def __init__(self, max_batch_size=64, max_wait=0.002, min_batch_size=16, observer=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.min_batch_size = min_batch_size
+        self.observer = observer
+        self._pending = deque()  # (taxpayer, calcs, mrate, future)
+        self._leading = False
+        self._lock = threading.Lock()
+        self._full = threading.Condition(self._lock)
+        # Notified when a batch's results are set and its leader has given up leading
+        self._released = threading.Condition(self._lock)
+        self.batches = 0
+        self.submissions = 0
+
+    def calc(self, taxpayer, calcs, mrate=True):
+        """
+        Calculate a taxpayer under several calc functions, batched with any
+        concurrent callers.
+
+        Args:
+            taxpayer (Taxpayer): An example taxpayer household.
+            calcs (list): (batch calc function, policy) or (batch calc function,
+                policy, scalar calc function) for each result wanted, e.g.
+                (batch.calc_federal_taxes_batch, policy, taxsim.calc_federal_taxes).
+            mrate (bool): Also calculate marginal income tax rates.
+
+        Returns:
+            list: One Result per entry of calcs.
+
+        Raises:
+            ValueError: The taxpayer is invalid, see validate_submission.
+        """
+        validate_submission(taxpayer)
+        future = Future()
+        # Only a caller that arrives to find no leader waits for others to join
+        wait = self.max_wait
+        with self._lock:
+            self._pending.append((taxpayer, tuple(calcs), mrate, future))
+            if self._leading and len(self._pending) >= self.max_batch_size:
+                self._full.notify()
+        while True:
+            with self._lock:
+                while self._leading and not future.done():
+                    self._released.wait()
+                    wait = 0
+                if future.done():
+                    break
+                self._leading = True
+            try:
+                self._lead(wait)
+            finally:
+                with self._lock:
+                    self._leading = False
+                    self._released.notify_all()
+            wait = 0
+        return future.result()
+
+    def _take_batch(self, wait):
+        with self._lock:
+            deadline = time.monotonic() + wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._full.wait(remaining)
+            count = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _lead(self, wait):
+        # Calculate one batch; the caller gives up leading afterwards
+        submissions = self._take_batch(wait)
+        if not submissions:
+            return
+        self.batches += 1
+        self.submissions += len(submissions)
+        self._calc(submissions)
+
+    def _calc(self, submissions):
+        # Group (submission, position) pairs by calc function, policy and mrate
+        groups = OrderedDict()
+        for i, (_, calcs, mrate, _) in enumerate(submissions):
+            for position, calc in enumerate(calcs):
+                key = (calc[0], id(calc[1]), mrate)
+                groups.setdefault(key, (calc, mrate, []))[2].append((i, position))
+        results = [[None] * len(calcs) for _, calcs, _, _ in submissions]
+        failed = {}
+        for calc, mrate, members in groups.values():
+            taxpayers = [submissions[i][0] for i, _ in members]
+            start = time.perf_counter()
+            try:
+                if len(calc) > 2 and len(members) < self.min_batch_size:
+                    rows = [calc[2](taxpayer, calc[1], mrate=mrate) for taxpayer in taxpayers]
+                else:
+                    columns = batch.to_columns(taxpayers)
+                    rows = [records.Result(row) for row in batch.to_rows(calc[0](columns, calc[1], mrate=mrate))]
+            except BaseException as e:
+                for i, _ in members:
+                    failed.setdefault(i, e)
+                continue
+            if self.observer is not None:
+                self.observer(calc, time.perf_counter() - start)
+            for (i, position), row in zip(members, rows):
+                results[i][position] = row
+        for i, submission in enumerate(submissions):
+            if i in failed:
+                submission[3].set_exception(failed[i])
+            else:
+                submission[3].set_result(results[i])
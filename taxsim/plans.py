@@ -0,0 +1,86 @@
+"""
+Registry of the tax plans the API and config generator can calculate.
+
+Each plan pairs a calc function (and its batch equivalent) with the name of
+the policy it runs under. Policies are only loaded, and plans only calculated,
+when a plan is selected.
+"""
+from collections import OrderedDict, namedtuple
+
+from . import taxsim
+from . import batch
+
+Plan = namedtuple('Plan', ['id', 'name', 'year', 'calc', 'batch_calc', 'policy_name'])
+
+# Every registered plan, keyed by (id, year)
+PLANS = OrderedDict()
+# Keys of the plans calculated when none are selected
+DEFAULT_PLANS = []
+
+
+def register(plan, default=True):
+    """
+    Add a plan to the registry.
+
+    Args:
+        plan (Plan): The plan. Its (id, year) must be unique.
+        default (bool): Whether the plan is calculated when a request does not
+            select plans explicitly.
+    """
+    PLANS[(plan.id, plan.year)] = plan
+    if default:
+        DEFAULT_PLANS.append((plan.id, plan.year))
+
+
+register(Plan('pre-tcja', 'Previous Law', 2018,
+              taxsim.calc_federal_taxes, batch.calc_federal_taxes_batch, 'current_law_policy'))
+register(Plan('tcja', 'Tax Cuts and Jobs Act', 2018,
+              taxsim.calc_senate_2018_taxes, batch.calc_senate_2018_taxes_batch, 'senate_2018_policy'))
+register(Plan('pre-tcja', 'Previous Law', 2019,
+              taxsim.calc_federal_taxes, batch.calc_federal_taxes_batch, 'current_law_2019_policy'))
+register(Plan('tcja', 'Tax Cuts and Jobs Act', 2019,
+              taxsim.calc_senate_2018_taxes, batch.calc_senate_2018_taxes_batch, 'senate_2019_policy'))
+# Only calculated on request
+register(Plan('ss2100', 'Social Security 2100 Act', 2019,
+              taxsim.calc_senate_2018_taxes, batch.calc_senate_2018_taxes_batch, 'senate_2019_ss_policy'),
+         default=False)
+
+
+def select_plans(ids=None, years=None):
+    """
+    Select plans from the registry, in registration order.
+
+    Args:
+        ids (list): Plan ids to include, e.g. ['tcja']. Defaults to the plans
+            in DEFAULT_PLANS; naming ids selects from every registered plan.
+        years (list): Years to include, e.g. [2019]. Defaults to every year.
+
+    Returns:
+        list: The selected Plans.
+
+    Raises:
+        ValueError: An id or year matches no registered plan, or no plan
+            has both a selected id and a selected year.
+    """
+    keys = list(PLANS) if ids else DEFAULT_PLANS
+    for plan_id in ids or ():
+        if not any(key[0] == plan_id for key in keys):
+            raise ValueError("Unknown plan: " + str(plan_id))
+    for year in years or ():
+        if not any(key[1] == year for key in keys):
+            raise ValueError("Unknown year: " + str(year))
+    selected = [PLANS[key] for key in keys
+                if (not ids or key[0] in ids) and (not years or key[1] in years)]
+    if not selected:
+        raise ValueError("No plan matches: " + ", ".join(map(str, list(ids or ()) + list(years or ()))))
+    return selected
+
+
+def policy(plan):
+    """Get the policy a plan runs under, loading it on first use."""
+    return taxsim.get_policy(plan.policy_name)
+
+
+def describe(plan):
+    """Get the plan as returned by the API, e.g. {'id': 'tcja', 'name': ..., 'year': 2018}."""
+    return {'id': plan.id, 'name': plan.name, 'year': plan.year}
@@ -0,0 +1,200 @@
+"""
+Fixed-layout taxpayer and result records.
+
+Taxpayers and results used to be OrderedDicts: every record carried its own
+hash table of string keys. These records store their fields in __slots__
+instead, which cuts the per-record memory several times over and lets the tax
+functions read fields as plain attributes. Both types are also mutable
+mappings keyed by the CSV column names, so taxpayer['401k_contributions'],
+DictWriter and the API keep working unchanged. Call to_dict() where a real
+dict is required (json, pandas, jsonify).
+"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from operator import attrgetter
+
+
+# Input fields, in CSV column order
+TAXPAYER_FIELDS = (
+    'filing_status',
+    'child_dep',
+    'nonchild_dep',
+    'ordinary_income1',
+    'ordinary_income2',
+    'business_income',
+    'ss_income',
+    'qualified_income',
+    '401k_contributions',
+    'medical_expenses',
+    'sl_income_tax',
+    'sl_property_tax',
+    'interest_paid',
+    'charity_contributions',
+    'other_itemized',
+    'business_income_service')
+
+# Every result any calculation produces, in results CSV column order. Each
+# calculation sets a subset of these; unset fields are absent from the mapping.
+RESULT_FIELDS = (
+    'gross_income',
+    'employee_payroll_tax',
+    'employer_payroll_tax',
+    'ordinary_income_after_401k',
+    'agi',
+    'taxable_income',
+    'deduction_type',
+    'deductions',
+    'personal_exemption_amt',
+    'pease_limitation_amt',
+    'qbi_ded',
+    'income_tax_before_credits',
+    'qualified_income_tax',
+    'selected_tax_before_credits',
+    'amt_taxable_income',
+    'amt',
+    'income_tax_before_credits_with_amt',
+    'ctc',
+    'actc',
+    'eitc',
+    'personal_credit',
+    'dep_credit',
+    'income_tax_after_nonrefundable_credits',
+    'medicare_surtax',
+    'niit',
+    'sched_se_tax',
+    'income_tax_after_other_taxes',
+    'income_tax_after_credits',
+    'total_payroll_tax',
+    'cash_income',
+    'tax_burden',
+    'tax_wedge',
+    'take_home_pay',
+    'avg_effective_tax_rate',
+    'avg_effective_tax_rate_wo_payroll',
+    'marginal_income_tax_rate',
+    'marginal_business_income_tax_rate')
+
+# Fields that are not valid identifiers are stored under another slot name
+SLOT_NAMES = {'401k_contributions': 'contributions_401k'}
+
+
+def slot_name(field):
+    return SLOT_NAMES.get(field, field)
+
+
+class Record(MutableMapping):
+    """
+    Base class for a mapping over a fixed set of fields stored in __slots__.
+
+    Subclasses set _slot_of, an ordered {field: slot name} dict, and __slots__
+    to its values. Fields cannot be added, only set and (for results) unset.
+    """
+    __slots__ = ()
+    _slot_of = OrderedDict()
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, self._slot_of[field])
+        except (KeyError, AttributeError):
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        try:
+            slot = self._slot_of[field]
+        except KeyError:
+            raise KeyError(field) from None
+        setattr(self, slot, value)
+
+    def __delitem__(self, field):
+        try:
+            delattr(self, self._slot_of[field])
+        except (KeyError, AttributeError):
+            raise KeyError(field) from None
+
+    def __iter__(self):
+        for field, slot in self._slot_of.items():
+            if hasattr(self, slot):
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "{name}({values!r})".format(name=type(self).__name__, values=dict(self.items()))
+
+    def copy(self):
+        new = type(self).__new__(type(self))
+        for slot in self.__slots__:
+            try:
+                setattr(new, slot, getattr(self, slot))
+            except AttributeError:
+                pass
+        return new
+
+    def to_dict(self, fields=None):
+        """
+        Return the fields as an OrderedDict, for json, pandas and jsonify.
+
+        Args:
+            fields (iterable): Only include these fields, in this order. Fields
+                that are not set are left out.
+        """
+        if fields is None:
+            return OrderedDict(self.items())
+        return OrderedDict((field, self[field]) for field in fields if field in self)
+
+
+class Taxpayer(Record):
+    """
+    A taxpayer household.
+
+    Every field is always set; fields not given default to 0, as in
+    misc_funcs.create_taxpayer.
+
+    Args:
+        values (mapping): Field values keyed by TAXPAYER_FIELDS names. Keys
+            outside TAXPAYER_FIELDS raise KeyError.
+    """
+    _slot_of = OrderedDict((field, slot_name(field)) for field in TAXPAYER_FIELDS)
+    __slots__ = tuple(_slot_of.values())
+
+    def __init__(self, values=None):
+        for slot in self.__slots__:
+            setattr(self, slot, 0)
+        if values is not None:
+            self.update(values)
+
+    def __delitem__(self, field):
+        raise TypeError("Taxpayer fields cannot be deleted")
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def copy(self):
+        # Every slot is set, so copy them all without the per-slot checks
+        new = Taxpayer.__new__(Taxpayer)
+        for slot, value in zip(self.__slots__, _taxpayer_values(self)):
+            setattr(new, slot, value)
+        return new
+
+    def astuple(self):
+        """Return the field values as a tuple, in TAXPAYER_FIELDS order."""
+        return _taxpayer_values(self)
+
+
+_taxpayer_values = attrgetter(*Taxpayer.__slots__)
+
+
+class Result(Record):
+    """
+    Results of a tax calculation, filled in field by field as it runs.
+
+    Args:
+        values (mapping): Initial field values keyed by RESULT_FIELDS names.
+    """
+    _slot_of = OrderedDict((field, field) for field in RESULT_FIELDS)
+    __slots__ = tuple(_slot_of.values())
+
+    def __init__(self, values=None):
+        if values is not None:
+            self.update(values)
@@ -0,0 +1,306 @@
+"""
+Opt-in LRU cache for tax calculation results.
+
+Many workloads calculate the same household under the same policy over and
+over. A ResultCache sits in front of the calc functions and returns a copy of
+the stored result when it has seen the calc function, policy, mrate flag and
+all 16 taxpayer fields before.
+
+    cache = result_cache.ResultCache(maxsize=1024)
+    results = cache.calc(taxsim.calc_federal_taxes, taxpayer, taxsim.current_law_policy)
+    cache.info()  # CacheInfo(hits=0, misses=1, evictions=0, maxsize=1024, currsize=1)
+
+Policies are identified by a fingerprint of their contents, computed once per
+policy object. If a policy dict is modified in place, or its CSV is reloaded
+into the same object, call invalidate(policy) so stale results are dropped.
+
+A ResponseCache sits one level higher and stores finished response bodies, so
+a hit skips both the calculations and serialization. Its keys are whatever the
+caller canonicalizes a request to, and entries expire after a TTL. A
+SingleFlight covers the gap before a response is cached: identical requests
+that arrive while one is still being calculated wait for its result.
+"""
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+import hashlib
+import json
+import threading
+import time
+
+from . import records
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+SingleFlightInfo = namedtuple('SingleFlightInfo', ['calls', 'coalesced', 'in_flight'])
+ResponseCacheInfo = namedtuple('ResponseCacheInfo', [
+    'hits', 'misses', 'evictions', 'expirations', 'maxsize', 'currsize', 'ttl',
+    'hit_rate', 'hit_latency', 'miss_latency'])
+
+
+def policy_fingerprint(policy):
+    """
+    Get a stable fingerprint of a policy.
+
+    Args:
+        policy (dict): A set of policy parameters, parsed from CSV.
+
+    Returns:
+        str: SHA-256 hex digest of the policy's parameters, independent of key order.
+    """
+    serialized = json.dumps(policy, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def taxpayer_key(taxpayer):
+    """
+    Get the 16 taxpayer fields as a hashable tuple, in TAXPAYER_FIELDS order.
+
+    Results echo their inputs, so 50000 and 50000.0 get different keys even
+    though they compare equal.
+    """
+    if isinstance(taxpayer, records.Taxpayer):
+        values = taxpayer.astuple()
+    else:
+        values = tuple(taxpayer[field] for field in records.TAXPAYER_FIELDS)
+    return values, tuple(isinstance(value, float) for value in values)
+
+
+class ResultCache(object):
+    """
+    A bounded, thread-safe LRU cache of calc function results.
+
+    Args:
+        maxsize (int): Maximum number of results kept. The least recently used
+            result is evicted when a new one would exceed it.
+    """
+
+    def __init__(self, maxsize=4096):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._fingerprints = {}  # id(policy): (policy, fingerprint)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _fingerprint(self, policy):
+        # The policy itself is kept alongside its fingerprint so its id can't be reused
+        entry = self._fingerprints.get(id(policy))
+        if entry is None:
+            entry = (policy, policy_fingerprint(policy))
+            self._fingerprints[id(policy)] = entry
+        return entry[1]
+
+    def calc(self, tax_calc, taxpayer, policy, mrate=True):
+        """
+        Calculate taxes through the cache.
+
+        Args:
+            tax_calc (function): A calc function, e.g. taxsim.calc_federal_taxes.
+            taxpayer (Taxpayer): An example taxpayer household.
+            policy (dict): A set of policy parameters, parsed from CSV.
+            mrate (bool): Passed through to tax_calc.
+
+        Returns:
+            Result: A copy of the cached results, safe for the caller to modify.
+        """
+        with self._lock:
+            key = (tax_calc.__module__, tax_calc.__name__, self._fingerprint(policy), mrate, taxpayer_key(taxpayer))
+            results = self._results.get(key)
+            if results is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return results.copy()
+            self.misses += 1
+
+        # Calculated outside the lock; invalid taxpayers raise here and are never cached
+        results = tax_calc(taxpayer, policy, mrate=mrate)
+
+        with self._lock:
+            self._results[key] = results.copy()
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+                self.evictions += 1
+        return results
+
+    def invalidate(self, policy=None):
+        """
+        Drop cached results.
+
+        Args:
+            policy (dict): Only drop results calculated under this policy, e.g.
+                after reloading or editing it. Drops everything if None.
+        """
+        with self._lock:
+            if policy is None:
+                self._results.clear()
+                self._fingerprints.clear()
+                return
+            entry = self._fingerprints.pop(id(policy), None)
+            fingerprints = {policy_fingerprint(policy)}
+            if entry is not None:
+                fingerprints.add(entry[1])
+            for key in [key for key in self._results if key[2] in fingerprints]:
+                del self._results[key]
+
+    def info(self):
+        """Return hit, miss and eviction counters and the current size."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._results))
+
+
+class ResponseCache(object):
+    """
+    A bounded, thread-safe LRU cache of serialized responses with a TTL.
+
+    Args:
+        maxsize (int): Maximum number of responses kept. The least recently
+            used response is evicted when a new one would exceed it.
+        ttl (float): Seconds a response is served for after it is stored.
+        clock (function): Returns the current time in seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, clock=time.monotonic):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._responses = OrderedDict()  # key: (expires, tags, body)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # [count, total seconds] for requests answered from and missing the cache
+        self._latency = {True: [0, 0.0], False: [0, 0.0]}
+
+    def get(self, key):
+        """
+        Get a stored response.
+
+        Args:
+            key (hashable): The canonicalized request.
+
+        Returns:
+            bytes: The response body, or None on a miss.
+        """
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                del self._responses[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._responses.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, body, tags=()):
+        """
+        Store a response.
+
+        Args:
+            key (hashable): The canonicalized request.
+            body (bytes): The serialized response.
+            tags (iterable): Labels invalidate() can drop the response by,
+                e.g. the plans it covers.
+        """
+        with self._lock:
+            self._responses[key] = (self._clock() + self.ttl, frozenset(tags), body)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.maxsize:
+                self._responses.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tag=None):
+        """
+        Drop stored responses.
+
+        Args:
+            tag (hashable): Only drop responses stored with this tag, e.g. a plan
+                whose policy changed. Drops everything if None.
+        """
+        with self._lock:
+            if tag is None:
+                self._responses.clear()
+                return
+            for key in [key for key, entry in self._responses.items() if tag in entry[1]]:
+                del self._responses[key]
+
+    def record_latency(self, hit, seconds):
+        """Record how long a request took, for the hit and miss latencies in info()."""
+        with self._lock:
+            latency = self._latency[bool(hit)]
+            latency[0] += 1
+            latency[1] += seconds
+
+    def info(self):
+        """Return the counters, current size, hit rate and mean hit and miss latencies in seconds."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            hit_rate = self.hits / lookups if lookups else 0.0
+            latencies = [total / count if count else 0.0
+                         for count, total in (self._latency[True], self._latency[False])]
+            return ResponseCacheInfo(self.hits, self.misses, self.evictions, self.expirations,
+                                     self.maxsize, len(self._responses), self.ttl,
+                                     hit_rate, latencies[0], latencies[1])
+
+
+class SingleFlight(object):
+    """
+    Runs one call per key at a time, sharing its outcome with concurrent callers.
+
+        value, coalesced = single_flight.do(key, function)
+    """
+
+    def __init__(self):
+        self._calls = {}  # key: Future of the call in progress
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, function):
+        """
+        Call function, unless a call for key is already in progress.
+
+        Args:
+            key (hashable): Identifies calls that give the same result.
+            function (function): Takes no arguments.
+
+        Returns:
+            tuple: (value, coalesced). coalesced is True if the value came from
+                another caller's call. An exception raised by the call is
+                raised to every caller sharing it.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+
+        try:
+            value = function()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def info(self):
+        """Return the number of calls run, callers that shared one, and calls in progress."""
+        with self._lock:
+            return SingleFlightInfo(self.calls, self.coalesced, len(self._calls))
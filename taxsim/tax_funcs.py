@@ -1,10 +1,13 @@
+import bisect
+import functools
 import math
 import logging
+from collections import namedtuple
 
 
 def sched_se(policy, taxpayer, results):
     # TODO: replace hardcoded percentages when verified
-    bus_inc = taxpayer["business_income"] * 0.9235
+    bus_inc = taxpayer.business_income * 0.9235
     if bus_inc < 400:
         sched_se_tax = 0
         return sched_se_tax, 0
@@ -15,6 +18,12 @@ def sched_se(policy, taxpayer, results):
     return sched_se_tax, (sched_se_tax / 2)
 
 
+# Withholding rate parameters of each party, built once rather than on every call
+PAYROLL_RATE_PARAMETERS = tuple(
+    (party, ('ss_withholding_rate_' + party, 'medicare_withholding_rate_' + party))
+    for party in ('employee', 'employer'))
+
+
 def fed_payroll(policy, taxpayer):
     """
     Get Federal payroll tax liabilities.
@@ -26,24 +35,24 @@ def fed_payroll(policy, taxpayer):
 
     Args:
         policy (dict): A set of policy parameters, parsed from CSV.
-        taxpayer (dict): An example taxpayer household, parsed from CSV.
+        taxpayer (Taxpayer): An example taxpayer household, parsed from CSV.
 
     Returns:
         dict: Payroll tax values for employee and employer.
     """
-    combined_ordinary_income = taxpayer['ordinary_income1'] + taxpayer['ordinary_income2']
+    combined_ordinary_income = taxpayer.ordinary_income1 + taxpayer.ordinary_income2
     payroll_taxes = {
         "employee": 0,
         "employer": 0}
 
     # Withholding Taxes
-    for party in payroll_taxes:
-        for income in [taxpayer['ordinary_income1'], taxpayer['ordinary_income2']]:
+    for party, (ss_rate, medicare_rate) in PAYROLL_RATE_PARAMETERS:
+        for income in [taxpayer.ordinary_income1, taxpayer.ordinary_income2]:
             social_security = (
-                policy['ss_withholding_rate_{party}'.format(party=party)] *
+                policy[ss_rate] *
                 min(income, policy['ss_wage_base']))
             medicare = (
-                policy['medicare_withholding_rate_{party}'.format(party=party)] *
+                policy[medicare_rate] *
                 min(income, policy['medicare_wage_base']))
             payroll_taxes[party] += social_security + medicare
 
@@ -51,11 +60,11 @@ def fed_payroll(policy, taxpayer):
 
 
 def medsurtax_niit(policy, taxpayer, agi):
-    combined_ordinary_income = taxpayer['ordinary_income1'] + taxpayer['ordinary_income2']
-    investment_income = taxpayer['qualified_income']  # TODO: add for business_income
+    combined_ordinary_income = taxpayer.ordinary_income1 + taxpayer.ordinary_income2
+    investment_income = taxpayer.qualified_income  # TODO: add for business_income
 
     # Additional Medicare Tax
-    filing_status = taxpayer['filing_status']
+    filing_status = taxpayer.filing_status
     medicare_thresholds = policy['additional_medicare_tax_threshold']
     additional_medicare_tax_threshold = medicare_thresholds[filing_status]
     medicare_surtax = 0
@@ -85,37 +94,37 @@ def fed_agi(policy, taxpayer, ordinary_income_after_401k, sched_se_ded):
 
     Args:
         policy (dict): A set of policy parameters, parsed from CSV.
-        taxpayer (dict): An example taxpayer household, parsed from CSV.
+        taxpayer (Taxpayer): An example taxpayer household, parsed from CSV.
         ordinary_income_after_401k (float): Combined income, less 401k contributions.
 
     Returns:
         float: Federal adjusted gross income, including any taxable social security.
     """
-    agi = ordinary_income_after_401k + taxpayer['business_income'] + taxpayer['qualified_income']
+    agi = ordinary_income_after_401k + taxpayer.business_income + taxpayer.qualified_income
 
     agi -= sched_se_ded
 
-    if taxpayer['ss_income'] > 0:
+    if taxpayer.ss_income > 0:
         # Social security income may not be fully taxable.
         # The following calculates any tax on social security.
         # Lines 1 through 8 are a calculation of AGI plus half of SS benefits.
         # If AGI plus half of benefits minus base threshold is negative, no SS tax.
-        line1 = taxpayer['ss_income']
+        line1 = taxpayer.ss_income
         line2 = line1 / 2
         line8 = agi + line2
-        line9 = policy["taxable_ss_base_threshold"][taxpayer['filing_status']]
+        line9 = policy["taxable_ss_base_threshold"][taxpayer.filing_status]
         line10 = max(0, line8 - line9)
         if line10 > 0:
             line11 = (
-                policy["taxable_ss_top_threshold"][taxpayer['filing_status']] -
-                policy["taxable_ss_base_threshold"][taxpayer['filing_status']])
+                policy["taxable_ss_top_threshold"][taxpayer.filing_status] -
+                policy["taxable_ss_base_threshold"][taxpayer.filing_status])
             line12 = max(0, line10 - line11)
             line13 = min(line10, line11)
             line14 = line13 * policy["taxable_ss_base_amt"]
             line15 = min(line14, line2)
             line16 = max(0, line12 * policy["taxable_ss_top_amt"])
             line17 = line15 + line16
-            line18 = taxpayer['ss_income'] * policy["taxable_ss_top_amt"]
+            line18 = taxpayer.ss_income * policy["taxable_ss_top_amt"]
             line19 = min(line17, line18)  # Line 20b on 1040
             return agi + line19
     return agi
@@ -130,7 +139,7 @@ def fed_taxable_income(policy, taxpayer, agi):
 
     Args:
         policy (dict): A set of policy parameters, parsed from CSV.
-        taxpayer (dict): An example taxpayer household, parsed from CSV.
+        taxpayer (Taxpayer): An example taxpayer household, parsed from CSV.
         agi (float): Adjusted gross income of taxpayer household.
 
     Returns:
@@ -141,10 +150,10 @@ def fed_taxable_income(policy, taxpayer, agi):
     # Personal exemption(s)
     # Publication 501 https://www.irs.gov/pub/irs-pdf/p501.pdf
     personal_exemption = 0
-    filers = 2 if taxpayer["filing_status"] == 1 else 1
-    exemptions_claimed = filers + taxpayer["child_dep"] + taxpayer["nonchild_dep"]
+    filers = 2 if taxpayer.filing_status == 1 else 1
+    exemptions_claimed = filers + taxpayer.child_dep + taxpayer.nonchild_dep
     # Check for phase out of personal exemption
-    phaseout_threshold = policy["personal_exemption_po_threshold"][taxpayer['filing_status']]
+    phaseout_threshold = policy["personal_exemption_po_threshold"][taxpayer.filing_status]
     if agi > phaseout_threshold:
         personal_exemption = policy["personal_exemption"] * exemptions_claimed
         amt_over_threshold = agi - phaseout_threshold
@@ -156,33 +165,33 @@ def fed_taxable_income(policy, taxpayer, agi):
         personal_exemption = policy["personal_exemption"] * exemptions_claimed
 
     # Standard deduction
-    standard_deduction = policy["standard_deduction"][taxpayer['filing_status']]
-    if taxpayer["ss_income"] > 0:
+    standard_deduction = policy["standard_deduction"][taxpayer.filing_status]
+    if taxpayer.ss_income > 0:
         standard_deduction = (
             standard_deduction +
             filers *
-            policy["additional_standard_deduction"][taxpayer['filing_status']])
+            policy["additional_standard_deduction"][taxpayer.filing_status])
 
     # Itemized deductions
     itemized_total = (
-        taxpayer["medical_expenses"] +
-        taxpayer["sl_income_tax"] +
-        taxpayer["sl_property_tax"] +
-        taxpayer["interest_paid"] +
-        taxpayer["charity_contributions"] +
-        taxpayer["other_itemized"]
+        taxpayer.medical_expenses +
+        taxpayer.sl_income_tax +
+        taxpayer.sl_property_tax +
+        taxpayer.interest_paid +
+        taxpayer.charity_contributions +
+        taxpayer.other_itemized
     )
     # Check for phase out of itemized deductions
     # Itemized Deductions Worksheet—Line 29 https://www.irs.gov/pub/irs-pdf/i1040sca.pdf
     pease_limitation = 0
     line1 = itemized_total
     # line2 could also include investment interest and casualty deductions
-    line2 = taxpayer["medical_expenses"]
+    line2 = taxpayer.medical_expenses
     if line2 < line1:
         line3 = line1 - line2
         line4 = line3 * policy["itemized_limitation_amt"]
         line5 = agi
-        line6 = policy["itemized_limitation_threshold"][taxpayer['filing_status']]
+        line6 = policy["itemized_limitation_threshold"][taxpayer.filing_status]
         if line6 < line5:
             line7 = line5 - line6
             line8 = line7 * policy["itemized_limitation_rate"]
@@ -206,7 +215,7 @@ def house_2018_taxable_income(policy, taxpayer, agi):
 
     Args:
         policy (dict): A set of policy parameters, parsed from CSV.
-        taxpayer (dict): An example taxpayer household, parsed from CSV.
+        taxpayer (Taxpayer): An example taxpayer household, parsed from CSV.
         agi (float): Adjusted gross income of taxpayer household.
 
     Returns:
@@ -217,10 +226,10 @@ def house_2018_taxable_income(policy, taxpayer, agi):
     # Personal exemption(s)
     # Publication 501 https://www.irs.gov/pub/irs-pdf/p501.pdf
     personal_exemption = 0
-    filers = 2 if taxpayer["filing_status"] == 1 else 1
-    exemptions_claimed = filers + taxpayer["child_dep"] + taxpayer["nonchild_dep"]
+    filers = 2 if taxpayer.filing_status == 1 else 1
+    exemptions_claimed = filers + taxpayer.child_dep + taxpayer.nonchild_dep
     # Check for phase out of personal exemption
-    phaseout_threshold = policy["personal_exemption_po_threshold"][taxpayer['filing_status']]
+    phaseout_threshold = policy["personal_exemption_po_threshold"][taxpayer.filing_status]
     if agi > phaseout_threshold:
         personal_exemption = policy["personal_exemption"] * exemptions_claimed
         amt_over_threshold = agi - phaseout_threshold
@@ -232,28 +241,28 @@ def house_2018_taxable_income(policy, taxpayer, agi):
         personal_exemption = policy["personal_exemption"] * exemptions_claimed
 
     # Standard deduction
-    standard_deduction = policy["standard_deduction"][taxpayer['filing_status']]
+    standard_deduction = policy["standard_deduction"][taxpayer.filing_status]
     # NEW: Eliminate additional standard deduction
 
     # Itemized deductions
     itemized_total = (
-        taxpayer["medical_expenses"] +
-        taxpayer["sl_income_tax"] +
-        taxpayer["sl_property_tax"] +
-        taxpayer["interest_paid"] +
-        taxpayer["charity_contributions"] +
-        taxpayer["other_itemized"])
+        taxpayer.medical_expenses +
+        taxpayer.sl_income_tax +
+        taxpayer.sl_property_tax +
+        taxpayer.interest_paid +
+        taxpayer.charity_contributions +
+        taxpayer.other_itemized)
     # Check for phase out of itemized deductions
     # Itemized Deductions Worksheet—Line 29 https://www.irs.gov/pub/irs-pdf/i1040sca.pdf
     pease_limitation = 0
     line1 = itemized_total
     # line2 could also include investment interest and casualty deductions
-    line2 = taxpayer["medical_expenses"]
+    line2 = taxpayer.medical_expenses
     if line2 < line1:
         line3 = line1 - line2
         line4 = line3 * policy["itemized_limitation_amt"]
         line5 = agi
-        line6 = policy["itemized_limitation_threshold"][taxpayer['filing_status']]
+        line6 = policy["itemized_limitation_threshold"][taxpayer.filing_status]
         if line6 < line5:
             line7 = line5 - line6
             line8 = line7 * policy["itemized_limitation_rate"]
@@ -277,7 +286,7 @@ def senate_2018_taxable_income(policy, taxpayer, agi):
 
     Args:
         policy (dict): A set of policy parameters, parsed from CSV.
-        taxpayer (dict): An example taxpayer household, parsed from CSV.
+        taxpayer (Taxpayer): An example taxpayer household, parsed from CSV.
         agi (float): Adjusted gross income of taxpayer household.
 
     Returns:
@@ -288,10 +297,10 @@ def senate_2018_taxable_income(policy, taxpayer, agi):
     # Personal exemption(s)
     # Publication 501 https://www.irs.gov/pub/irs-pdf/p501.pdf
     personal_exemption_amt = 0
-    filers = 2 if taxpayer["filing_status"] == 1 else 1
-    exemptions_claimed = filers + taxpayer["child_dep"] + taxpayer["nonchild_dep"]
+    filers = 2 if taxpayer.filing_status == 1 else 1
+    exemptions_claimed = filers + taxpayer.child_dep + taxpayer.nonchild_dep
     # Check for phase out of personal exemption
-    phaseout_threshold = policy["personal_exemption_po_threshold"][taxpayer['filing_status']]
+    phaseout_threshold = policy["personal_exemption_po_threshold"][taxpayer.filing_status]
     if agi > phaseout_threshold:
         personal_exemption = policy["personal_exemption"] * exemptions_claimed
         amt_over_threshold = agi - phaseout_threshold
@@ -303,31 +312,31 @@ def senate_2018_taxable_income(policy, taxpayer, agi):
         personal_exemption_amt = policy["personal_exemption"] * exemptions_claimed
 
     # Standard deduction
-    standard_deduction = policy["standard_deduction"][taxpayer['filing_status']]
-    if taxpayer["ss_income"] > 0:
+    standard_deduction = policy["standard_deduction"][taxpayer.filing_status]
+    if taxpayer.ss_income > 0:
         standard_deduction = (
             standard_deduction +
             filers *
-            policy["additional_standard_deduction"][taxpayer['filing_status']])
+            policy["additional_standard_deduction"][taxpayer.filing_status])
     # Itemized deductions
     itemized_total = (
-        taxpayer["medical_expenses"] +
-        taxpayer["sl_income_tax"] +
-        taxpayer["sl_property_tax"] +
-        taxpayer["interest_paid"] +
-        taxpayer["charity_contributions"] +
-        taxpayer["other_itemized"])
+        taxpayer.medical_expenses +
+        taxpayer.sl_income_tax +
+        taxpayer.sl_property_tax +
+        taxpayer.interest_paid +
+        taxpayer.charity_contributions +
+        taxpayer.other_itemized)
     # Check for phase out of itemized deductions
     # Itemized Deductions Worksheet—Line 29 https://www.irs.gov/pub/irs-pdf/i1040sca.pdf
     pease_limitation_amt = 0
     line1 = itemized_total
     # Line 2 could also include investment interest and casualty deductions
-    line2 = taxpayer["medical_expenses"]
+    line2 = taxpayer.medical_expenses
     if line2 < line1:
         line3 = line1 - line2
         line4 = line3 * policy["itemized_limitation_amt"]
         line5 = agi
-        line6 = policy["itemized_limitation_threshold"][taxpayer['filing_status']]
+        line6 = policy["itemized_limitation_threshold"][taxpayer.filing_status]
         if line6 < line5:
             line7 = line5 - line6
             line8 = line7 * policy["itemized_limitation_rate"]
@@ -343,19 +352,19 @@ def senate_2018_taxable_income(policy, taxpayer, agi):
     BUSINESS_DEDUCTION_RATE = policy["199a_rate"]
 
     '''
-    if taxpayer['business_income_service'] == 1:
+    if taxpayer.business_income_service == 1:
         # https://www.irs.gov/newsroom/tax-cuts-and-jobs-act-provision-11011-section-199a-qualified-business-income-deduction-faqs
         # see Q/A #5
         BUSINESS_DEDUCTION_RATE = 0
     '''
 
-    qualified_business_income = taxpayer['business_income'] * BUSINESS_DEDUCTION_RATE
+    qualified_business_income = taxpayer.business_income * BUSINESS_DEDUCTION_RATE
     taxable_income_limit = taxable_income_before * BUSINESS_DEDUCTION_RATE
 
-    po_start = policy["199a_po_start"][taxpayer['filing_status']]
-    po_length = policy["199a_po_length"][taxpayer['filing_status']]
+    po_start = policy["199a_po_start"][taxpayer.filing_status]
+    po_length = policy["199a_po_length"][taxpayer.filing_status]
 
-    if (taxable_income_before > po_start) and (taxpayer['business_income_service'] == 1):
+    if (taxable_income_before > po_start) and (taxpayer.business_income_service == 1):
         taxable_income_over = taxable_income_before - po_start
         if taxable_income_over > po_length:
             qualified_business_income = 0
@@ -377,28 +386,17 @@ def senate_2018_taxable_income(policy, taxpayer, agi):
 
 
 def fed_ordinary_income_tax(policy, taxpayer, taxable_income):
-    brackets = get_brackets(taxpayer, policy)
-    rates = list(reversed(policy["income_tax_rates"]))
-    ordinary_income_tax = 0
-    running_taxable_income = taxable_income
-    i = 0
-    for threshold in reversed(brackets):
-        if taxable_income > threshold:
-            applicable_taxable_income = running_taxable_income - threshold
-            running_taxable_income = running_taxable_income - applicable_taxable_income
-            ordinary_income_tax = ordinary_income_tax + (applicable_taxable_income * rates[i])
-        i += 1
-
-    return round(ordinary_income_tax, 2)
+    schedule = get_schedule(taxpayer, policy)
+    return round(schedule_tax(schedule, taxable_income), 2)
 
 
 def fed_ctc(policy, taxpayer, agi, tax_liability):
     # Child Tax Credit Worksheet https://www.irs.gov/pub/irs-pdf/p972.pdf
     # Part 1
     ctc = 0
-    line1 = taxpayer["child_dep"] * policy["ctc_credit"]
+    line1 = taxpayer.child_dep * policy["ctc_credit"]
     line4 = agi
-    line5 = policy["ctc_po_threshold"][taxpayer['filing_status']]
+    line5 = policy["ctc_po_threshold"][taxpayer.filing_status]
     if line4 > line5:
         line6 = math.ceil((line4 - line5) / 1000) * 1000
     else:
@@ -412,7 +410,7 @@ def fed_ctc(policy, taxpayer, agi, tax_liability):
     if line8 > tax_liability:
         # Additional Child Tax Credit
         actc_line1 = line8  # ctc
-        actc_line2 = taxpayer['ordinary_income1'] + taxpayer['ordinary_income2']  # Earned income
+        actc_line2 = taxpayer.ordinary_income1 + taxpayer.ordinary_income2  # Earned income
         if actc_line2 > policy['additional_ctc_threshold']:
             actc_line3 = actc_line2 - policy['additional_ctc_threshold']
             actc_line4 = actc_line3 * policy['additional_ctc_rate']
@@ -444,9 +442,9 @@ def fed_ctc_actc_limited(policy, taxpayer, agi, actc_limit, tax_liability):
     # Child Tax Credit Worksheet https://www.irs.gov/pub/irs-pdf/p972.pdf
     # Part 1
     ctc = 0
-    line1 = taxpayer["child_dep"] * policy["ctc_credit"]
+    line1 = taxpayer.child_dep * policy["ctc_credit"]
     line4 = agi
-    line5 = policy["ctc_po_threshold"][taxpayer['filing_status']]
+    line5 = policy["ctc_po_threshold"][taxpayer.filing_status]
     if line4 > line5:
         line6 = math.ceil((line4 - line5) / 1000) * 1000
     else:
@@ -460,7 +458,7 @@ def fed_ctc_actc_limited(policy, taxpayer, agi, actc_limit, tax_liability):
     if line8 > tax_liability:
         # Additional Child Tax Credit
         actc_line1 = line8  # ctc
-        actc_line2 = taxpayer['ordinary_income1'] + taxpayer['ordinary_income2']  # Earned income
+        actc_line2 = taxpayer.ordinary_income1 + taxpayer.ordinary_income2  # Earned income
         if actc_line2 > policy['additional_ctc_threshold']:
             actc_line3 = actc_line2 - policy['additional_ctc_threshold']
             actc_line4 = actc_line3 * policy['additional_ctc_rate']
@@ -472,7 +470,7 @@ def fed_ctc_actc_limited(policy, taxpayer, agi, actc_limit, tax_liability):
     else:
         return line8, 0
 
-    actc_limit = taxpayer["child_dep"] * actc_limit
+    actc_limit = taxpayer.child_dep * actc_limit
     if actc > actc_limit:
         overage = actc - actc_limit
         # reduce ACTC
@@ -498,9 +496,9 @@ def fed_ctc_actc_limited(policy, taxpayer, agi, actc_limit, tax_liability):
 
 def fed_eitc(policy, taxpayer):
     # Publication 596 https://www.irs.gov/pub/irs-pdf/p596.pdf
-    income = taxpayer["ordinary_income1"] + taxpayer["ordinary_income2"]  # earned income
-    dependentCount = min(taxpayer["child_dep"], 3)
-    status = ("married", "single")[taxpayer["filing_status"] != 1]
+    income = taxpayer.ordinary_income1 + taxpayer.ordinary_income2  # earned income
+    dependentCount = min(taxpayer.child_dep, 3)
+    status = ("married", "single")[taxpayer.filing_status != 1]
     EITC_THRESHOLD = policy["eitc_threshold"][dependentCount]
     EITC_MAX = policy["eitc_max"][dependentCount]
     EITC_PHASEOUT = policy["eitc_phaseout_" + status][dependentCount]
@@ -527,14 +525,14 @@ def fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation,
     amt_income = 0
     if deduction_type == "itemized":
         line1 = agi - deductions  # also line41 on form 1040
-        if taxpayer["ss_income"] > 0:
-            line2 = taxpayer["medical_expenses"]
+        if taxpayer.ss_income > 0:
+            line2 = taxpayer.medical_expenses
         else:
             line2 = 0
-        line3 = taxpayer["sl_income_tax"] + taxpayer["sl_property_tax"]
+        line3 = taxpayer.sl_income_tax + taxpayer.sl_property_tax
         # TODO: check this logic before use
-        line5 = taxpayer["other_itemized"]
-        if agi < policy["itemized_limitation_threshold"][taxpayer['filing_status']]:
+        line5 = taxpayer.other_itemized
+        if agi < policy["itemized_limitation_threshold"][taxpayer.filing_status]:
             line6 = 0
         else:
             # TODO: Check this behavior, it reverses the pease limitation
@@ -546,8 +544,8 @@ def fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation,
         amt_income = line1
 
     # Step 2: Calculate AMT Exemption
-    amt_exemption = policy["amt_exemption"][taxpayer['filing_status']]
-    amt_exemption_po_threshold = policy["amt_exemption_po_threshold"][taxpayer['filing_status']]
+    amt_exemption = policy["amt_exemption"][taxpayer.filing_status]
+    amt_exemption_po_threshold = policy["amt_exemption_po_threshold"][taxpayer.filing_status]
     if amt_income > amt_exemption_po_threshold:
         # Exemption Worksheet
         # https://www.irs.gov/pub/irs-pdf/i6251.pdf#en_US_2016_publink64277pd0e1980
@@ -568,7 +566,7 @@ def fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation,
         (policy["amt_rate_threshold"] * policy["amt_rates"][0]))
 
     # After this if statement, amt is equivalent to line 31 and 33 of form 6251
-    if taxpayer["qualified_income"] == 0:
+    if taxpayer.qualified_income == 0:
         if amt_taxable_income < policy["amt_rate_threshold"]:
             amt = amt_taxable_income * policy["amt_rates"][0]  # 26% rate
         else:
@@ -576,7 +574,7 @@ def fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation,
     else:
         # Tax Computation Using Maximum Capital Gains Rate
         line36 = amt_taxable_income
-        line37 = max(taxpayer["qualified_income"], 0)  # line 6 from cap gains worksheet
+        line37 = max(taxpayer.qualified_income, 0)  # line 6 from cap gains worksheet
         line38 = 0  # line 19 from schedule D
         line39 = line37
         line40 = min(line36, line39)
@@ -585,15 +583,15 @@ def fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation,
             line42 = line41 * policy["amt_rates"][0]
         else:
             line42 = line41 * policy["amt_rates"][1] - rate_diff
-        line43 = policy["cap_gains_lower_threshold"][taxpayer['filing_status']]
-        line44 = max(taxable_income - taxpayer["qualified_income"], 0)  # line7 from cap gains worksheet
+        line43 = policy["cap_gains_lower_threshold"][taxpayer.filing_status]
+        line44 = max(taxable_income - taxpayer.qualified_income, 0)  # line7 from cap gains worksheet
         line45 = max(line43 - line44, 0)
         line46 = min(line36, line37)
         line47 = min(line45, line46)
         line48 = line46 - line47
-        line49 = policy["cap_gains_upper_threshold"][taxpayer['filing_status']]
+        line49 = policy["cap_gains_upper_threshold"][taxpayer.filing_status]
         line50 = line45
-        line51 = max(taxable_income - taxpayer["qualified_income"], 0)  # line7 from cap gains worksheet
+        line51 = max(taxable_income - taxpayer.qualified_income, 0)  # line7 from cap gains worksheet
         line52 = line50 + line51
         line53 = max(line49 - line52, 0)
         line54 = min(line48, line53)
@@ -623,20 +621,20 @@ def fed_qualified_income(policy, taxpayer, taxable_income, income_tax_before_cre
     # https://apps.irs.gov/app/vita/content/globalmedia/capital_gain_tax_worksheet_1040i.pdf
     cap_gains_tax = 0
     line1 = taxable_income
-    line2 = taxpayer["qualified_income"]
+    line2 = taxpayer.qualified_income
     line3 = 0  # Enter the amount from Form 1040, line 13.
     line4 = line3 + line2
     line5 = 0  # investment interest expense deduction
     line6 = max(0, line4 - line5)
     line7 = max(0, line1 - line6)  # taxable_income - qualified_income
-    line8 = policy["cap_gains_lower_threshold"][taxpayer['filing_status']]
+    line8 = policy["cap_gains_lower_threshold"][taxpayer.filing_status]
     line9 = min(line1, line8)
     line10 = min(line7, line9)
     line11 = line9 - line10  # this amount is taxed at 0%
     line12 = min(line1, line6)
     line13 = line11
     line14 = line12 - line13
-    line15 = policy["cap_gains_upper_threshold"][taxpayer['filing_status']]
+    line15 = policy["cap_gains_upper_threshold"][taxpayer.filing_status]
     line16 = min(line15, line1)
     line17 = line7 + line11
     line18 = max(0, line16 - line17)
@@ -658,20 +656,20 @@ def house_2018_qualified_income(policy, taxpayer, taxable_income, income_tax_bef
     # https://apps.irs.gov/app/vita/content/globalmedia/capital_gain_tax_worksheet_1040i.pdf
     cap_gains_tax = 0
     line1 = taxable_income
-    line2 = taxpayer["qualified_income"]
+    line2 = taxpayer.qualified_income
     line3 = 0  # Enter the amount from Form 1040, line 13.
     line4 = line3 + line2
     line5 = 0  # investment interest expense deduction
     line6 = max(0, line4 - line5)
     line7 = max(0, line1 - line6)  # taxable_income - qualified_income
-    line8 = policy["cap_gains_lower_threshold"][taxpayer['filing_status']]
+    line8 = policy["cap_gains_lower_threshold"][taxpayer.filing_status]
     line9 = min(line1, line8)
     line10 = min(line7, line9)
     line11 = line9 - line10  # this amount is taxed at 0%
     line12 = min(line1, line6)
     line13 = line11
     line14 = line12 - line13
-    line15 = policy["cap_gains_upper_threshold"][taxpayer['filing_status']]
+    line15 = policy["cap_gains_upper_threshold"][taxpayer.filing_status]
     line16 = min(line15, line1)
     line17 = line7 + line11
     line18 = max(0, line16 - line17)
@@ -690,37 +688,28 @@ def house_2018_qualified_income(policy, taxpayer, taxable_income, income_tax_bef
 
 def house_ordinary_income_tax(policy, taxpayer, taxable_income, agi):
     brackets = get_brackets(taxpayer, policy)
-    rates = list(reversed(policy["income_tax_rates"]))
+    schedule = get_schedule(taxpayer, policy)
 
-    ordinary_income_tax = 0
     business_income_tax = 0
 
-    taxable_ordinary_income = max(0, taxable_income - taxpayer["business_income"])
-    running_taxable_income = taxable_ordinary_income
-
+    taxable_ordinary_income = max(0, taxable_income - taxpayer.business_income)
     taxable_business_income = max(0, taxable_income - (taxable_ordinary_income))
 
-    i = 0
-    marginal_rates = []
-    applicable_incomes = []
-    for threshold in reversed(brackets):
-        if taxable_income > threshold:
-            applicable_taxable_income = max(0, running_taxable_income - threshold)
-            if applicable_taxable_income > 0:
-                marginal_rates.append(rates[i])
-                if rates[i] != 0.12:
-                    applicable_incomes.append(applicable_taxable_income)
-
-            ordinary_income_tax = ordinary_income_tax + (applicable_taxable_income * rates[i])
-            running_taxable_income = running_taxable_income - applicable_taxable_income
-        i += 1
-
-    try:
-        top_marginal_rate = marginal_rates[0]
-        applicable_income = sum(applicable_incomes)
-    except IndexError:  # taxpayer must have 0 ordinary income in this case
+    ordinary_income_tax = schedule_tax(schedule, taxable_ordinary_income)
+
+    # Top bracket reached by ordinary income, and the ordinary income taxed outside the 12% bracket
+    top = bisect.bisect_left(schedule.thresholds, taxable_ordinary_income) - 1
+    if top < 0:  # taxpayer must have 0 ordinary income in this case
         top_marginal_rate = 0
         applicable_income = 0
+    else:
+        top_marginal_rate = schedule.rates[top]
+        uppers = schedule.thresholds[1:top + 1] + (taxable_ordinary_income,)
+        # Summed from the top bracket down, as the bracket walk did
+        applicable_income = sum(
+            upper - lower
+            for lower, upper, rate in reversed(list(zip(schedule.thresholds, uppers, schedule.rates)))
+            if rate != 0.12)
 
     if top_marginal_rate >= 0.25:  # taxpayer's ordinary is already in the 25% bracket
         business_income_over_25 = taxable_income - brackets[2] - applicable_income
@@ -728,7 +717,7 @@ def house_ordinary_income_tax(policy, taxpayer, taxable_income, agi):
         business_income_tax = (business_income_over_25 * 0.25) + (business_income_under_25 * 0.12)
     else:
         if taxable_income <= brackets[2]:  # bracket at which 25% rate kicks in
-            business_income_tax = taxable_business_income * rates[5]  # 12%
+            business_income_tax = taxable_business_income * schedule.rates[1]  # 12%
         else:
             business_income_over_25 = taxable_income - brackets[2]
             business_income_under_25 = taxable_business_income - business_income_over_25
@@ -745,14 +734,57 @@ def get_gross_income(taxpayer,
                               "qualified_income")):
     income = 0
     for incomeType in incomes:
-        income += taxpayer[incomeType]
+        income += getattr(taxpayer, incomeType)
     return income
 
 
 def get_brackets(taxpayer, policy):
-    if taxpayer['filing_status'] == 0:
+    if taxpayer.filing_status == 0:
         return policy["single_brackets"]
-    elif taxpayer['filing_status'] == 1:
+    elif taxpayer.filing_status == 1:
         return policy["married_brackets"]
     else:
         return policy["hoh_brackets"]
+
+
+# A bracket schedule compiled for lookup: thresholds and rates in bracket order
+# plus the tax owed on the whole of each bracket below the top one.
+BracketSchedule = namedtuple('BracketSchedule', ['thresholds', 'rates', 'bracket_tax'])
+
+
+@functools.lru_cache(maxsize=256)
+def compile_brackets(brackets, rates):
+    """
+    Compile a bracket schedule.
+
+    Precomputes the tax owed on each whole bracket so that tax on any income
+    is a binary search, one multiply and a sum of the brackets below it.
+    Compiled schedules are cached, keyed on the bracket and rate values, so
+    each policy is only compiled once.
+
+    Args:
+        brackets (tuple): Ascending bracket thresholds, e.g. policy["single_brackets"].
+        rates (tuple): Rate applying above each threshold, e.g. policy["income_tax_rates"].
+
+    Returns:
+        BracketSchedule: The compiled schedule.
+    """
+    bracket_tax = tuple((brackets[i] - brackets[i - 1]) * rates[i - 1] for i in range(1, len(brackets)))
+    return BracketSchedule(tuple(brackets), tuple(rates), bracket_tax)
+
+
+def get_schedule(taxpayer, policy):
+    return compile_brackets(tuple(get_brackets(taxpayer, policy)), tuple(policy["income_tax_rates"]))
+
+
+def schedule_tax(schedule, taxable_income):
+    # Only thresholds strictly below taxable_income apply. The whole brackets
+    # are added from the top down, in the order of a walk down the brackets,
+    # so the sum rounds to the same cent.
+    i = bisect.bisect_left(schedule.thresholds, taxable_income) - 1
+    if i < 0:
+        return 0
+    tax = (taxable_income - schedule.thresholds[i]) * schedule.rates[i]
+    for bracket_tax in reversed(schedule.bracket_tax[:i]):
+        tax += bracket_tax
+    return tax
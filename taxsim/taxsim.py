@@ -1,22 +1,22 @@
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import logging
 from datetime import datetime
 import json
 import argparse
+import math
+import multiprocessing
 import sys
-import pandas as pd
-import copy
+import threading
+import time
 
 from . import csv_parser
 from . import tax_funcs
 from . import misc_funcs
-from . import graph
-from . import county_data
-from . import marriage_penalty
+from . import records
+# pandas, tqdm, graph (matplotlib), county_data and marriage_penalty are
+# imported where they are used, so importing this module stays cheap
 
 
-current_datetime = datetime.now().strftime("%Y%m%dT%H%M%S")  # ISO 8601
-
 ##### Default Configuration #####
 MARG_RATE_BOUND = 2500
 ASSUMED_MORTGAGE_RATE = 0.04
@@ -33,177 +33,332 @@ SENATE_2019_SS_FILE = "senate_2019_ss.csv"
 CURRENT_LAW_RESULTS = "current_law_results.csv"
 HOUSE_2018_RESULTS = "house_2018_results.csv"
 SENATE_2018_RESULTS = "senate_2018_results.csv"
-# Directories - These must be wrapped in misc_funcs.require_dir()
-PARAMS_DIR = misc_funcs.require_dir("./params/")
-LOGS_DIR = misc_funcs.require_dir("./logs/")
-RESULTS_DIR = misc_funcs.require_dir("./results/")
-GRAPH_DATA_RESULTS_DIR = misc_funcs.require_dir("./results/graph_data/")
-misc_funcs.require_dir("./results/marriage_penalty/")
-# Logging
-logging.basicConfig(filename=LOGS_DIR + current_datetime + '.log',
-                    level=logging.DEBUG,
-                    format='%(asctime)s %(levelname)s: %(message)s')
+# Directories - Output directories are created with misc_funcs.require_dir() when first written to
+PARAMS_DIR = "./params/"
+LOGS_DIR = "./logs/"
+RESULTS_DIR = "./results/"
+GRAPH_DATA_RESULTS_DIR = "./results/graph_data/"
+MARRIAGE_PENALTY_RESULTS_DIR = "./results/marriage_penalty/"
+JOBS_RESULTS_DIR = "./results/jobs/"
+GRAPH_CACHE_DIR = "./results/graph_data/cache/"
+# Bump when a change to the calculations changes their results; cached graph
+# data is keyed on it (and on the source of the batch engine, see graph.py)
+ENGINE_VERSION = "1"
+
+
+def configure_logging():
+    """Log to a new timestamped file in LOGS_DIR. Called by entry points, never on import."""
+    current_datetime = datetime.now().strftime("%Y%m%dT%H%M%S")  # ISO 8601
+    logging.basicConfig(filename=misc_funcs.require_dir(LOGS_DIR) + current_datetime + '.log',
+                        level=logging.DEBUG,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+
 
 ##### Globals #####
-current_law_policy = csv_parser.load_policy(PARAMS_DIR + CURRENT_LAW_FILE)
-house_2018_policy = csv_parser.load_policy(PARAMS_DIR + HOUSE_2018_FILE)
-senate_2018_policy = csv_parser.load_policy(PARAMS_DIR + SENATE_2018_FILE)
-current_law_2019_policy = csv_parser.load_policy(PARAMS_DIR + CURRENT_LAW_2019_FILE)
-senate_2019_policy = csv_parser.load_policy(PARAMS_DIR + SENATE_2019_FILE)
-senate_2019_ss_policy = csv_parser.load_policy(PARAMS_DIR + SENATE_2019_SS_FILE)
+# Policies are module attributes (taxsim.current_law_policy, ...) parsed from
+# PARAMS_DIR on first access, see __getattr__
+POLICY_FILES = OrderedDict([
+    ('current_law_policy', CURRENT_LAW_FILE),
+    ('house_2018_policy', HOUSE_2018_FILE),
+    ('senate_2018_policy', SENATE_2018_FILE),
+    ('current_law_2019_policy', CURRENT_LAW_2019_FILE),
+    ('senate_2019_policy', SENATE_2019_FILE),
+    ('senate_2019_ss_policy', SENATE_2019_SS_FILE)])
+_policy_lock = threading.Lock()
+
+
+def get_policy(name):
+    """
+    Get a policy by its module attribute name, loading it on first use.
+
+    Args:
+        name (str): A key of POLICY_FILES, e.g. 'current_law_policy'.
+
+    Returns:
+        dict: The policy. Every call returns the same object.
+    """
+    with _policy_lock:
+        policy = globals().get(name)
+        if policy is None:
+            policy = csv_parser.load_policy(PARAMS_DIR + POLICY_FILES[name])
+            # Later lookups find the global and skip __getattr__
+            globals()[name] = policy
+    return policy
+
+
+def __getattr__(name):
+    # Module level __getattr__ (PEP 562) is only called for names not yet defined
+    if name in POLICY_FILES:
+        return get_policy(name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def working_taxpayer(taxpayer):
+    """
+    Copy a taxpayer into the working structure a calculation adjusts.
+
+    Calculations cap and reduce some inputs (mortgage interest, medical
+    expenses, charity, state and local taxes) before using them. They do so on
+    this shallow copy so the caller's taxpayer is never modified; every field
+    is a plain number, so no deep copy is needed. Plain dicts are converted to
+    a records.Taxpayer, which the tax functions read by attribute.
+    """
+    if isinstance(taxpayer, records.Taxpayer):
+        return taxpayer.copy()
+    return records.Taxpayer(taxpayer)
+
+
+##### Marginal Rates #####
+# Called as stage_observer(stage, seconds) after the 'return' and
+# 'marginal_rates' stages of calc_federal_taxes and calc_senate_2018_taxes,
+# e.g. by the API to export stage latencies
+stage_observer = None
+
+# Default marginal rate perturbations: (result name, taxpayer field, step)
+MARGINAL_RATE_PERTURBATIONS = (
+    ('marginal_income_tax_rate', 'ordinary_income1', MARG_RATE_BOUND),
+    ('marginal_business_income_tax_rate', 'business_income', MARG_RATE_BOUND))
+
+# Taxpayer fields read by the stages of a return that marginal rates can reuse
+# from the base return: payroll, schedule SE and EITC, which don't depend on
+# AGI. They are the only stages reused. AGI, taxable income, the bracket tax
+# and everything after them read the perturbed income, directly or through
+# AGI, so each perturbation re-evaluates them.
+STAGE_INPUTS = {
+    "payroll": ("ordinary_income1", "ordinary_income2"),
+    "sched_se": ("business_income",),
+    "eitc": ("ordinary_income1", "ordinary_income2", "child_dep", "filing_status"),
+}
+
+
+def reuse_stage(base_stages, stage, changed_field):
+    """True if a stage of the base return is unaffected by a change to changed_field."""
+    return base_stages is not None and changed_field not in STAGE_INPUTS[stage]
+
+
+def marginal_rates(return_function, taxpayer, policy, base_results, base_stages, perturbations=MARGINAL_RATE_PERTURBATIONS):
+    """
+    Calculate marginal rates from an already calculated base return.
+
+    Each perturbation re-runs return_function with one field increased, on the
+    working copy the return makes anyway. The payroll, schedule SE and EITC
+    stages of the base return are reused when the field is not one of their
+    STAGE_INPUTS; every stage from AGI on is re-evaluated.
+
+    Args:
+        return_function (function): _federal_return or _senate_2018_return.
+        taxpayer (dict): The taxpayer as passed in, before any adjustments.
+        policy (dict): A set of policy parameters, parsed from CSV.
+        base_results (dict): Results of the base return.
+        base_stages (dict): Reusable stages of the base return.
+        perturbations (iterable): (result name, taxpayer field, step) tuples.
+
+    Returns:
+        OrderedDict: Marginal rate for each perturbation, keyed by result name.
+    """
+    # Marginal rate calculations use tax_burden, NOT income_tax_after_credits
+    rates = OrderedDict()
+    for name, field, step in perturbations:
+        perturbed_results, _ = return_function(taxpayer, policy, base_stages, field, step)
+        rates[name] = (perturbed_results["tax_burden"] - base_results["tax_burden"]) / step
+    return rates
+
+
+def calc_marginal_rates(tax_calc, taxpayer, policy, perturbations=MARGINAL_RATE_PERTURBATIONS):
+    """
+    Calculate several marginal rates (income types and step sizes) in one pass.
+
+    Args:
+        tax_calc (function): calc_federal_taxes or calc_senate_2018_taxes.
+        taxpayer (dict): An example taxpayer household.
+        policy (dict): A set of policy parameters, parsed from CSV.
+        perturbations (iterable): (result name, taxpayer field, step) tuples, e.g.
+            ('marginal_qualified_income_tax_rate', 'qualified_income', 1000).
+
+    Returns:
+        OrderedDict: Marginal rate for each perturbation, keyed by result name.
+    """
+    misc_funcs.validate_taxpayer(taxpayer)
+    return_function = RETURN_FUNCTIONS[tax_calc]
+    results, stages = return_function(taxpayer, policy)
+    return marginal_rates(return_function, taxpayer, policy, results, stages, perturbations)
+
+
+def calc_return(return_function, taxpayer, policy, mrate=True):
+    """
+    Validate a taxpayer, calculate a return and, if mrate, its marginal rates.
+
+    Reports how long each stage took to stage_observer when it is set.
+    """
+    misc_funcs.validate_taxpayer(taxpayer)
+    observer = stage_observer
+    start = time.perf_counter()
+    results, stages = return_function(taxpayer, policy)
+    if observer is not None:
+        split = time.perf_counter()
+        observer('return', split - start)
+
+    if mrate is True:
+        results.update(marginal_rates(return_function, taxpayer, policy, results, stages))
+        if observer is not None:
+            observer('marginal_rates', time.perf_counter() - split)
+
+    return results
 
 
 ##### Current Law #####
 def calc_federal_taxes(taxpayer, policy, mrate=True):
-    misc_funcs.validate_taxpayer(taxpayer)
-    temp_taxpayer = copy.deepcopy(taxpayer)
-    results = OrderedDict()
-    taxpayer["interest_paid"] = min(policy['mortgage_interest_cap'] * ASSUMED_MORTGAGE_RATE, taxpayer["interest_paid"])
+    return calc_return(_federal_return, taxpayer, policy, mrate)
+
+
+def _federal_return(taxpayer, policy, base_stages=None, changed_field=None, step=0):
+    # Returns the results and the reusable stages, see STAGE_INPUTS
+    # Adjusted values are written to a working copy, never to the caller's
+    # taxpayer; a marginal rate's increase to changed_field is made on it too
+    taxpayer = working_taxpayer(taxpayer)
+    if changed_field is not None:
+        taxpayer[changed_field] = taxpayer[changed_field] + step
+    results = records.Result()
+    taxpayer.interest_paid = min(policy['mortgage_interest_cap'] * ASSUMED_MORTGAGE_RATE, taxpayer.interest_paid)
 
     # Gross income
-    results["gross_income"] = tax_funcs.get_gross_income(taxpayer)
+    results.gross_income = tax_funcs.get_gross_income(taxpayer)
 
     # Payroll taxes
-    payroll_taxes = tax_funcs.fed_payroll(policy, taxpayer)
-    results["employee_payroll_tax"] = payroll_taxes['employee']
-    results["employer_payroll_tax"] = payroll_taxes['employer']
+    if reuse_stage(base_stages, "payroll", changed_field):
+        payroll_taxes = base_stages["payroll"]
+    else:
+        payroll_taxes = tax_funcs.fed_payroll(policy, taxpayer)
+    results.employee_payroll_tax = payroll_taxes['employee']
+    results.employer_payroll_tax = payroll_taxes['employer']
 
-    sched_se_tax, sched_se_ded = tax_funcs.sched_se(policy, taxpayer, results)
+    if reuse_stage(base_stages, "sched_se", changed_field):
+        sched_se_tax, sched_se_ded = base_stages["sched_se"]
+    else:
+        sched_se_tax, sched_se_ded = tax_funcs.sched_se(policy, taxpayer, results)
 
     # Income after tax-deferred retirement contributions
     ordinary_income_after_401k = (
-        taxpayer['ordinary_income1'] +
-        taxpayer['ordinary_income2'] -
-        taxpayer['401k_contributions'])
-    results["ordinary_income_after_401k"] = ordinary_income_after_401k
+        taxpayer.ordinary_income1 +
+        taxpayer.ordinary_income2 -
+        taxpayer.contributions_401k)
+    results.ordinary_income_after_401k = ordinary_income_after_401k
 
     # AGI
     agi = tax_funcs.fed_agi(policy, taxpayer, ordinary_income_after_401k, sched_se_ded)
-    results["agi"] = agi
+    results.agi = agi
 
-    if (policy["medical_expense_threshold"] * results["agi"]) > taxpayer["medical_expenses"]:
-        taxpayer["medical_expenses"] = 0
+    if (policy["medical_expense_threshold"] * results.agi) > taxpayer.medical_expenses:
+        taxpayer.medical_expenses = 0
     else:
-        taxpayer["medical_expenses"] = taxpayer["medical_expenses"] - (policy["medical_expense_threshold"] * results["agi"])
+        taxpayer.medical_expenses = taxpayer.medical_expenses - (policy["medical_expense_threshold"] * results.agi)
 
-    taxpayer["charity_contributions"] = min(policy['charitable_cont_limit'] * agi, taxpayer["charity_contributions"])
+    taxpayer.charity_contributions = min(policy['charitable_cont_limit'] * agi, taxpayer.charity_contributions)
 
     # Taxable income
     taxable_income, deduction_type, deductions, personal_exemption_amt, pease_limitation_amt = tax_funcs.fed_taxable_income(policy, taxpayer, agi)
-    results["taxable_income"] = taxable_income
-    results["deduction_type"] = deduction_type
-    results["deductions"] = deductions
-    results["personal_exemption_amt"] = personal_exemption_amt
-    results["pease_limitation_amt"] = pease_limitation_amt
-    results['qbi_ded'] = 0
+    results.taxable_income = taxable_income
+    results.deduction_type = deduction_type
+    results.deductions = deductions
+    results.personal_exemption_amt = personal_exemption_amt
+    results.pease_limitation_amt = pease_limitation_amt
+    results.qbi_ded = 0
 
     # Ordinary income tax
     income_tax_before_credits = tax_funcs.fed_ordinary_income_tax(policy, taxpayer, taxable_income)
-    results["income_tax_before_credits"] = income_tax_before_credits
+    results.income_tax_before_credits = income_tax_before_credits
 
     # Qualified income/capital gains
     qualified_income_tax = tax_funcs.fed_qualified_income(policy, taxpayer, taxable_income, income_tax_before_credits)
     income_tax_before_credits = min(income_tax_before_credits, qualified_income_tax)
-    results["qualified_income_tax"] = qualified_income_tax
+    results.qualified_income_tax = qualified_income_tax
     # form1040_line44
-    results["selected_tax_before_credits"] = income_tax_before_credits
+    results.selected_tax_before_credits = income_tax_before_credits
 
     # AMT
     amt, amt_taxable_income = tax_funcs.fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation_amt, income_tax_before_credits, taxable_income)
-    results['amt_taxable_income'] = amt_taxable_income
-    results["amt"] = amt
+    results.amt_taxable_income = amt_taxable_income
+    results.amt = amt
 
     income_tax_before_credits += amt
-    results["income_tax_before_credits_with_amt"] = income_tax_before_credits
+    results.income_tax_before_credits_with_amt = income_tax_before_credits
 
     # CTC
     ctc, actc = tax_funcs.fed_ctc(policy, taxpayer, agi, income_tax_before_credits)
-    results["ctc"] = ctc
-    results["actc"] = actc
+    results.ctc = ctc
+    results.actc = actc
 
     # EITC
-    eitc = tax_funcs.fed_eitc(policy, taxpayer)
-    results["eitc"] = eitc
+    if reuse_stage(base_stages, "eitc", changed_field):
+        eitc = base_stages["eitc"]
+    else:
+        eitc = tax_funcs.fed_eitc(policy, taxpayer)
+    results.eitc = eitc
 
     # $500 nonrefundable credit for qualifying dependents other than qualifying children
-    results["dep_credit"] = 0
+    results.dep_credit = 0
 
     # Tax after nonrefundable credits
     income_tax_after_nonrefundable_credits = round(max(0, income_tax_before_credits - ctc), 2)
-    results["income_tax_after_nonrefundable_credits"] = income_tax_after_nonrefundable_credits
+    results.income_tax_after_nonrefundable_credits = income_tax_after_nonrefundable_credits
 
     # Other taxes
     medicare_surtax, niit = tax_funcs.medsurtax_niit(policy, taxpayer, agi)
-    results["medicare_surtax"] = medicare_surtax
-    results["niit"] = niit
-    results["sched_se_tax"] = sched_se_tax
-    results["income_tax_after_other_taxes"] = income_tax_after_nonrefundable_credits + medicare_surtax + niit + sched_se_tax
+    results.medicare_surtax = medicare_surtax
+    results.niit = niit
+    results.sched_se_tax = sched_se_tax
+    results.income_tax_after_other_taxes = income_tax_after_nonrefundable_credits + medicare_surtax + niit + sched_se_tax
 
     # Tax after ALL credits (payments)
-    results["income_tax_after_credits"] = round(results["income_tax_after_other_taxes"] - actc - eitc, 2)
+    results.income_tax_after_credits = round(results.income_tax_after_other_taxes - actc - eitc, 2)
 
-    results = misc_funcs.calc_effective_rates(results["income_tax_after_credits"],
+    results = misc_funcs.calc_effective_rates(results.income_tax_after_credits,
                                             payroll_taxes,
-                                            results["gross_income"], results)
+                                            results.gross_income, results)
 
-    if mrate is True:
-        # Marginal rate calculations use tax_burden, NOT income_tax_after_credits
-        temp_taxpayer1 = copy.copy(temp_taxpayer)
-        temp_taxpayer1['ordinary_income1'] = temp_taxpayer1['ordinary_income1'] + MARG_RATE_BOUND
-
-        temp_taxpayer2 = copy.copy(temp_taxpayer)
-        temp_taxpayer2['business_income'] = temp_taxpayer2['business_income'] + MARG_RATE_BOUND
-
-        # Setting mrate to True results in infinite recursion
-        temp_results1 = calc_federal_taxes(temp_taxpayer1, policy, mrate=False)
-        marginal_income_tax_rate = (temp_results1["tax_burden"] - results["tax_burden"]) / MARG_RATE_BOUND
-        results['marginal_income_tax_rate'] = marginal_income_tax_rate
-
-        temp_results2 = calc_federal_taxes(temp_taxpayer2, policy, mrate=False)
-        marginal_business_income_tax_rate = (temp_results2["tax_burden"] - results["tax_burden"]) / MARG_RATE_BOUND
-        results['marginal_business_income_tax_rate'] = marginal_business_income_tax_rate
-
-    return results
+    return results, {"payroll": payroll_taxes, "sched_se": (sched_se_tax, sched_se_ded), "eitc": eitc}
 
 
 ##### House 2018 #####
 def calc_house_2018_taxes(taxpayer, policy, mrate=True):
     # WARNING: THIS FUNCTION IS NOT MAINTAINED
     misc_funcs.validate_taxpayer(taxpayer)
-    results = OrderedDict()
+    input_taxpayer = taxpayer
+    taxpayer = working_taxpayer(taxpayer)
+    results = records.Result()
 
     # NEW: Itemized deduction limitations
-    taxpayer["sl_property_tax"] = min(10000, taxpayer["sl_property_tax"])
-    taxpayer["interest_paid"] = min(17500, taxpayer["interest_paid"])  # TODO: Warn if this is happening
-    taxpayer["sl_income_tax"] = 0
-    taxpayer["medical_expenses"] = 0
+    taxpayer.sl_property_tax = min(10000, taxpayer.sl_property_tax)
+    taxpayer.interest_paid = min(17500, taxpayer.interest_paid)  # TODO: Warn if this is happening
+    taxpayer.sl_income_tax = 0
+    taxpayer.medical_expenses = 0
 
     # Gross income
-    results["gross_income"] = tax_funcs.get_gross_income(taxpayer)
+    results.gross_income = tax_funcs.get_gross_income(taxpayer)
 
     # Payroll taxes
     payroll_taxes = tax_funcs.fed_payroll(policy, taxpayer)
-    results["employee_payroll_tax"] = payroll_taxes['employee']
-    results["employer_payroll_tax"] = payroll_taxes['employer']
+    results.employee_payroll_tax = payroll_taxes['employee']
+    results.employer_payroll_tax = payroll_taxes['employer']
 
     # Income after tax-deferred retirement contributions
     ordinary_income_after_401k = (
-        taxpayer['ordinary_income1'] +
-        taxpayer['ordinary_income2'] -
-        taxpayer['401k_contributions'])
-    results["ordinary_income_after_401k"] = ordinary_income_after_401k
+        taxpayer.ordinary_income1 +
+        taxpayer.ordinary_income2 -
+        taxpayer.contributions_401k)
+    results.ordinary_income_after_401k = ordinary_income_after_401k
 
     # AGI
     agi = tax_funcs.fed_agi(policy, taxpayer, ordinary_income_after_401k, 0)
-    results["agi"] = agi
+    results.agi = agi
 
     # Taxable income
     taxable_income, deduction_type, deductions, personal_exemption_amt, pease_limitation_amt = tax_funcs.house_2018_taxable_income(policy, taxpayer, agi)
-    results["taxable_income"] = taxable_income
-    results["deduction_type"] = deduction_type
-    results["deductions"] = deductions
-    results["personal_exemption_amt"] = personal_exemption_amt
-    results["pease_limitation_amt"] = pease_limitation_amt
+    results.taxable_income = taxable_income
+    results.deduction_type = deduction_type
+    results.deductions = deductions
+    results.personal_exemption_amt = personal_exemption_amt
+    results.pease_limitation_amt = pease_limitation_amt
 
     # Ordinary income tax
     income_tax_before_credits = tax_funcs.house_ordinary_income_tax(policy, taxpayer, taxable_income, agi)
@@ -211,16 +366,16 @@ def calc_house_2018_taxes(taxpayer, policy, mrate=True):
     # NEW: Phaseout of benefit of the 12-percent bracket
     po_amount = 0
     lower_rate_po_threshold = [1000000, 1200000, 1000000]
-    if agi > lower_rate_po_threshold[taxpayer["filing_status"]]:
+    if agi > lower_rate_po_threshold[taxpayer.filing_status]:
         brackets = tax_funcs.get_brackets(taxpayer, policy)
         benefit = (
             policy["income_tax_rates"][-1] * brackets[2] -
             policy["income_tax_rates"][0] * brackets[2])
         po_amount = min(
             benefit,
-            0.06 * (agi - lower_rate_po_threshold[taxpayer["filing_status"]]))
+            0.06 * (agi - lower_rate_po_threshold[taxpayer.filing_status]))
     income_tax_before_credits = income_tax_before_credits + po_amount
-    results["income_tax_before_credits"] = income_tax_before_credits
+    results.income_tax_before_credits = income_tax_before_credits
 
     # Qualified income/capital gains
     # NEW: new house_2018_qualified_income function
@@ -232,184 +387,329 @@ def calc_house_2018_taxes(taxpayer, policy, mrate=True):
         po_amount,
         agi)
     income_tax_before_credits = min(income_tax_before_credits, qualified_income_tax)
-    results["qualified_income_tax"] = qualified_income_tax
+    results.qualified_income_tax = qualified_income_tax
     # form1040_line44
-    results["selected_tax_before_credits"] = income_tax_before_credits
+    results.selected_tax_before_credits = income_tax_before_credits
 
     # AMT
     amt, amt_taxable_income = tax_funcs.fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation_amt, income_tax_before_credits, taxable_income)
-    results['amt_taxable_income'] = amt_taxable_income
-    results["amt"] = amt
+    results.amt_taxable_income = amt_taxable_income
+    results.amt = amt
 
     income_tax_before_credits += amt
-    results["income_tax_before_credits_with_amt"] = income_tax_before_credits
+    results.income_tax_before_credits_with_amt = income_tax_before_credits
 
     # CTC
     ctc, actc = tax_funcs.fed_ctc_actc_limited(policy, taxpayer, agi, 1100, income_tax_before_credits)  # may be broken
-    results["ctc"] = ctc
-    results["actc"] = actc
+    results.ctc = ctc
+    results.actc = actc
 
     # EITC
     eitc = tax_funcs.fed_eitc(policy, taxpayer)
-    results["eitc"] = eitc
+    results.eitc = eitc
     # NEW: Personal credit
     num_taxpayers = 1
-    if taxpayer["filing_status"] == 1:  # married
+    if taxpayer.filing_status == 1:  # married
         num_taxpayers = 2
     personal_credit = (num_taxpayers) * 300
-    results["personal_credit"] = personal_credit
+    results.personal_credit = personal_credit
 
     # Tax after nonrefundable credits
     income_tax_after_credits = round(max(
         0,
         income_tax_before_credits - ctc - personal_credit), 2)
-    results["income_tax_after_nonrefundable_credits"] = income_tax_after_credits
+    results.income_tax_after_nonrefundable_credits = income_tax_after_credits
 
     # Tax after ALL credits
-    results["income_tax_after_credits"] = round(
+    results.income_tax_after_credits = round(
         income_tax_after_credits - actc - eitc, 2)
 
-    results = misc_funcs.calc_effective_rates(results["income_tax_after_credits"],
+    results = misc_funcs.calc_effective_rates(results.income_tax_after_credits,
                                             payroll_taxes,
-                                            results["gross_income"], results)
+                                            results.gross_income, results)
 
     if mrate is True:
         # Marginal rate calculations use tax_burden, NOT income_tax_after_credits
-        temp_taxpayer1 = copy.copy(taxpayer)
+        temp_taxpayer1 = working_taxpayer(input_taxpayer)
         temp_taxpayer1['ordinary_income1'] = temp_taxpayer1['ordinary_income1'] + MARG_RATE_BOUND
 
-        temp_taxpayer2 = copy.copy(taxpayer)
+        temp_taxpayer2 = working_taxpayer(input_taxpayer)
         temp_taxpayer2['business_income'] = temp_taxpayer2['business_income'] + MARG_RATE_BOUND
 
         # Setting mrate to True results in infinite recursion
         temp_results1 = calc_house_2018_taxes(temp_taxpayer1, policy, mrate=False)
-        marginal_income_tax_rate = (temp_results1["tax_burden"] - results["tax_burden"]) / MARG_RATE_BOUND
-        results['marginal_income_tax_rate'] = marginal_income_tax_rate
+        marginal_income_tax_rate = (temp_results1["tax_burden"] - results.tax_burden) / MARG_RATE_BOUND
+        results.marginal_income_tax_rate = marginal_income_tax_rate
 
         temp_results2 = calc_house_2018_taxes(temp_taxpayer2, policy, mrate=False)
-        marginal_business_income_tax_rate = (temp_results2["tax_burden"] - results["tax_burden"]) / MARG_RATE_BOUND
-        results['marginal_business_income_tax_rate'] = marginal_business_income_tax_rate
+        marginal_business_income_tax_rate = (temp_results2["tax_burden"] - results.tax_burden) / MARG_RATE_BOUND
+        results.marginal_business_income_tax_rate = marginal_business_income_tax_rate
 
     return results
 
 
 ##### Senate 2018 #####
 def calc_senate_2018_taxes(taxpayer, policy, mrate=True):
-    misc_funcs.validate_taxpayer(taxpayer)
-    temp_taxpayer = copy.deepcopy(taxpayer)
-    results = OrderedDict()
+    return calc_return(_senate_2018_return, taxpayer, policy, mrate)
+
 
-    taxpayer["sl_property_tax"] = min(policy["taxes_paid_deduction_limit"], taxpayer["sl_property_tax"] + taxpayer["sl_income_tax"])  # sl_income_tax will be included in sl_property_tax
-    taxpayer["sl_income_tax"] = 0
-    taxpayer["interest_paid"] = min(policy['mortgage_interest_cap'] * ASSUMED_MORTGAGE_RATE, taxpayer["interest_paid"])
+def _senate_2018_return(taxpayer, policy, base_stages=None, changed_field=None, step=0):
+    # Returns the results and the reusable stages, see STAGE_INPUTS
+    # Adjusted values are written to a working copy, never to the caller's
+    # taxpayer; a marginal rate's increase to changed_field is made on it too
+    taxpayer = working_taxpayer(taxpayer)
+    if changed_field is not None:
+        taxpayer[changed_field] = taxpayer[changed_field] + step
+    results = records.Result()
+
+    taxpayer.sl_property_tax = min(policy["taxes_paid_deduction_limit"], taxpayer.sl_property_tax + taxpayer.sl_income_tax)  # sl_income_tax will be included in sl_property_tax
+    taxpayer.sl_income_tax = 0
+    taxpayer.interest_paid = min(policy['mortgage_interest_cap'] * ASSUMED_MORTGAGE_RATE, taxpayer.interest_paid)
 
     # Gross income
-    results["gross_income"] = tax_funcs.get_gross_income(taxpayer)
+    results.gross_income = tax_funcs.get_gross_income(taxpayer)
 
     # Payroll taxes
-    payroll_taxes = tax_funcs.fed_payroll(policy, taxpayer)
-    results["employee_payroll_tax"] = payroll_taxes['employee']
-    results["employer_payroll_tax"] = payroll_taxes['employer']
+    if reuse_stage(base_stages, "payroll", changed_field):
+        payroll_taxes = base_stages["payroll"]
+    else:
+        payroll_taxes = tax_funcs.fed_payroll(policy, taxpayer)
+    results.employee_payroll_tax = payroll_taxes['employee']
+    results.employer_payroll_tax = payroll_taxes['employer']
 
-    sched_se_tax, sched_se_ded = tax_funcs.sched_se(policy, taxpayer, results)
+    if reuse_stage(base_stages, "sched_se", changed_field):
+        sched_se_tax, sched_se_ded = base_stages["sched_se"]
+    else:
+        sched_se_tax, sched_se_ded = tax_funcs.sched_se(policy, taxpayer, results)
 
     # Income after tax-deferred retirement contributions
-    ordinary_income_after_401k = taxpayer['ordinary_income1'] + taxpayer['ordinary_income2'] - taxpayer['401k_contributions']
-    results["ordinary_income_after_401k"] = ordinary_income_after_401k
+    ordinary_income_after_401k = taxpayer.ordinary_income1 + taxpayer.ordinary_income2 - taxpayer.contributions_401k
+    results.ordinary_income_after_401k = ordinary_income_after_401k
 
     # AGI
     agi = tax_funcs.fed_agi(policy, taxpayer, ordinary_income_after_401k, sched_se_ded)
-    results["agi"] = agi
+    results.agi = agi
 
-    if (policy["medical_expense_threshold"] * results["agi"]) > taxpayer["medical_expenses"]:
-        taxpayer["medical_expenses"] = 0
+    if (policy["medical_expense_threshold"] * results.agi) > taxpayer.medical_expenses:
+        taxpayer.medical_expenses = 0
     else:
-        taxpayer["medical_expenses"] = taxpayer["medical_expenses"] - (policy["medical_expense_threshold"] * results["agi"])
+        taxpayer.medical_expenses = taxpayer.medical_expenses - (policy["medical_expense_threshold"] * results.agi)
 
-    taxpayer["charity_contributions"] = min(policy['charitable_cont_limit'] * agi, taxpayer["charity_contributions"])
+    taxpayer.charity_contributions = min(policy['charitable_cont_limit'] * agi, taxpayer.charity_contributions)
 
     # Taxable income
     taxable_income, deduction_type, deductions, personal_exemption_amt, pease_limitation_amt, taxable_income_before, new_agi, business_income_deduction = tax_funcs.senate_2018_taxable_income(policy, taxpayer, agi)
-    results["taxable_income"] = taxable_income
-    # results["taxable_income_before"] = taxable_income_before
-    results["deduction_type"] = deduction_type
-    results["deductions"] = deductions
-    results["personal_exemption_amt"] = personal_exemption_amt
-    results["pease_limitation_amt"] = pease_limitation_amt
+    results.taxable_income = taxable_income
+    # results.taxable_income_before = taxable_income_before
+    results.deduction_type = deduction_type
+    results.deductions = deductions
+    results.personal_exemption_amt = personal_exemption_amt
+    results.pease_limitation_amt = pease_limitation_amt
     agi = new_agi
-    results['agi'] = new_agi
-    results['qbi_ded'] = business_income_deduction
+    results.agi = new_agi
+    results.qbi_ded = business_income_deduction
 
     # Ordinary income tax
     income_tax_before_credits = tax_funcs.fed_ordinary_income_tax(policy, taxpayer, taxable_income)
-    results["income_tax_before_credits"] = income_tax_before_credits
+    results.income_tax_before_credits = income_tax_before_credits
 
     # Qualified income/capital gains
     qualified_income_tax = tax_funcs.fed_qualified_income(policy, taxpayer, taxable_income, income_tax_before_credits)
     income_tax_before_credits = min(income_tax_before_credits, qualified_income_tax)
-    results["qualified_income_tax"] = qualified_income_tax
-    results["selected_tax_before_credits"] = income_tax_before_credits  # form1040_line44
+    results.qualified_income_tax = qualified_income_tax
+    results.selected_tax_before_credits = income_tax_before_credits  # form1040_line44
 
     # AMT
     amt, amt_taxable_income = tax_funcs.fed_amt(policy, taxpayer, deduction_type, deductions, agi, pease_limitation_amt, income_tax_before_credits, taxable_income)
-    results['amt_taxable_income'] = amt_taxable_income
-    results["amt"] = amt
+    results.amt_taxable_income = amt_taxable_income
+    results.amt = amt
 
     income_tax_before_credits = income_tax_before_credits + amt
-    results["income_tax_before_credits_with_amt"] = income_tax_before_credits
+    results.income_tax_before_credits_with_amt = income_tax_before_credits
 
     # CTC
     ctc, actc = tax_funcs.fed_ctc_actc_limited(policy, taxpayer, agi, policy["actc_limit"], income_tax_before_credits)
-    results["ctc"] = ctc
-    results["actc"] = actc
+    results.ctc = ctc
+    results.actc = actc
 
     # EITC
-    eitc = tax_funcs.fed_eitc(policy, taxpayer)
-    results["eitc"] = eitc
+    if reuse_stage(base_stages, "eitc", changed_field):
+        eitc = base_stages["eitc"]
+    else:
+        eitc = tax_funcs.fed_eitc(policy, taxpayer)
+    results.eitc = eitc
 
     # $500 nonrefundable credit for qualifying dependents other than qualifying children
-    dep_credit = policy["nonchild_dep_credit"] * taxpayer["nonchild_dep"]
-    results["dep_credit"] = dep_credit
+    dep_credit = policy["nonchild_dep_credit"] * taxpayer.nonchild_dep
+    results.dep_credit = dep_credit
 
     # Tax after nonrefundable credits
     income_tax_after_nonrefundable_credits = round(max(0, income_tax_before_credits - ctc - dep_credit), 2)
-    results["income_tax_after_nonrefundable_credits"] = income_tax_after_nonrefundable_credits
+    results.income_tax_after_nonrefundable_credits = income_tax_after_nonrefundable_credits
 
     # Other taxes
     medicare_surtax, niit = tax_funcs.medsurtax_niit(policy, taxpayer, agi)
-    results["medicare_surtax"] = medicare_surtax
-    results["niit"] = niit
-    results["sched_se_tax"] = sched_se_tax
-    results["income_tax_after_other_taxes"] = income_tax_after_nonrefundable_credits + medicare_surtax + niit + sched_se_tax
+    results.medicare_surtax = medicare_surtax
+    results.niit = niit
+    results.sched_se_tax = sched_se_tax
+    results.income_tax_after_other_taxes = income_tax_after_nonrefundable_credits + medicare_surtax + niit + sched_se_tax
 
     # Tax after ALL credits (payments)
-    results["income_tax_after_credits"] = round(results["income_tax_after_other_taxes"] - actc - eitc, 2)
+    results.income_tax_after_credits = round(results.income_tax_after_other_taxes - actc - eitc, 2)
 
-    results = misc_funcs.calc_effective_rates(results["income_tax_after_credits"],
+    results = misc_funcs.calc_effective_rates(results.income_tax_after_credits,
                                             payroll_taxes,
-                                            results["gross_income"], results)
+                                            results.gross_income, results)
 
-    if mrate is True:
-        # Marginal rate calculations use tax_burden, NOT income_tax_after_credits
-        temp_taxpayer1 = copy.copy(temp_taxpayer)
-        temp_taxpayer1['ordinary_income1'] = temp_taxpayer1['ordinary_income1'] + MARG_RATE_BOUND
+    return results, {"payroll": payroll_taxes, "sched_se": (sched_se_tax, sched_se_ded), "eitc": eitc}
 
-        temp_taxpayer2 = copy.copy(temp_taxpayer)
-        temp_taxpayer2['business_income'] = temp_taxpayer2['business_income'] + MARG_RATE_BOUND
 
-        # Setting mrate to True results in infinite recursion
-        temp_results1 = calc_senate_2018_taxes(temp_taxpayer1, policy, mrate=False)
-        marginal_income_tax_rate = (temp_results1["tax_burden"] - results["tax_burden"]) / MARG_RATE_BOUND
-        results['marginal_income_tax_rate'] = marginal_income_tax_rate
+RETURN_FUNCTIONS = {
+    calc_federal_taxes: _federal_return,
+    calc_senate_2018_taxes: _senate_2018_return,
+}
 
-        temp_results2 = calc_senate_2018_taxes(temp_taxpayer2, policy, mrate=False)
-        marginal_business_income_tax_rate = (temp_results2["tax_burden"] - results["tax_burden"]) / MARG_RATE_BOUND
-        results['marginal_business_income_tax_rate'] = marginal_business_income_tax_rate
 
-    return results
+##### Batch Run #####
+# Taxpayers read, calculated and written at a time by main()
+CHUNK_SIZE = 1000
+# Chunks handed to each worker process, enough to keep every worker busy until the end
+CHUNKS_PER_JOB = 4
+# Policies loaded by each worker process, see _init_worker
+_worker_policies = None
+
+
+def load_main_policies(params_dir=PARAMS_DIR):
+    """Load the current law, House 2018 and Senate 2018 policies calculated by main()."""
+    return (csv_parser.load_policy(params_dir + CURRENT_LAW_FILE),
+            csv_parser.load_policy(params_dir + HOUSE_2018_FILE),
+            csv_parser.load_policy(params_dir + SENATE_2018_FILE))
+
+
+def calc_taxpayers(taxpayers, policies, start=0, progress=None):
+    """
+    Calculate current law, House 2018 and Senate 2018 taxes for each taxpayer.
+
+    Args:
+        taxpayers (list): Taxpayers, as returned by csv_parser.load_taxpayers.
+        policies (tuple): Current law, House 2018 and Senate 2018 policies.
+        start (int): Index of the first taxpayer in the input, for logging.
+        progress (tqdm): Progress bar to advance per taxpayer, if any.
+
+    Returns:
+        tuple: Current law, House 2018 and Senate 2018 result lists, in input order.
+    """
+    current_law_policy, house_2018_policy, senate_2018_policy = policies
+    current_law_results = []
+    house_2018_results = []
+    senate_2018_results = []
+    # Results are only dumped to the log, which takes longer than calculating
+    # them, when DEBUG logging is on
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    for i, filer in enumerate(taxpayers, start):
+        filer_number = str(i + 1)
+
+        logging.info("Running calc_federal_taxes for filer #" + filer_number)
+        current_law_result = calc_federal_taxes(filer, current_law_policy)
+        current_law_results.append(current_law_result)
+        if debug:
+            logging.debug(json.dumps(current_law_result.to_dict(), indent=4))
+
+        logging.info("Running calc_house_2018_taxes for filer #" + filer_number)
+        house_2018_result = calc_house_2018_taxes(filer, house_2018_policy)
+        house_2018_results.append(house_2018_result)
+        if debug:
+            logging.debug(json.dumps(house_2018_result.to_dict(), indent=4))
+
+        logging.info("Running calc_senate_2018_taxes for filer #" + filer_number)
+        senate_2018_result = calc_senate_2018_taxes(filer, senate_2018_policy)
+        senate_2018_results.append(senate_2018_result)
+        if debug:
+            logging.debug(json.dumps(senate_2018_result.to_dict(), indent=4))
+
+        if progress is not None:
+            progress.update(1)
+
+    return current_law_results, house_2018_results, senate_2018_results
+
+
+def _init_worker(params_dir):
+    # Runs once in each worker process
+    global _worker_policies
+    _worker_policies = load_main_policies(params_dir)
+
+
+def _calc_chunk(chunk):
+    start, taxpayers = chunk
+    return calc_taxpayers(taxpayers, _worker_policies, start)
+
+
+def calc_chunks(chunks, policies):
+    """
+    Calculate taxes for a stream of taxpayer chunks, one chunk at a time.
+
+    Args:
+        chunks (iterable): Lists of taxpayers, e.g. from misc_funcs.chunked.
+        policies (tuple): Current law, House 2018 and Senate 2018 policies.
+
+    Yields:
+        tuple: Current law, House 2018 and Senate 2018 result lists for each chunk.
+    """
+    start = 0
+    for chunk in chunks:
+        yield calc_taxpayers(chunk, policies, start)
+        start += len(chunk)
+
+
+def calc_chunks_parallel(chunks, jobs):
+    """
+    Calculate taxes like calc_chunks, across a process pool.
+
+    Each worker loads the policies once. At most CHUNKS_PER_JOB chunks per
+    worker are in flight, so chunks are read from the input only as fast as
+    they are calculated, and results are yielded in input order.
+
+    Args:
+        chunks (iterable): Lists of taxpayers, e.g. from misc_funcs.chunked.
+        jobs (int): Number of worker processes.
+
+    Yields:
+        tuple: Current law, House 2018 and Senate 2018 result lists for each chunk.
+    """
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(PARAMS_DIR,)) as pool:
+        pending = deque()
+        start = 0
+        for chunk in chunks:
+            pending.append(pool.apply_async(_calc_chunk, ((start, chunk),)))
+            start += len(chunk)
+            if len(pending) >= jobs * CHUNKS_PER_JOB:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def calc_taxpayers_parallel(taxpayers, jobs):
+    """
+    Calculate taxes like calc_taxpayers, split into chunks across a process pool.
+
+    Args:
+        taxpayers (list): Taxpayers, as returned by csv_parser.load_taxpayers.
+        jobs (int): Number of worker processes.
+
+    Returns:
+        tuple: Current law, House 2018 and Senate 2018 result lists, in input order.
+    """
+    chunk_size = max(1, math.ceil(len(taxpayers) / (jobs * CHUNKS_PER_JOB)))
+    all_results = ([], [], [])
+    for chunk_results in calc_chunks_parallel(misc_funcs.chunked(taxpayers, chunk_size), jobs):
+        for results, chunk_result in zip(all_results, chunk_results):
+            results.extend(chunk_result)
+    return all_results
 
 
 def main():
+    configure_logging()
+
     ##### Argument Parsing #####
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input',
@@ -432,11 +732,22 @@ def main():
                         help='estimate county level tax liability (INCOMPLETE)')
     parser.add_argument('-mp', '--marriagepenalty', action='store_true',
                         help='generate marriage penalty dataset')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        metavar="N",
+                        help='calculate taxpayers or render graphs in N worker processes (0 uses every core)')
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=CHUNK_SIZE,
+                        metavar="N",
+                        help='read, calculate and write taxpayers N at a time')
     args, unknown = parser.parse_known_args()
 
     # Check for unknown arguments and log warning
     if unknown != []:
         logging.warning("Unknown argument(s) passed: " + str(unknown))
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
 
     # Generate blank CSV
     if args.gencsv != "":
@@ -446,63 +757,75 @@ def main():
 
     # Render plots
     if args.plot == "average":
-        graph.render_graphs("average")
+        from . import graph
+        graph.render_graphs("average", jobs)
         quit()
     elif args.plot == "marginal":
-        graph.render_graphs("marginal")
+        from . import graph
+        graph.render_graphs("marginal", jobs)
         quit()
     elif args.plot == "marriagepenalty":
+        from . import marriage_penalty
         marriage_penalty.plot_datasets()
         quit()
 
     # County data
     if args.county is True:
         logging.info("Starting county level data module")
+        import pandas as pd
+        from . import county_data
         county_results = county_data.process_county_data()
         county_results = pd.DataFrame(county_results)
-        county_results.to_csv(RESULTS_DIR + 'county_results.csv', index=False)
+        county_results.to_csv(misc_funcs.require_dir(RESULTS_DIR) + 'county_results.csv', index=False)
         quit()
 
     # County data
     if args.marriagepenalty is True:
         logging.info("Processing marriage penalty dataset")
+        from . import marriage_penalty
         marriage_penalty.gen_datasets()
         # marriage_penalty.plot_datasets()
         quit()
 
     ##### Main Script #####
-    taxpayers = csv_parser.load_taxpayers(args.input)
+    # Taxpayers are read, calculated and written one chunk at a time, so memory
+    # use does not grow with the size of the input file
+    chunks = misc_funcs.chunked(csv_parser.iter_taxpayers(args.input), args.chunk_size)
 
     logging.info("Begining calculation for taxpayers in: " + TAXPAYERS_FILE)
-    current_law_results = []
-    house_2018_results = []
-    senate_2018_results = []
-    for i in range(len(taxpayers)):
-        filer = taxpayers[i]
-        filer_number = str(i + 1)
-
-        filer1 = copy.deepcopy(filer)
-        filer2 = copy.deepcopy(filer)
-        filer3 = copy.deepcopy(filer)
-
-        logging.info("Running calc_federal_taxes for filer #" + filer_number)
-        current_law_result = calc_federal_taxes(filer1, current_law_policy)
-        current_law_results.append(current_law_result)
-        logging.debug(json.dumps(current_law_result, indent=4))
-
-        logging.info("Running calc_house_2018_taxes for filer #" + filer_number)
-        house_2018_result = calc_house_2018_taxes(filer2, house_2018_policy)
-        house_2018_results.append(house_2018_result)
-        logging.debug(json.dumps(house_2018_result, indent=4))
-
-        logging.info("Running calc_senate_2018_taxes for filer #" + filer_number)
-        senate_2018_result = calc_senate_2018_taxes(filer3, senate_2018_policy)
-        senate_2018_results.append(senate_2018_result)
-        logging.debug(json.dumps(senate_2018_result, indent=4))
-
-    csv_parser.write_results(current_law_results, RESULTS_DIR + CURRENT_LAW_RESULTS)
-    csv_parser.write_results(house_2018_results, RESULTS_DIR + HOUSE_2018_RESULTS)
-    csv_parser.write_results(senate_2018_results, RESULTS_DIR + SENATE_2018_RESULTS)
+    if jobs == 1:
+        policies = (get_policy('current_law_policy'), get_policy('house_2018_policy'), get_policy('senate_2018_policy'))
+        all_results = calc_chunks(chunks, policies)
+    else:
+        all_results = calc_chunks_parallel(chunks, jobs)
+
+    from tqdm import tqdm
+    misc_funcs.require_dir(RESULTS_DIR)
+    count = 0
+    start_time = time.perf_counter()
+    try:
+        with tqdm(unit="taxpayer") as progress, \
+                csv_parser.ResultsWriter(RESULTS_DIR + CURRENT_LAW_RESULTS) as current_law_writer, \
+                csv_parser.ResultsWriter(RESULTS_DIR + HOUSE_2018_RESULTS) as house_2018_writer, \
+                csv_parser.ResultsWriter(RESULTS_DIR + SENATE_2018_RESULTS) as senate_2018_writer:
+            writers = (current_law_writer, house_2018_writer, senate_2018_writer)
+            for chunk_results in all_results:
+                for writer, results in zip(writers, chunk_results):
+                    writer.write(results)
+                count += len(chunk_results[0])
+                progress.update(len(chunk_results[0]))
+    except PermissionError as e:
+        print("PermissionError: Results file in use. Please close '" + e.filename + "' and try again.")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+
+    report = "Calculated {count} taxpayers under 3 policies in {elapsed:.2f}s ({rate:.1f} taxpayers/s, {jobs} job(s))".format(
+        count=count,
+        elapsed=elapsed,
+        rate=count / elapsed if elapsed > 0 else 0,
+        jobs=jobs)
+    logging.info(report)
+    print(report)
 
     # Success
     sys.exit(0)
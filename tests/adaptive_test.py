@@ -0,0 +1,61 @@
+from context import *
+
+import numpy as np
+import pytest
+
+import taxsim.adaptive as adaptive
+
+
+def rates(income):
+    # A ramp from 1000 to 3500 like a marginal rate across a kink, a jump at
+    # 6000 and a bump 2500 wide at 40000 like a marginal rate across a jump
+    ramp = 0.1 + 0.15 * np.clip((income - 1000) / 2500, 0, 1)
+    bump = 0.02 * np.clip(1 - np.abs(income - 40000) / 1250, 0, 1)
+    return np.column_stack([ramp + 0.1 * (income > 6000) + bump, np.full(len(income), 0.3)])
+
+
+def test_sample_within_tolerance():
+    # Knots either side of the jump at 6000
+    samples = adaptive.sample(rates, 0, 100000, max_spacing=2500, knots=[6000, 6000.01])
+
+    assert samples.converged
+    assert samples.income[0] == 0 and samples.income[-1] == 100000
+    assert np.array_equal(samples.values, rates(samples.income))
+    income = np.linspace(0, 100000, 100001)
+    income = income[np.abs(income - 6000) > adaptive.DEFAULT_MIN_SPACING]
+    interpolated = np.interp(income, samples.income, samples.values[:, 0])
+    assert np.abs(interpolated - rates(income)[:, 0]).max() <= 2 * adaptive.DEFAULT_TOLERANCE
+    # Dense only at the jump, the ends of the ramp and the bump
+    assert len(samples.income) < 400
+    assert np.diff(samples.income).max() > 10 * np.diff(samples.income).min()
+
+
+def test_sample_unknown_jump_not_converged():
+    samples = adaptive.sample(rates, 0, 100000, max_spacing=2500)
+
+    # The jump is narrowed down to min_spacing but can't be interpolated
+    assert not samples.converged
+    below = samples.income[samples.income <= 6000].max()
+    above = samples.income[samples.income > 6000].min()
+    assert above - below < 4 * adaptive.DEFAULT_MIN_SPACING
+
+
+def test_sample_coarse_grid_misses_narrow_bump():
+    samples = adaptive.sample(rates, 0, 100000, initial_points=5)
+    assert samples.values[:, 0].max() == pytest.approx(0.35)
+
+    samples = adaptive.sample(rates, 0, 100000, initial_points=5, knots=[40000])
+    assert samples.values[:, 0].max() == pytest.approx(0.37)
+
+
+def test_sample_point_budget():
+    samples = adaptive.sample(rates, 0, 100000, tolerance=0, max_points=200, max_spacing=2500)
+
+    assert not samples.converged
+    assert len(samples.income) <= 200
+
+
+@pytest.mark.parametrize('lo, hi, max_points', [(100, 100, 2000), (0, 100, 10)])
+def test_sample_bad_arguments(lo, hi, max_points):
+    with pytest.raises(ValueError):
+        adaptive.sample(rates, lo, hi, max_points=max_points)
@@ -1,8 +1,15 @@
 from context import *
 
+import io
+import itertools
 import json
+import threading
+import time
+
+import pytest
 
 import api
+import taxsim.plans as plans
 
 
 def test_api_200():
@@ -140,3 +147,329 @@ def test_api_failure_not_json():
         resp = web.post('/taxcalc/tcja_submit', data="not json data", headers={'content-type': 'application/json'})
 
         assert resp.status_code == 400
+
+
+def make_submission(**fields):
+    submission = misc_funcs.create_taxpayer().to_dict()
+    submission.update(fields)
+    return submission
+
+
+def test_api_batch_json_array():
+    submissions = [make_submission(ordinary_income1=income) for income in (10000, 50000, 250000)]
+    with api.app.test_client() as web:
+        resp = web.post('/taxcalc/batch', data=json.dumps(submissions), headers={'content-type': 'application/json'})
+        single = web.post('/taxcalc/tcja_submit', data=json.dumps(submissions[1]), headers={'content-type': 'application/json'})
+
+    assert resp.status_code == 200
+    rows = resp.get_json()
+    assert [row['row'] for row in rows] == [0, 1, 2]
+    for plan_results, single_results in zip(rows[1]['taxes'], single.get_json()):
+        assert plan_results['plan'] == single_results['plan']
+        for key, value in single_results['results'].items():
+            assert plan_results['results'][key] == pytest.approx(value, abs=1e-6), key
+
+
+def test_api_batch_ndjson_row_errors():
+    lines = [
+        json.dumps(make_submission(ordinary_income1=50000)),
+        json.dumps(make_submission(filing_status=0, child_dep=1)),
+        "not json",
+        "",
+        json.dumps(make_submission(ordinary_income1="bad stuff!")),
+        json.dumps({"child_dep": 1}),
+        json.dumps(make_submission(filing_status=1, child_dep=2, ordinary_income1=80000))]
+    with api.app.test_client() as web:
+        resp = web.post('/taxcalc/batch', data="\n".join(lines), headers={'content-type': 'application/x-ndjson'})
+
+    assert resp.status_code == 200
+    rows = resp.get_json()
+    assert [row['row'] for row in rows] == [0, 1, 2, 3, 4, 5]
+    assert [('error' in row) for row in rows] == [False, True, True, True, True, False]
+    assert len(rows[0]['taxes']) == len(plans.DEFAULT_PLANS)
+    assert rows[4]['error'] == "Missing field: filing_status"
+    expected = taxsim.calc_senate_2018_taxes(make_submission(filing_status=1, child_dep=2, ordinary_income1=80000), taxsim.senate_2018_policy)
+    assert rows[5]['taxes'][1]['results']['tax_burden'] == pytest.approx(expected['tax_burden'])
+
+
+def test_api_batch_malformed():
+    with api.app.test_client() as web:
+        assert web.post('/taxcalc/batch', data="[1, 2", headers={'content-type': 'application/json'}).status_code == 400
+        resp = web.post('/taxcalc/batch', data="[]", headers={'content-type': 'application/json'})
+        assert resp.status_code == 200
+        assert resp.get_json() == []
+
+
+def test_api_default_plans():
+    with api.app.test_client() as web:
+        resp = web.post('/taxcalc/tcja_submit', data=json.dumps(make_submission()), headers={'content-type': 'application/json'})
+
+    assert resp.status_code == 200
+    assert [(result['plan']['id'], result['plan']['year']) for result in resp.get_json()] == [
+        ('pre-tcja', 2018), ('tcja', 2018), ('pre-tcja', 2019), ('tcja', 2019)]
+
+
+def test_api_select_plans():
+    submission = json.dumps(make_submission(ordinary_income1=50000))
+    with api.app.test_client() as web:
+        resp = web.post('/taxcalc/tcja_submit?plans=tcja,ss2100&years=2019', data=submission, headers={'content-type': 'application/json'})
+        batch_resp = web.post('/taxcalc/batch?plans=ss2100', data="[" + submission + "]", headers={'content-type': 'application/json'})
+
+    assert resp.status_code == 200
+    assert [result['plan']['id'] for result in resp.get_json()] == ['tcja', 'ss2100']
+    expected = taxsim.calc_senate_2018_taxes(make_submission(ordinary_income1=50000), taxsim.senate_2019_ss_policy)
+    assert resp.get_json()[1]['results']['tax_burden'] == pytest.approx(expected['tax_burden'])
+    assert batch_resp.status_code == 200
+    assert [taxes['plan']['id'] for taxes in batch_resp.get_json()[0]['taxes']] == ['ss2100']
+
+
+def test_api_select_unknown_plan():
+    submission = json.dumps(make_submission())
+    with api.app.test_client() as web:
+        for query in ('plans=flat-tax', 'years=1999', 'years=next', 'plans=ss2100&years=2018'):
+            assert web.post('/taxcalc/tcja_submit?' + query, data=submission, headers={'content-type': 'application/json'}).status_code == 400
+            assert web.post('/taxcalc/batch?' + query, data="[]", headers={'content-type': 'application/json'}).status_code == 400
+
+
+def test_api_list_plans():
+    with api.app.test_client() as web:
+        resp = web.get('/taxcalc/plans')
+
+    assert resp.status_code == 200
+    assert [(plan['id'], plan['default']) for plan in resp.get_json()][-1] == ('ss2100', False)
+
+
+def test_api_fields_projection():
+    submission = make_submission(ordinary_income1=50000, business_income=20000)
+    with api.app.test_client() as web:
+        full = web.post('/taxcalc/tcja_submit', data=json.dumps(submission), headers={'content-type': 'application/json'})
+        resp = web.post('/taxcalc/tcja_submit?fields=take_home_pay,tax_burden', data=json.dumps(submission), headers={'content-type': 'application/json'})
+        with_rate = web.post('/taxcalc/tcja_submit?fields=marginal_income_tax_rate', data=json.dumps(submission), headers={'content-type': 'application/json'})
+        batch_resp = web.post('/taxcalc/batch?fields=take_home_pay,tax_burden', data=json.dumps([submission]), headers={'content-type': 'application/json'})
+        assert web.post('/taxcalc/tcja_submit?fields=nope', data=json.dumps(submission), headers={'content-type': 'application/json'}).status_code == 400
+
+    assert resp.status_code == 200
+    for projected, result in zip(resp.get_json(), full.get_json()):
+        assert projected['results'] == {'take_home_pay': result['results']['take_home_pay'],
+                                        'tax_burden': result['results']['tax_burden']}
+    for projected, result in zip(batch_resp.get_json()[0]['taxes'], full.get_json()):
+        assert set(projected['results']) == {'take_home_pay', 'tax_burden'}
+        assert projected['results']['tax_burden'] == pytest.approx(result['results']['tax_burden'])
+    for projected, result in zip(with_rate.get_json(), full.get_json()):
+        assert projected['results'] == {'marginal_income_tax_rate': result['results']['marginal_income_tax_rate']}
+
+
+def test_api_response_cache():
+    api.response_cache.invalidate()
+    submission = make_submission(ordinary_income1=123456)
+    reordered = dict(reversed(list(submission.items())))
+    with api.app.test_client() as web:
+        first = web.post('/taxcalc/tcja_submit', data=json.dumps(submission), headers={'content-type': 'application/json'})
+        calculations = api.cache.info()
+        second = web.post('/taxcalc/tcja_submit', data=json.dumps(reordered), headers={'content-type': 'application/json'})
+        assert api.cache.info() == calculations  # answered without touching the result cache
+        projected = web.post('/taxcalc/tcja_submit?fields=tax_burden', data=json.dumps(submission), headers={'content-type': 'application/json'})
+
+    assert second.status_code == 200
+    assert second.data == first.data
+    assert projected.data != first.data
+    api.invalidate_plan(plans.PLANS[('tcja', 2019)])
+    assert api.response_cache.info().currsize == 0
+
+
+def test_api_response_echoes_number_spelling():
+    as_int = make_submission(filing_status=1, ordinary_income1=50000)
+    as_float = make_submission(filing_status=1, ordinary_income1=50000.0, ordinary_income2=0.0)
+    with api.app.test_client() as web:
+        api.response_cache.invalidate()
+        api.cache.invalidate()
+        bodies = {}
+        for name, submission in (('int', as_int), ('float', as_float), ('int again', as_int)):
+            resp = web.post('/taxcalc/tcja_submit', data=json.dumps(submission), headers={'content-type': 'application/json'})
+            assert resp.status_code == 200
+            bodies[name] = resp.data
+        boolean = web.post('/taxcalc/tcja_submit', data=json.dumps(make_submission(ordinary_income1=True)), headers={'content-type': 'application/json'})
+
+    # Each spelling gets its own cached response, echoing the input as sent
+    assert b'"agi":50000,' in bodies['int']
+    assert b'"agi":50000.0' in bodies['float']
+    assert bodies['int again'] == bodies['int']
+    assert json.loads(bodies['int']) == json.loads(bodies['float'])
+    assert boolean.status_code == 400
+
+
+def plan_duration_count(plan):
+    labels = (('/taxcalc/tcja_submit', plan),)
+    return sum(value for suffix, labelvalues, _, value in api.plan_duration.samples()
+               if suffix == '_count' and labelvalues in labels)
+
+
+def test_api_micro_batching():
+    submission = make_submission(ordinary_income1=43210)
+    with api.app.test_client() as web:
+        api.response_cache.invalidate()
+        expected = web.post('/taxcalc/tcja_submit', data=json.dumps(submission), headers={'content-type': 'application/json'}).get_data()
+        api.response_cache.invalidate()
+        api.enable_micro_batching(max_batch_size=4, max_wait=0.001, min_batch_size=1)
+        observed = plan_duration_count('tcja-2019')
+        try:
+            resp = web.post('/taxcalc/tcja_submit', data=json.dumps(submission), headers={'content-type': 'application/json'})
+            invalid = web.post('/taxcalc/tcja_submit', data=json.dumps(make_submission(filing_status=0, child_dep=1)), headers={'content-type': 'application/json'})
+        finally:
+            api.micro_batcher = None
+
+    assert resp.status_code == 200
+    assert invalid.status_code == 400
+    assert plan_duration_count('tcja-2019') == observed + 1
+    # The same numbers, though micro-batched results are all floats
+    assert json.loads(resp.get_data()) == json.loads(expected)
+
+
+def test_api_metrics():
+    submission = make_submission(ordinary_income1=76543)
+    with api.app.test_client() as web:
+        web.post('/taxcalc/tcja_submit', data=json.dumps(submission), headers={'content-type': 'application/json'})
+        web.post('/taxcalc/tcja_submit?plans=flat-tax', data=json.dumps(submission), headers={'content-type': 'application/json'})
+        web.post('/taxcalc/batch', data="[1, 2", headers={'content-type': 'application/json'})
+        resp = web.get('/metrics')
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/plain'
+    text = resp.get_data(as_text=True)
+    assert 'taxcalc_requests_total{endpoint="/taxcalc/tcja_submit",status="200"}' in text
+    assert 'taxcalc_errors_total{endpoint="/taxcalc/tcja_submit",cause="bad_query"}' in text
+    assert 'taxcalc_errors_total{endpoint="/taxcalc/batch",cause="malformed_batch"}' in text
+    assert 'taxcalc_plan_duration_seconds_count{endpoint="/taxcalc/tcja_submit",plan="tcja-2019"}' in text
+    assert 'taxcalc_request_stage_duration_seconds_count{endpoint="/taxcalc/tcja_submit",stage="serialize"}' in text
+    assert 'taxcalc_calc_stage_duration_seconds_count{stage="marginal_rates"}' in text
+    assert '# TYPE taxcalc_cache_lookups_total counter' in text
+    assert 'taxcalc_cache_lookups_total{cache="response",outcome="hit"}' in text
+    assert '# TYPE taxcalc_coalesced_requests_total counter' in text
+
+
+def test_api_coalesces_identical_requests(monkeypatch):
+    api.response_cache.invalidate()
+    release = threading.Event()
+    calc_response = api.calc_response
+
+    def slow_calc_response(*args):
+        release.wait(5)
+        return calc_response(*args)
+
+    monkeypatch.setattr(api, 'calc_response', slow_calc_response)
+    before = api.in_flight.info()
+    submission = json.dumps(make_submission(ordinary_income1=98765))
+    bodies = []
+
+    def submit():
+        with api.app.test_client() as web:
+            bodies.append(web.post('/taxcalc/tcja_submit', data=submission, headers={'content-type': 'application/json'}).data)
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while api.in_flight.info().coalesced < before.coalesced + 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert api.in_flight.info().calls == before.calls + 1
+    assert len(set(bodies)) == 1 and len(bodies) == 4
+
+
+def test_api_batch_stream(monkeypatch):
+    monkeypatch.setattr(api, 'STREAM_CHUNK_ROWS', 2)
+    lines = [json.dumps(make_submission(ordinary_income1=10000 * i)) for i in range(1, 6)]
+    lines[2] = "not json"
+    with api.app.test_client() as web:
+        expected = web.post('/taxcalc/batch', data="\n".join(lines), headers={'content-type': 'application/x-ndjson'})
+        resp = web.post('/taxcalc/batch?fields=tax_burden', data="\n".join(lines),
+                        headers={'content-type': 'application/x-ndjson', 'accept': 'application/x-ndjson'}, buffered=False)
+        assert resp.is_streamed
+        body = resp.get_data(as_text=True)
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [row['row'] for row in rows] == [0, 1, 2, 3, 4]
+    assert 'error' in rows[2]
+    for row, expected_row in zip(rows, expected.get_json()):
+        if 'taxes' in row:
+            assert [taxes['results'] for taxes in row['taxes']] == [{'tax_burden': taxes['results']['tax_burden']} for taxes in expected_row['taxes']]
+
+
+class LineStream(io.BytesIO):
+    # A request body that counts the bytes read from it
+    def __init__(self, lines):
+        super().__init__(b''.join(line.encode('utf-8') + b'\n' for line in lines))
+        self.line_ends = list(itertools.accumulate(len(line) + 1 for line in lines))
+
+    @property
+    def read_lines(self):
+        return sum(1 for end in self.line_ends if end <= self.tell())
+
+
+def test_api_batch_stream_reads_input_incrementally(monkeypatch):
+    monkeypatch.setattr(api, 'STREAM_CHUNK_ROWS', 2)
+    monkeypatch.setattr(api, 'MAX_BATCH_ROWS', 5)
+    stream = LineStream([json.dumps(make_submission(ordinary_income1=10000 * i)) for i in range(1, 8)])
+    with api.app.test_client() as web:
+        resp = web.post('/taxcalc/batch', input_stream=stream,
+                        headers={'content-type': 'application/x-ndjson', 'accept': 'application/x-ndjson'}, buffered=False)
+        chunks = iter(resp.response)
+        first = next(chunks)
+        # The first chunk is sent after reading only its own rows
+        assert stream.read_lines == 2
+        body = (first if isinstance(first, str) else first.decode('utf-8')) + ''.join(
+            chunk if isinstance(chunk, str) else chunk.decode('utf-8') for chunk in chunks)
+        array = web.post('/taxcalc/batch', data=json.dumps([make_submission()] * 3),
+                         headers={'content-type': 'application/json', 'accept': 'application/x-ndjson'})
+
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [row['row'] for row in rows] == [0, 1, 2, 3, 4, 5]
+    assert all('taxes' in row for row in rows[:5])
+    assert rows[5]['error'].startswith("Batch too large")
+    assert stream.read_lines == 6
+    assert [json.loads(line)['row'] for line in array.get_data(as_text=True).splitlines()] == [0, 1, 2]
+
+
+def test_api_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, 'job_queue', api.jobs.JobQueue(str(tmp_path), max_running=1, max_queued=0))
+    monkeypatch.setattr(api, 'STREAM_CHUNK_ROWS', 2)
+    lines = [json.dumps(make_submission(ordinary_income1=10000 * i)) for i in range(1, 6)]
+    with api.app.test_client() as web:
+        expected = web.post('/taxcalc/batch', data="\n".join(lines), headers={'content-type': 'application/x-ndjson', 'accept': 'application/x-ndjson'}).get_data(as_text=True)
+        resp = web.post('/taxcalc/jobs', data="\n".join(lines), headers={'content-type': 'application/x-ndjson'})
+        assert resp.status_code == 202
+        status_url = resp.get_json()['status']
+        for _ in range(1000):
+            status = web.get(status_url).get_json()
+            if status['state'] in ('done', 'failed'):
+                break
+            time.sleep(0.01)
+        result = web.get(status_url + '/result')
+        assert web.get('/taxcalc/jobs/nope').status_code == 404
+        assert web.delete(status_url).status_code == 204
+        assert web.get(status_url).status_code == 404
+
+    assert (status['state'], status['done'], status['total']) == ('done', 5, 5)
+    assert result.status_code == 200
+    assert result.get_data(as_text=True) == expected
+
+
+def test_api_jobs_queue_full(monkeypatch):
+    class FullQueue(object):
+        def submit(self, function, args, total):
+            raise api.jobs.QueueFull()
+
+    monkeypatch.setattr(api, 'job_queue', FullQueue())
+    with api.app.test_client() as web:
+        resp = web.post('/taxcalc/jobs', data=json.dumps([make_submission()]), headers={'content-type': 'application/json'})
+    assert resp.status_code == 429
+
+
+def test_preload_without_plans(monkeypatch):
+    api.preload()
+    monkeypatch.setattr(plans, 'PLANS', {})
+    api.preload()
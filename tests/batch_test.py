@@ -0,0 +1,148 @@
+from context import *
+import itertools
+
+import numpy as np
+import pytest
+
+import taxsim.array_funcs as array_funcs
+import taxsim.batch as batch
+
+policy = taxsim.current_law_policy
+
+
+def gen_taxpayers():
+    # Valid filing status/dependent combinations crossed with a spread of incomes
+    households = [(0, 0, 0), (0, 0, 1), (1, 0, 0), (1, 2, 0), (1, 3, 1), (2, 1, 0), (2, 4, 0), (2, 0, 1)]
+    incomes = [0, 5000, 14000, 23000, 41000, 78000, 131000, 190000, 280000, 450000, 1200000]
+    taxpayers = []
+    for (filing_status, child_dep, nonchild_dep), income, mix in itertools.product(households, incomes, range(6)):
+        taxpayer = misc_funcs.create_taxpayer()
+        taxpayer['filing_status'] = filing_status
+        taxpayer['child_dep'] = child_dep
+        taxpayer['nonchild_dep'] = nonchild_dep
+        taxpayer['ordinary_income1'] = income
+        if mix == 1:
+            taxpayer['ordinary_income2'] = income / 3
+            taxpayer['401k_contributions'] = min(income / 10, 18500)
+        elif mix == 2:
+            taxpayer['business_income'] = income
+            taxpayer['business_income_service'] = 1
+        elif mix == 3:
+            taxpayer['business_income'] = income / 2
+            taxpayer['qualified_income'] = income / 4
+        elif mix == 4:
+            taxpayer['ss_income'] = min(income, 40000)
+            taxpayer['medical_expenses'] = 9000
+        elif mix == 5:
+            taxpayer['qualified_income'] = income
+            taxpayer['sl_income_tax'] = income * 0.05
+            taxpayer['sl_property_tax'] = 6000
+            taxpayer['interest_paid'] = 45000
+            taxpayer['charity_contributions'] = income * 0.04
+            taxpayer['other_itemized'] = 1500
+        taxpayers.append(taxpayer)
+    return taxpayers
+
+
+def assert_parity(scalar_results, batch_results):
+    rows = batch.to_rows(batch_results)
+    assert len(rows) == len(scalar_results)
+    for scalar_row, batch_row in zip(scalar_results, rows):
+        assert list(batch_row.keys()) == list(scalar_row.keys())
+        for key, value in scalar_row.items():
+            if isinstance(value, str):
+                assert batch_row[key] == value, key
+            else:
+                assert batch_row[key] == pytest.approx(value, abs=1e-6), key
+
+
+@pytest.mark.parametrize("policy_name", ["current_law_policy", "current_law_2019_policy"])
+def test_federal_batch_parity(policy_name):
+    test_policy = getattr(taxsim, policy_name)
+    taxpayers = gen_taxpayers()
+    scalar_results = [taxsim.calc_federal_taxes(dict(taxpayer), test_policy) for taxpayer in taxpayers]
+    batch_results = batch.calc_federal_taxes_batch(batch.to_columns(taxpayers), test_policy)
+    assert_parity(scalar_results, batch_results)
+
+
+def test_federal_batch_parity_no_mrate():
+    taxpayers = gen_taxpayers()
+    scalar_results = [taxsim.calc_federal_taxes(dict(taxpayer), policy, mrate=False) for taxpayer in taxpayers]
+    batch_results = batch.calc_federal_taxes_batch(batch.to_columns(taxpayers), policy, mrate=False)
+    assert 'marginal_income_tax_rate' not in batch_results
+    assert_parity(scalar_results, batch_results)
+
+
+def test_batch_does_not_mutate_columns():
+    columns = batch.to_columns(gen_taxpayers())
+    before = {key: column.copy() for key, column in columns.items()}
+    batch.calc_federal_taxes_batch(columns, policy)
+    for key in before:
+        assert np.array_equal(columns[key], before[key])
+
+
+def test_batch_invalid_taxpayer():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['child_dep'] = 1
+    with pytest.raises(ValueError):
+        batch.calc_federal_taxes_batch(batch.to_columns([taxpayer]), policy)
+
+
+def test_batch_bad_value():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = "bad stuff!"
+    with pytest.raises(ValueError):
+        batch.calc_federal_taxes_batch(batch.to_columns([taxpayer]), policy)
+
+
+def test_py_round():
+    values = np.array([2036.245, 0.125, 1.005, -2.675, 123456.785, 0.5, 1.5, 2.5])
+    expected = [round(value, 2) for value in values.tolist()]
+    assert array_funcs.py_round(values, 2).tolist() == expected
+
+
+@pytest.mark.parametrize("policy_name", ["senate_2018_policy", "senate_2019_policy", "senate_2019_ss_policy"])
+def test_senate_batch_parity(policy_name):
+    test_policy = getattr(taxsim, policy_name)
+    taxpayers = gen_taxpayers()
+    scalar_results = [taxsim.calc_senate_2018_taxes(dict(taxpayer), test_policy) for taxpayer in taxpayers]
+    batch_results = batch.calc_senate_2018_taxes_batch(batch.to_columns(taxpayers), test_policy)
+    assert_parity(scalar_results, batch_results)
+
+
+def test_senate_batch_qbi_phaseout():
+    # Service business income straddling the 199A phase-out range
+    policy_2018 = taxsim.senate_2018_policy
+    taxpayers = []
+    for business_income in range(100000, 300000, 2500):
+        taxpayer = misc_funcs.create_taxpayer()
+        taxpayer['business_income'] = business_income
+        taxpayer['business_income_service'] = 1
+        taxpayers.append(taxpayer)
+    scalar_results = [taxsim.calc_senate_2018_taxes(dict(taxpayer), policy_2018, mrate=False) for taxpayer in taxpayers]
+    batch_results = batch.calc_senate_2018_taxes_batch(batch.to_columns(taxpayers), policy_2018, mrate=False)
+    assert_parity(scalar_results, batch_results)
+    assert batch_results['qbi_ded'][0] > 0
+    assert batch_results['qbi_ded'][-1] == 0
+
+
+def test_senate_batch_actc_limit():
+    policy_2018 = taxsim.senate_2018_policy
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['filing_status'] = 1
+    taxpayer['child_dep'] = 3
+    taxpayer['ordinary_income1'] = 30000
+    results = batch.calc_senate_2018_taxes_batch(batch.to_columns([taxpayer]), policy_2018)
+    assert results['actc'][0] <= 3 * policy_2018['actc_limit']
+    assert results['actc'][0] == taxsim.calc_senate_2018_taxes(taxpayer, policy_2018)['actc']
+
+
+def test_from_scalar():
+    taxpayers = gen_taxpayers()[::7]
+    calc = batch.from_scalar(taxsim.calc_house_2018_taxes)
+    results = calc(batch.to_columns(taxpayers), taxsim.house_2018_policy)
+
+    for i, taxpayer in enumerate(taxpayers):
+        expected = taxsim.calc_house_2018_taxes(taxpayer, taxsim.house_2018_policy)
+        for key in expected:
+            assert results[key][i] == pytest.approx(expected[key], abs=1e-6), key
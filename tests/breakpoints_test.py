@@ -0,0 +1,104 @@
+from context import *
+
+import numpy as np
+import pytest
+
+import taxsim.batch as batch
+import taxsim.breakpoints as breakpoints
+
+ORDINARY = {"ordinary": 1.0, "business": 0.0, "ss": 0.0, "qualified": 0.0}
+BUSINESS = {"ordinary": 0.0, "business": 1.0, "ss": 0.0, "qualified": 0.0}
+
+
+def piecewise(income):
+    # Kinks at 1000 and 4321.5, a jump just above 2500 like a rounded-up phaseout
+    tax = 0.1 * income + 0.15 * np.maximum(0, income - 1000) - 0.2 * np.maximum(0, income - 4321.5)
+    return np.column_stack([tax - 50 * (income > 2500), income])
+
+
+def test_find_breakpoints():
+    incomes, values, jumps, evaluations = breakpoints.find_breakpoints(piecewise, 0, 10000, knots=[2500])
+
+    kinks = [x for x in incomes if not any(a <= x <= b for a, b in jumps)]
+    assert kinks == pytest.approx([0, 1000, 4321.5, 10000])
+    assert len(jumps) == 1
+    assert jumps[0][0] == 2500
+    assert jumps[0][1] <= jumps[0][0] + breakpoints.DEFAULT_RESOLUTION
+    assert np.array_equal(values, piecewise(incomes))
+    assert evaluations < 100
+
+
+def test_find_breakpoints_without_knots():
+    incomes, values, jumps, _ = breakpoints.find_breakpoints(piecewise, 0, 10000)
+
+    [(below, above)] = jumps
+    assert below <= 2500 < above <= below + breakpoints.DEFAULT_RESOLUTION
+    income = np.linspace(0, 10000, 10001)
+    income = income[(income <= below) | (income >= above)]
+    assert np.abs(np.interp(income, incomes, values[:, 0]) - piecewise(income)[:, 0]).max() < 1e-6
+
+
+def test_find_breakpoints_bad_range():
+    with pytest.raises(ValueError):
+        breakpoints.find_breakpoints(piecewise, 100, 100)
+
+
+def test_policy_thresholds():
+    thresholds = breakpoints.policy_thresholds(taxsim.current_law_policy, 2, 1)
+
+    assert 13600 in thresholds  # head of household bracket
+    assert 9525 not in thresholds  # single bracket
+    assert 18700 in thresholds  # EITC phaseout with one child
+    assert 8510 not in thresholds  # EITC phaseout with no children
+    assert all(threshold > 1 for threshold in thresholds)
+
+
+def test_stepped_thresholds():
+    # 2 children lose $2000 of CTC at $50 per $1000 of AGI over $75,000
+    steps = breakpoints.stepped_thresholds(taxsim.current_law_policy, 2, 2)
+    assert [step for step in steps if step < 266700] == [75000 + 1000 * i for i in range(41)]
+
+
+def test_step_edges():
+    grid = np.linspace(10, 100000, 129)
+    edges = breakpoints.step_edges(batch.calc_federal_taxes_batch, taxsim.current_law_policy, 2, 2, ORDINARY, grid,
+                                   [('ordinary_income1', 2500)])
+
+    # All income is AGI, so each step is crossed at its own income and, with
+    # $2500 more ordinary income, $2500 below it
+    assert all(0 < above - below <= breakpoints.DEFAULT_RESOLUTION for below, above in edges)
+    for income in (75000, 76000, 99000, 72500, 97500):
+        assert sum(below <= income < above for below, above in edges) == 1
+    assert len(edges) == 25 + 28
+
+
+@pytest.mark.parametrize('calc_function, policy, filing_status, child_dep, income_ratios, hi', [
+    (batch.calc_federal_taxes_batch, taxsim.current_law_policy, 2, 2, ORDINARY, 100000),
+    (batch.calc_federal_taxes_batch, taxsim.current_law_policy, 1, 3, BUSINESS, 400000),
+    (batch.calc_senate_2018_taxes_batch, taxsim.senate_2018_policy, 1, 3, BUSINESS, 1000000),
+])
+def test_household_curve_matches_uniform(calc_function, policy, filing_status, child_dep, income_ratios, hi):
+    curve = breakpoints.household_curve(calc_function, policy, filing_status, child_dep, income_ratios, 10, hi)
+
+    income = np.linspace(10, hi, 40001)
+    for below, above in curve.jumps:
+        income = income[(income <= below) | (income >= above)]
+    results = calc_function(batch.income_sweep(filing_status, child_dep, income_ratios, income), policy, mrate=False)
+    for field in breakpoints.CURVE_FIELDS:
+        interpolated = np.interp(income, curve.income, curve.values[field])
+        assert np.abs(interpolated - results[field]).max() < 2 * breakpoints.DEFAULT_TOLERANCE, field
+    assert curve.evaluations < 10000
+
+
+def test_rate_incomes_marginal_rates_are_linear():
+    step = taxsim.MARG_RATE_BOUND
+    curve = breakpoints.household_curve(batch.calc_federal_taxes_batch, taxsim.current_law_policy, 0, 0, ORDINARY,
+                                        100, 300000 + step)
+    incomes = breakpoints.rate_incomes(curve, 100, 300000, [step])
+    assert incomes[0] == 100 and incomes[-1] == 300000
+
+    results = batch.calc_federal_taxes_batch(batch.income_sweep(0, 0, ORDINARY, incomes), taxsim.current_law_policy)
+    income = np.linspace(100, 300000, 30001)
+    expected = batch.calc_federal_taxes_batch(batch.income_sweep(0, 0, ORDINARY, income), taxsim.current_law_policy)
+    interpolated = np.interp(income, incomes, results["marginal_income_tax_rate"])
+    assert np.abs(interpolated - expected["marginal_income_tax_rate"]).max() < 1e-4
@@ -0,0 +1,196 @@
+from context import *
+import json
+import os
+
+import numpy as np
+import pytest
+
+import taxsim.batch as batch
+import taxsim.graph as graph
+
+RATIOS = {"ordinary": 0.5, "business": 0.5, "ss": 0.0, "qualified": 0.0}
+
+
+def test_graph_sweep_matches_scalar():
+    taxpayers = graph.graph_taxpayers(2, 1, RATIOS, 2500, start=1, stop=60)
+    results = batch.to_rows(batch.calc_senate_2018_taxes_batch(taxpayers, taxsim.senate_2018_policy))
+
+    assert len(results) == 59
+    for i, result in zip(range(1, 60), results):
+        taxpayer = misc_funcs.create_taxpayer()
+        taxpayer['filing_status'] = 2
+        taxpayer['child_dep'] = 1
+        taxpayer['ordinary_income1'] = i * 2500 * 0.5
+        taxpayer['business_income'] = i * 2500 * 0.5
+        expected = taxsim.calc_senate_2018_taxes(taxpayer, taxsim.senate_2018_policy)
+        for key in expected:
+            assert result[key] == pytest.approx(expected[key], abs=1e-6), key
+
+
+def test_make_graph_writes_data_and_plot(tmp_path, monkeypatch):
+    monkeypatch.setattr(taxsim, 'GRAPH_DATA_RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'GRAPH_CACHE_DIR', str(tmp_path / 'cache') + '/')
+    graph.make_graph("Business Income", "test_graph", 0, 0, RATIOS, 1, 1000, 1, 100, "marginal")
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'cache', 'test_graph-current_law_graph_data.csv', 'test_graph-senate_2018_graph_data.csv', 'test_graph.png']
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_render_graphs(tmp_path, monkeypatch, jobs):
+    specs = [{"main_income_type": "Ordinary Income", "file_name": "graph_" + str(i), "filing_status": i,
+              "child_dep": 1 if i == 2 else 0, "income_ratios": RATIOS, "payroll": i % 2, "step": 1000,
+              "start": 1, "stop": 50, "rate_type": "average"} for i in range(3)]
+    spec_file = tmp_path / 'graphs.json'
+    spec_file.write_text(json.dumps(specs))
+    monkeypatch.setitem(graph.GRAPH_FILES, 'average', str(spec_file))
+    monkeypatch.setattr(taxsim, 'GRAPH_DATA_RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'GRAPH_CACHE_DIR', str(tmp_path / 'cache') + '/')
+
+    timings = graph.render_graphs('average', jobs)
+
+    assert sorted(name for name, _, _ in timings) == ['graph_0', 'graph_1', 'graph_2']
+    assert all(seconds > 0 and not cached for _, seconds, cached in timings)
+    assert all((tmp_path / (name + '.png')).exists() for name, _, _ in timings)
+    assert graph.plt.get_fignums() == []
+
+
+def test_graph_data_cache(tmp_path, monkeypatch):
+    params_dir = tmp_path / 'params'
+    params_dir.mkdir()
+    for _, policy_file, _ in graph.GRAPH_POLICIES:
+        (params_dir / policy_file).write_bytes(open(taxsim.PARAMS_DIR + policy_file, 'rb').read())
+    monkeypatch.setattr(taxsim, 'PARAMS_DIR', str(params_dir) + '/')
+    monkeypatch.setattr(taxsim, 'GRAPH_DATA_RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'GRAPH_CACHE_DIR', str(tmp_path / 'cache') + '/')
+    data_path = tmp_path / 'cached-current_law_graph_data.csv'
+
+    def render(title="Ordinary Income", step=1000):
+        return graph.make_graph(title, "cached", 0, 0, RATIOS, 0, step, 1, 50, "average")
+
+    assert render() is False
+    first_data = data_path.read_bytes()
+    first_mtime = data_path.stat().st_mtime_ns
+    assert render(title="Renamed") is True  # only the plot changed
+    assert data_path.stat().st_mtime_ns == first_mtime  # identical data is not rewritten
+    assert render(step=2000) is False
+    assert render() is True
+    assert data_path.read_bytes() == first_data
+
+    # Editing a policy file changes the fingerprint
+    senate_file = params_dir / taxsim.SENATE_2018_FILE
+    senate_file.write_bytes(senate_file.read_bytes().rstrip(b'\r\n') + b'\nunused_param,1\n')
+    assert render() is False
+    monkeypatch.setattr(taxsim, 'ENGINE_VERSION', 'test')
+    monkeypatch.setattr(graph, '_engine_fingerprint', None)
+    assert render() is False
+    assert graph.make_graph("Ordinary Income", "cached", 0, 0, RATIOS, 0, 1000, 1, 50, "average", use_cache=False) is False
+
+
+def test_make_graph_breakpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(taxsim, 'GRAPH_DATA_RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'GRAPH_CACHE_DIR', str(tmp_path / 'cache') + '/')
+    # Only uniform sampling needs the full sweep
+    monkeypatch.setattr(graph, 'graph_taxpayers', None)
+    ratios = {"ordinary": 1.0, "business": 0.0, "ss": 0.0, "qualified": 0.0}
+    graph.make_graph("Ordinary Income", "exact", 2, 2, ratios, 0, 25, 1, 4001, "average", sampling="breakpoints")
+
+    data = graph.pd.read_csv(tmp_path / 'exact-current_law_graph_data.csv')
+    assert len(data) < 400
+    assert data["gross_income"].iloc[0] == 25
+    assert data["gross_income"].iloc[-1] == 100000
+    # Average rates between breakpoints follow from the dollar amounts at them
+    income = np.arange(1, 4001) * 25.0
+    expected = batch.calc_federal_taxes_batch(batch.income_sweep(2, 2, ratios, income), taxsim.current_law_policy, mrate=False)
+    interpolated = np.interp(income, data["gross_income"], data["income_tax_after_credits"])
+    assert np.abs(interpolated - expected["income_tax_after_credits"]).max() < 0.1
+    assert (tmp_path / 'exact.png').exists()
+
+
+def test_make_graph_unknown_sampling(tmp_path, monkeypatch):
+    monkeypatch.setattr(taxsim, 'GRAPH_CACHE_DIR', str(tmp_path / 'cache') + '/')
+    with pytest.raises(ValueError):
+        graph.make_graph("Ordinary Income", "bad", 0, 0, RATIOS, 0, 1000, 1, 50, "average", sampling="random")
+
+
+def test_make_graph_adaptive(tmp_path, monkeypatch):
+    monkeypatch.setattr(taxsim, 'GRAPH_DATA_RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'RESULTS_DIR', str(tmp_path) + '/')
+    monkeypatch.setattr(taxsim, 'GRAPH_CACHE_DIR', str(tmp_path / 'cache') + '/')
+    monkeypatch.setattr(graph, 'graph_taxpayers', None)
+    # The business marginal rate of a mixed sweep is not along its income mix
+    graph.make_graph("Mixed Income", "adaptive", 2, 1, RATIOS, 0, 25, 1, 8001, "marginal", sampling="adaptive")
+
+    data = graph.pd.read_csv(tmp_path / 'adaptive-senate_2018_graph_data.csv')
+    assert len(data) < 3000
+    assert data["gross_income"].iloc[0] == 25
+    assert data["gross_income"].iloc[-1] == 200000
+    income = np.arange(1, 8001) * 25.0
+    expected = batch.calc_senate_2018_taxes_batch(batch.income_sweep(2, 1, RATIOS, income), taxsim.senate_2018_policy)
+    error = np.abs(np.interp(income, data["gross_income"], data["marginal_business_income_tax_rate"]) -
+                   expected["marginal_business_income_tax_rate"])
+    assert np.mean(error > 2 * graph.adaptive.DEFAULT_TOLERANCE) < 0.001
+    assert (tmp_path / 'adaptive.png').exists()
+
+
+def test_adaptive_results_scalar_calc():
+    calc = batch.from_scalar(taxsim.calc_house_2018_taxes)
+    ratios = {"ordinary": 1.0, "business": 0.0, "ss": 0.0, "qualified": 0.0}
+    data = graph.adaptive_results(calc, taxsim.house_2018_policy, 0, 0, ratios, 100, 100000)
+
+    assert data["gross_income"].is_monotonic_increasing
+    income = np.linspace(100, 100000, 201)
+    expected = calc(batch.income_sweep(0, 0, ratios, income), taxsim.house_2018_policy)
+    interpolated = np.interp(income, data["gross_income"], data["avg_effective_tax_rate"])
+    assert np.abs(interpolated - expected["avg_effective_tax_rate"]).max() < 2 * graph.adaptive.DEFAULT_TOLERANCE
+
+
+@pytest.mark.parametrize('calc_function, policy', [
+    (batch.calc_federal_taxes_batch, taxsim.current_law_policy),
+    (batch.calc_senate_2018_taxes_batch, taxsim.senate_2018_policy)])
+def test_adaptive_results_stepped_phaseouts(calc_function, policy):
+    # Head of household with two children on mixed income crosses every step
+    # of the CTC and personal exemption phaseouts
+    ratios = {"ordinary": 0.5, "business": 0.3, "ss": 0.0, "qualified": 0.2}
+    data = graph.adaptive_results(calc_function, policy, 2, 2, ratios, 100, 500000)
+
+    income = np.arange(100, 500000, 5.0)
+    expected = calc_function(batch.income_sweep(2, 2, ratios, income), policy)
+    # Intervals too narrow to split are jumps; no line through samples follows those
+    sampled = data["gross_income"].values
+    i = np.clip(np.searchsorted(sampled, income), 1, len(sampled) - 1)
+    outside_jumps = sampled[i] - sampled[i - 1] >= 4 * graph.ADAPTIVE_MIN_SPACING
+    for field in graph.ADAPTIVE_FIELDS:
+        error = np.abs(np.interp(income, sampled, data[field]) - expected[field])[outside_jumps]
+        assert error.max() <= 3 * graph.adaptive.DEFAULT_TOLERANCE, field
+
+
+def test_engine_fingerprint_covers_sampling_and_tax_code(tmp_path, monkeypatch):
+    assert taxsim in graph.ENGINE_MODULES and tax_funcs in graph.ENGINE_MODULES
+    source = tmp_path / 'graph.py'
+    source.write_bytes(open(graph.__file__, 'rb').read())
+    monkeypatch.setattr(graph, '__file__', str(source))
+    monkeypatch.setattr(graph, '_engine_fingerprint', None)
+    fingerprint = graph.engine_fingerprint()
+
+    # As if a sampling constant were edited
+    source.write_bytes(source.read_bytes().replace(b'ADAPTIVE_MAX_POINTS = ', b'ADAPTIVE_MAX_POINTS = 1 + '))
+    monkeypatch.setattr(graph, '_engine_fingerprint', None)
+    assert graph.engine_fingerprint() != fingerprint
+
+
+def test_prune_cache_keeps_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(taxsim, 'GRAPH_CACHE_DIR', str(tmp_path) + '/')
+    for i in range(5):
+        path = tmp_path / (str(i) + '.csv')
+        path.write_text('income\n')
+        os.utime(str(path), (1000 + i, 1000 + i))
+    os.utime(str(tmp_path / '0.csv'))  # used just now
+    (tmp_path / 'other.tmp').write_text('')
+
+    assert graph.prune_cache(max_files=2) == 3
+    assert sorted(os.listdir(str(tmp_path))) == ['0.csv', '4.csv', 'other.tmp']
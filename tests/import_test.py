@@ -0,0 +1,53 @@
+from context import *
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Importing taxsim.taxsim measured at ~0.06s (down from ~1s when pandas,
+# matplotlib and every policy were loaded at import). The budget leaves room
+# for slow CI machines while still catching a heavy import sneaking back in.
+IMPORT_BUDGET_SECONDS = 0.5
+HEAVY_MODULES = ('pandas', 'matplotlib', 'tqdm', 'flask')
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import taxsim.taxsim
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(','.join(name for name in {heavy!r} if name in sys.modules))
+print(','.join(name for name in taxsim.taxsim.POLICY_FILES if name in vars(taxsim.taxsim)))
+"""
+
+
+def run_import(cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(heavy=HEAVY_MODULES)],
+        cwd=str(cwd), env=env, universal_newlines=True)
+    elapsed, heavy_modules, loaded_policies = output.split('\n')[:3]
+    return float(elapsed), heavy_modules, loaded_policies
+
+
+def test_import_budget(tmp_path):
+    # Best of three, to keep one slow start from failing the test
+    elapsed = min(run_import(tmp_path)[0] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET_SECONDS
+
+
+def test_import_has_no_side_effects(tmp_path):
+    elapsed, heavy_modules, loaded_policies = run_import(tmp_path)
+    assert heavy_modules == ''
+    assert loaded_policies == ''
+    assert list(tmp_path.iterdir()) == []  # no logs or results directories
+
+
+def test_policies_load_on_first_use():
+    policy = taxsim.senate_2019_ss_policy
+    assert policy is taxsim.get_policy('senate_2019_ss_policy')
+    assert policy == csv_parser.load_policy(taxsim.PARAMS_DIR + taxsim.SENATE_2019_SS_FILE)
+    with pytest.raises(AttributeError):
+        taxsim.not_a_policy
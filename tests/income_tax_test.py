@@ -1,6 +1,11 @@
 from context import *
 import copy
 
+import numpy as np
+import pytest
+
+import taxsim.array_funcs as array_funcs
+
 policy = taxsim.current_law_policy
 
 
@@ -79,3 +84,41 @@ def test_weird_brackets():
     taxes_owed2 = tax_funcs.fed_ordinary_income_tax(new_policy2, taxpayer, 200000)
 
     assert taxes_owed == taxes_owed2
+
+
+def test_compiled_schedule_bracket_tax():
+    schedule = tax_funcs.compile_brackets((0, 10000, 50000), (0.1, 0.2, 0.3))
+    assert schedule.bracket_tax == (1000.0, 8000.0)
+    assert tax_funcs.schedule_tax(schedule, 0) == 0
+    assert tax_funcs.schedule_tax(schedule, 10000) == 1000
+    assert tax_funcs.schedule_tax(schedule, 60000) == 9000 + 10000 * 0.3
+
+
+def test_compiled_schedule_is_cached():
+    taxpayer = misc_funcs.create_taxpayer()
+    assert tax_funcs.get_schedule(taxpayer, policy) is tax_funcs.get_schedule(taxpayer, copy.deepcopy(policy))
+
+
+def test_compiled_schedule_matches_bracket_walk():
+    taxpayer = misc_funcs.create_taxpayer()
+    brackets = policy['single_brackets']
+    rates = policy['income_tax_rates']
+    for taxable_income in list(range(0, 600000, 737)) + brackets:
+        expected = 0
+        for lower, upper, rate in zip(brackets, brackets[1:] + [float('inf')], rates):
+            if taxable_income > lower:
+                expected += (min(taxable_income, upper) - lower) * rate
+        assert tax_funcs.fed_ordinary_income_tax(policy, taxpayer, taxable_income) == pytest.approx(expected, abs=0.01)
+
+
+@pytest.mark.parametrize('filing_status, taxable_income, expected', [
+    (0, 195452.5, 47569.58),
+    (1, 424951.5, 114959.53),
+])
+def test_half_dollar_above_bracket_rounds_as_bracket_walk(filing_status, taxable_income, expected):
+    # Adding the brackets bottom up instead of top down gives a cent less here
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['filing_status'] = filing_status
+    assert tax_funcs.fed_ordinary_income_tax(policy, taxpayer, taxable_income) == expected
+    taxpayers = {'filing_status': np.array([filing_status])}
+    assert array_funcs.fed_ordinary_income_tax(policy, taxpayers, np.array([taxable_income]))[0] == expected
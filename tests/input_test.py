@@ -26,3 +26,30 @@ def test_single_with_child():
     taxpayer['child_dep'] = 1
     with pytest.raises(ValueError):
         result = taxsim.calc_federal_taxes(taxpayer, policy)
+
+
+def test_calcs_do_not_mutate_taxpayer():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['filing_status'] = 1
+    taxpayer['child_dep'] = 2
+    taxpayer['ordinary_income1'] = 150000
+    taxpayer['medical_expenses'] = 20000
+    taxpayer['sl_income_tax'] = 9000
+    taxpayer['sl_property_tax'] = 8000
+    taxpayer['interest_paid'] = 60000
+    taxpayer['charity_contributions'] = 100000
+    before = dict(taxpayer)
+    taxsim.calc_federal_taxes(taxpayer, policy)
+    taxsim.calc_senate_2018_taxes(taxpayer, taxsim.senate_2018_policy)
+    taxsim.calc_house_2018_taxes(taxpayer, taxsim.house_2018_policy)
+    assert dict(taxpayer) == before
+
+
+def test_calcs_are_repeatable():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 90000
+    taxpayer['medical_expenses'] = 15000
+    taxpayer['charity_contributions'] = 70000
+    first = taxsim.calc_federal_taxes(taxpayer, policy)
+    second = taxsim.calc_federal_taxes(taxpayer, policy)
+    assert first == second
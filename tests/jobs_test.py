@@ -0,0 +1,164 @@
+from context import *
+import os
+import time
+
+import pytest
+
+import taxsim.jobs as jobs
+
+
+def write_lines(count, gate_path, output_path, report):
+    with open(output_path, 'w') as f:
+        for i in range(count):
+            while gate_path and not os.path.exists(gate_path):
+                time.sleep(0.005)
+            f.write(str(i) + '\n')
+            report(i + 1)
+
+
+def fail_job(output_path, report):
+    raise ValueError("bad job")
+
+
+def job_files(directory):
+    # The queue's lock files stay
+    return [name for name in os.listdir(directory) if not name.endswith('.lock')]
+
+
+def wait_for(queue, job_id, states=('done', 'failed')):
+    for _ in range(1000):
+        status = queue.status(job_id)
+        if status['state'] in states:
+            return status
+        time.sleep(0.01)
+    raise AssertionError("job did not finish: " + repr(status))
+
+
+def test_job_runs_and_reports(tmp_path):
+    queue = jobs.JobQueue(str(tmp_path / 'jobs'), max_running=1, max_queued=1)
+    job_id = queue.submit(write_lines, (3, None), total=3)
+
+    status = wait_for(queue, job_id)
+    assert (status['state'], status['done'], status['total']) == ('done', 3, 3)
+    with open(queue.result_path(job_id)) as f:
+        assert f.read() == '0\n1\n2\n'
+    assert queue.forget(job_id)
+    assert not job_files(str(tmp_path / 'jobs'))
+    with pytest.raises(KeyError):
+        queue.status(job_id)
+
+
+def test_job_failure(tmp_path):
+    queue = jobs.JobQueue(str(tmp_path), max_running=1, max_queued=0)
+    job_id = queue.submit(fail_job, (), total=1)
+
+    status = wait_for(queue, job_id)
+    assert status['state'] == 'failed'
+    assert status['error'] == "bad job"
+    assert queue.result_path(job_id) is None
+
+
+def test_queue_full(tmp_path):
+    gate_path = str(tmp_path / 'gate')
+    queue = jobs.JobQueue(str(tmp_path / 'jobs'), max_running=1, max_queued=1)
+    running = queue.submit(write_lines, (2, gate_path), total=2)
+    queued = queue.submit(write_lines, (1, None), total=1)
+    with pytest.raises(jobs.QueueFull):
+        queue.submit(write_lines, (1, None), total=1)
+
+    assert queue.status(queued)['state'] == 'queued'
+    assert queue.result_path(running) is None
+    open(gate_path, 'w').close()
+    assert wait_for(queue, running)['state'] == 'done'
+    assert wait_for(queue, queued)['state'] == 'done'
+    assert queue.unfinished() == 0
+
+
+def test_job_seen_by_another_queue(tmp_path):
+    # As when a pre-fork server's workers each have a queue on the same directory
+    directory = str(tmp_path / 'jobs')
+    submitter = jobs.JobQueue(directory, max_running=1, max_queued=0)
+    poller = jobs.JobQueue(directory, max_running=1, max_queued=0)
+    job_id = submitter.submit(write_lines, (3, None), total=3)
+
+    status = wait_for(poller, job_id)
+    assert (status['state'], status['done'], status['total']) == ('done', 3, 3)
+    assert status == submitter.status(job_id)
+    with open(poller.result_path(job_id)) as f:
+        assert f.read() == '0\n1\n2\n'
+    assert poller.forget(job_id)
+    with pytest.raises(KeyError):
+        submitter.status(job_id)
+
+
+def test_limits_shared_by_queues_on_a_directory(tmp_path):
+    # Each pre-fork server worker has its own queue and pool, but the limits are per machine
+    gate_path = str(tmp_path / 'gate')
+    directory = str(tmp_path / 'jobs')
+    first = jobs.JobQueue(directory, max_running=1, max_queued=1)
+    second = jobs.JobQueue(directory, max_running=1, max_queued=1)
+    running = first.submit(write_lines, (1, gate_path), total=1)
+    wait_for(first, running, states=('running',))
+    queued = second.submit(write_lines, (1, None), total=1)
+    with pytest.raises(jobs.QueueFull):
+        second.submit(write_lines, (1, None), total=1)
+
+    # second's pool is idle, but the only running slot is taken
+    time.sleep(0.5)
+    assert second.status(queued)['state'] == 'queued'
+    assert first.unfinished() == second.unfinished() == 2
+    open(gate_path, 'w').close()
+    assert wait_for(second, running)['state'] == 'done'
+    assert wait_for(first, queued)['state'] == 'done'
+
+
+def test_forget_queued_job(tmp_path):
+    gate_path = str(tmp_path / 'gate')
+    queue = jobs.JobQueue(str(tmp_path / 'jobs'), max_running=1, max_queued=1)
+    running = queue.submit(write_lines, (1, gate_path), total=1)
+    queued = queue.submit(write_lines, (1, None), total=1)
+    wait_for(queue, running, states=('running',))
+
+    assert queue.forget(queued)
+    assert not queue.forget(running)
+    open(gate_path, 'w').close()
+    assert wait_for(queue, running)['state'] == 'done'
+    with pytest.raises(KeyError):
+        queue.status(queued)
+
+
+def test_unknown_job_ids(tmp_path):
+    queue = jobs.JobQueue(str(tmp_path), max_running=1, max_queued=0)
+    for job_id in ('0' * 32, '..', 'not a job'):
+        with pytest.raises(KeyError):
+            queue.status(job_id)
+
+
+def test_finished_jobs_are_cleaned_up(tmp_path):
+    queue = jobs.JobQueue(str(tmp_path), max_running=1, max_queued=2, ttl=60, max_finished=2)
+    job_ids = [queue.submit(write_lines, (1, None), total=1) for _ in range(3)]
+    finished = [wait_for(queue, job_id) for job_id in job_ids]
+    assert all(status['state'] == 'done' for status in finished)
+
+    # The oldest beyond max_finished goes first, then the rest after ttl
+    assert queue.cleanup() == 1
+    with pytest.raises(KeyError):
+        queue.status(job_ids[0])
+    assert queue.cleanup() == 0
+    assert queue.cleanup(now=time.time() + 61) == 2
+    assert not job_files(str(tmp_path))
+
+
+def test_lost_jobs_are_cleaned_up(tmp_path):
+    # As if queued by a worker that died before running it
+    queue = jobs.JobQueue(str(tmp_path), max_running=1, max_queued=0, ttl=60)
+    job_id = '0' * 32
+    jobs.write_status(os.path.join(str(tmp_path), job_id + '.status'),
+                      {'id': job_id, 'state': 'queued', 'done': 0, 'total': 1, 'submitted': time.time()})
+    with pytest.raises(jobs.QueueFull):
+        queue.submit(write_lines, (1, None), total=1)
+
+    assert queue.cleanup() == 0
+    assert queue.cleanup(now=time.time() + 61) == 1
+    assert queue.unfinished() == 0
+    assert not job_files(str(tmp_path))
@@ -1,4 +1,6 @@
 from context import *
+import sys
+
 import pytest
 
 policy = taxsim.current_law_policy
@@ -14,3 +16,47 @@ def test_main_success():
     with pytest.raises(SystemExit) as exit_code:
         taxsim.main()
     assert exit_code.value.code == 0
+
+
+def run_main(monkeypatch, tmp_path, *args):
+    results_dir = tmp_path / "results"
+    results_dir.mkdir(parents=True)
+    monkeypatch.setattr(sys, "argv", ["taxsim"] + list(args))
+    monkeypatch.setattr(taxsim, "RESULTS_DIR", str(results_dir) + "/")
+    with pytest.raises(SystemExit) as exit_code:
+        taxsim.main()
+    assert exit_code.value.code == 0
+    return {path.name: path.read_text() for path in results_dir.iterdir()}
+
+
+def test_main_jobs_match_serial(monkeypatch, tmp_path):
+    serial = run_main(monkeypatch, tmp_path / "serial")
+    parallel = run_main(monkeypatch, tmp_path / "parallel", "--jobs", "3")
+    assert sorted(serial) == sorted([taxsim.CURRENT_LAW_RESULTS, taxsim.HOUSE_2018_RESULTS, taxsim.SENATE_2018_RESULTS])
+    assert parallel == serial
+
+
+def test_calc_taxpayers_parallel_order():
+    taxpayers = []
+    for income in range(0, 200000, 10000):
+        taxpayer = misc_funcs.create_taxpayer()
+        taxpayer['ordinary_income1'] = income
+        taxpayers.append(taxpayer)
+    policies = taxsim.load_main_policies()
+    assert taxsim.calc_taxpayers_parallel(taxpayers, 3) == taxsim.calc_taxpayers(taxpayers, policies)
+
+
+def test_main_chunk_size(monkeypatch, tmp_path):
+    whole = run_main(monkeypatch, tmp_path / "whole")
+    assert run_main(monkeypatch, tmp_path / "serial", "--chunk-size", "3") == whole
+    assert run_main(monkeypatch, tmp_path / "parallel", "--chunk-size", "3", "--jobs", "2") == whole
+
+
+def test_results_writer_matches_write_results(tmp_path):
+    taxpayers = csv_parser.iter_taxpayers(taxsim.TAXPAYERS_FILE)
+    results = [taxsim.calc_federal_taxes(taxpayer, policy) for taxpayer in taxpayers]
+    csv_parser.write_results(results, str(tmp_path / "whole.csv"))
+    with csv_parser.ResultsWriter(str(tmp_path / "streamed.csv")) as writer:
+        for chunk in misc_funcs.chunked(results, 3):
+            writer.write(chunk)
+    assert (tmp_path / "streamed.csv").read_text() == (tmp_path / "whole.csv").read_text()
@@ -0,0 +1,48 @@
+from context import *
+import pytest
+
+import taxsim.metrics as metrics
+
+
+def test_counter_and_gauge_render():
+    registry = metrics.Registry()
+    requests = registry.counter('requests_total', "Requests handled.", ['endpoint', 'status'])
+    size = registry.gauge('cache_size', "Cache entries.")
+    requests.inc('/a', 200)
+    requests.inc('/a', 200)
+    requests.inc('/b "quoted"', 400, amount=3)
+    size.set(7)
+
+    assert requests.value('/a', 200) == 2
+    assert registry.render() == (
+        '# HELP requests_total Requests handled.\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{endpoint="/a",status="200"} 2\n'
+        'requests_total{endpoint="/b \\"quoted\\"",status="400"} 3\n'
+        '# HELP cache_size Cache entries.\n'
+        '# TYPE cache_size gauge\n'
+        'cache_size 7\n')
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    latency = registry.histogram('latency_seconds', "Latency.", ['stage'], buckets=(0.01, 0.1))
+    for value in (0.005, 0.01, 0.05, 2):
+        latency.observe(value, 'parse')
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="parse",le="0.01"} 2',
+        'latency_seconds_bucket{stage="parse",le="0.1"} 3',
+        'latency_seconds_bucket{stage="parse",le="+Inf"} 4',
+        'latency_seconds_sum{stage="parse"} 2.065',
+        'latency_seconds_count{stage="parse"} 4']
+
+
+def test_metric_label_checks():
+    registry = metrics.Registry()
+    requests = registry.counter('requests_total', "Requests handled.", ['status'])
+    with pytest.raises(ValueError):
+        requests.inc()
+    with pytest.raises(ValueError):
+        registry.counter('requests_total', "Again.")
@@ -0,0 +1,102 @@
+from context import *
+import threading
+import time
+
+import pytest
+
+import taxsim.batch as batch
+import taxsim.microbatch as microbatch
+
+CALCS = [(batch.calc_federal_taxes_batch, taxsim.current_law_policy, taxsim.calc_federal_taxes),
+         (batch.calc_senate_2018_taxes_batch, taxsim.senate_2018_policy, taxsim.calc_senate_2018_taxes)]
+
+
+def make_taxpayer(income, **fields):
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['filing_status'] = 1
+    taxpayer['ordinary_income1'] = income
+    taxpayer.update(fields)
+    return taxpayer
+
+
+def run_concurrently(batcher, taxpayers, calcs, mrate=True):
+    outcomes = [None] * len(taxpayers)
+    start = threading.Barrier(len(taxpayers))
+
+    def submit(i):
+        start.wait()
+        try:
+            outcomes[i] = batcher.calc(taxpayers[i], calcs, mrate)
+        except ValueError as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(taxpayers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+@pytest.mark.parametrize('min_batch_size', [1, 1000])
+def test_micro_batches_match_scalar(min_batch_size):
+    batcher = microbatch.MicroBatcher(max_batch_size=8, max_wait=0.05, min_batch_size=min_batch_size)
+    taxpayers = [make_taxpayer(10000 * i) for i in range(20)]
+    outcomes = run_concurrently(batcher, taxpayers, CALCS)
+
+    assert batcher.submissions == 20
+    assert batcher.batches < 20
+    for taxpayer, results in zip(taxpayers, outcomes):
+        for (_, policy, calc), result in zip(CALCS, results):
+            expected = calc(taxpayer, policy)
+            assert list(result.keys()) == list(expected.keys())
+            for key in expected:
+                assert result[key] == pytest.approx(expected[key], abs=1e-6), key
+
+
+def test_micro_batch_invalid_taxpayer_fails_alone():
+    batcher = microbatch.MicroBatcher(max_batch_size=8, max_wait=0.05, min_batch_size=1)
+    taxpayers = [make_taxpayer(50000), make_taxpayer(50000, filing_status=0, child_dep=1),
+                 make_taxpayer(50000, ordinary_income2="bad stuff!"), make_taxpayer(60000)]
+    outcomes = run_concurrently(batcher, taxpayers, CALCS[:1], mrate=False)
+
+    assert isinstance(outcomes[1], ValueError)
+    assert isinstance(outcomes[2], ValueError)
+    assert outcomes[3][0]['tax_burden'] == pytest.approx(taxsim.calc_federal_taxes(taxpayers[3], taxsim.current_law_policy, mrate=False)['tax_burden'])
+    assert 'marginal_income_tax_rate' not in outcomes[0][0]
+
+
+def test_micro_batch_leader_returns_under_steady_load():
+    batcher = microbatch.MicroBatcher(max_batch_size=2, max_wait=0.01, min_batch_size=1000)
+    stop = threading.Event()
+    first = []
+
+    def slow_calc(taxpayer, policy, mrate):
+        # Let finished submitters come back while the batch is calculated
+        time.sleep(0.001)
+        return taxsim.calc_federal_taxes(taxpayer, policy, mrate=mrate)
+
+    calcs = [(batch.calc_federal_taxes_batch, taxsim.current_law_policy, slow_calc)]
+
+    def submit_continuously(income):
+        while not stop.is_set():
+            batcher.calc(make_taxpayer(income), calcs, mrate=False)
+
+    # More continuous submitters than fit in a batch, so something is always pending
+    leader = threading.Thread(target=lambda: first.append(batcher.calc(make_taxpayer(1000), calcs, mrate=False)))
+    leader.start()
+    load = [threading.Thread(target=submit_continuously, args=(10000 * i,)) for i in range(1, 7)]
+    for thread in load:
+        thread.start()
+    try:
+        leader.join(timeout=5)
+        returned = not leader.is_alive()
+    finally:
+        stop.set()
+        for thread in load:
+            thread.join()
+        leader.join()
+
+    assert returned
+    assert len(first) == 1
+    assert batcher.submissions > len(load)
@@ -7,3 +7,25 @@ policy = taxsim.current_law_policy
 def test_load_taxpayers():
     taxpayers = csv_parser.load_taxpayers('taxpayers.csv')
     assert taxpayers[0]['ordinary_income1'] == 30000
+
+
+def test_iter_taxpayers_is_lazy():
+    taxpayers = csv_parser.iter_taxpayers('taxpayers.csv')
+    assert next(taxpayers)['ordinary_income1'] == 30000
+    assert len(list(taxpayers)) == len(csv_parser.load_taxpayers('taxpayers.csv')) - 1
+
+
+def test_chunked():
+    assert list(misc_funcs.chunked(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(misc_funcs.chunked(range(6), 3)) == [[0, 1, 2], [3, 4, 5]]
+    assert list(misc_funcs.chunked([], 3)) == []
+
+
+def test_iter_taxpayers_ignores_other_columns(tmp_path):
+    path = tmp_path / 'taxpayers.csv'
+    path.write_text("id,filing_status,ordinary_income1,notes\n"
+                    "a1,1,50000,married couple\n")
+    [taxpayer] = csv_parser.iter_taxpayers(str(path))
+    assert taxpayer['filing_status'] == 1
+    assert taxpayer['ordinary_income1'] == 50000
+    assert taxpayer['child_dep'] == 0
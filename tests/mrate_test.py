@@ -43,3 +43,58 @@ def test_marginal_business_income_tax_rate0():
     results = taxsim.calc_federal_taxes(taxpayer, policy)
 
     assert results['marginal_business_income_tax_rate'] > 0.0001
+
+
+def brute_force_rate(tax_calc, taxpayer, test_policy, field, step):
+    base = tax_calc(copy.copy(taxpayer), test_policy, mrate=False)
+    perturbed_taxpayer = copy.copy(taxpayer)
+    perturbed_taxpayer[field] += step
+    perturbed = tax_calc(perturbed_taxpayer, test_policy, mrate=False)
+    return (perturbed["tax_burden"] - base["tax_burden"]) / step
+
+
+def test_marginal_rates_match_full_recomputation():
+    for tax_calc, test_policy in [(taxsim.calc_federal_taxes, policy),
+                                  (taxsim.calc_senate_2018_taxes, taxsim.senate_2018_policy)]:
+        for income in [0, 12000, 45000, 160000, 500000]:
+            taxpayer = misc_funcs.create_taxpayer()
+            taxpayer['filing_status'] = 2
+            taxpayer['child_dep'] = 2
+            taxpayer['ordinary_income1'] = income
+            taxpayer['business_income'] = income / 4
+            taxpayer['ss_income'] = 10000
+            results = tax_calc(copy.copy(taxpayer), test_policy)
+            assert results['marginal_income_tax_rate'] == brute_force_rate(
+                tax_calc, taxpayer, test_policy, 'ordinary_income1', taxsim.MARG_RATE_BOUND)
+            assert results['marginal_business_income_tax_rate'] == brute_force_rate(
+                tax_calc, taxpayer, test_policy, 'business_income', taxsim.MARG_RATE_BOUND)
+
+
+def test_calc_marginal_rates_several_perturbations():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 80000
+    taxpayer['qualified_income'] = 20000
+    perturbations = [('ordinary_100', 'ordinary_income1', 100),
+                     ('ordinary_10000', 'ordinary_income1', 10000),
+                     ('qualified_1000', 'qualified_income', 1000)]
+    rates = taxsim.calc_marginal_rates(taxsim.calc_federal_taxes, taxpayer, policy, perturbations)
+    assert list(rates.keys()) == ['ordinary_100', 'ordinary_10000', 'qualified_1000']
+    for name, field, step in perturbations:
+        assert rates[name] == brute_force_rate(taxsim.calc_federal_taxes, taxpayer, policy, field, step)
+    assert taxpayer['ordinary_income1'] == 80000
+
+
+def test_calc_marginal_rates_batch():
+    import taxsim.batch as batch
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 80000
+    taxpayer['qualified_income'] = 20000
+    perturbations = [('ordinary_100', 'ordinary_income1', 100),
+                     ('qualified_1000', 'qualified_income', 1000)]
+    rates = batch.calc_marginal_rates_batch(batch.calc_senate_2018_taxes_batch, batch.to_columns([taxpayer]),
+                                            taxsim.senate_2018_policy, perturbations)
+    scalar_rates = taxsim.calc_marginal_rates(taxsim.calc_senate_2018_taxes, taxpayer,
+                                              taxsim.senate_2018_policy, perturbations)
+    assert list(rates.keys()) == list(scalar_rates.keys())
+    for name in scalar_rates:
+        assert rates[name][0] == scalar_rates[name]
@@ -0,0 +1,31 @@
+from context import *
+import pytest
+
+import taxsim.plans as plans
+
+
+def test_default_plans_exclude_ss2100():
+    assert [(plan.id, plan.year) for plan in plans.select_plans()] == plans.DEFAULT_PLANS
+    assert ('ss2100', 2019) in plans.PLANS
+    assert ('ss2100', 2019) not in plans.DEFAULT_PLANS
+
+
+def test_select_plans_by_id_and_year():
+    assert [(plan.id, plan.year) for plan in plans.select_plans(years=[2019])] == [('pre-tcja', 2019), ('tcja', 2019)]
+    assert [(plan.id, plan.year) for plan in plans.select_plans(['ss2100', 'tcja'], [2019])] == [('tcja', 2019), ('ss2100', 2019)]
+
+
+def test_select_unknown_plan():
+    with pytest.raises(ValueError):
+        plans.select_plans(['flat-tax'])
+    with pytest.raises(ValueError):
+        plans.select_plans(years=[1999])
+    # Both known, but never together
+    with pytest.raises(ValueError):
+        plans.select_plans(['ss2100'], [2018])
+
+
+def test_plan_policy():
+    plan = plans.PLANS[('ss2100', 2019)]
+    assert plans.policy(plan) is taxsim.senate_2019_ss_policy
+    assert plans.describe(plan) == {'id': 'ss2100', 'name': 'Social Security 2100 Act', 'year': 2019}
@@ -0,0 +1,106 @@
+from context import *
+import json
+import pickle
+import sys
+from collections import OrderedDict
+
+import pytest
+
+import taxsim.records as records
+
+policy = taxsim.current_law_policy
+
+
+def test_taxpayer_defaults():
+    taxpayer = misc_funcs.create_taxpayer()
+    assert list(taxpayer.keys()) == list(records.TAXPAYER_FIELDS)
+    assert all(value == 0 for value in taxpayer.values())
+    assert len(taxpayer) == 16
+
+
+def test_taxpayer_mapping_access():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['401k_contributions'] = 5000
+    taxpayer['ordinary_income1'] = 40000
+    assert taxpayer.contributions_401k == 5000
+    assert taxpayer.ordinary_income1 == 40000
+    assert taxpayer['401k_contributions'] == 5000
+    assert '401k_contributions' in taxpayer
+    assert 'contributions_401k' not in taxpayer
+
+
+def test_taxpayer_fixed_layout():
+    taxpayer = misc_funcs.create_taxpayer()
+    with pytest.raises(KeyError):
+        taxpayer['bad_field'] = 1
+    with pytest.raises(TypeError):
+        del taxpayer['child_dep']
+    with pytest.raises(AttributeError):
+        taxpayer.bad_field = 1
+    assert not hasattr(taxpayer, '__dict__')
+
+
+def test_taxpayer_from_dict():
+    values = OrderedDict([('filing_status', 1), ('child_dep', 2), ('401k_contributions', 1000)])
+    taxpayer = misc_funcs.create_taxpayer(values)
+    assert taxpayer['child_dep'] == 2
+    assert taxpayer['ordinary_income1'] == 0
+    assert taxpayer == dict(misc_funcs.create_taxpayer(), **values)
+
+
+def test_taxpayer_copy_is_independent():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 1000
+    copy = taxpayer.copy()
+    copy['ordinary_income1'] = 2000
+    assert taxpayer['ordinary_income1'] == 1000
+    assert isinstance(copy, records.Taxpayer)
+
+
+def test_result_keys_follow_calculation():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 50000
+    result = taxsim.calc_federal_taxes(taxpayer, policy)
+    assert isinstance(result, records.Result)
+    assert 'personal_credit' not in result
+    assert list(result.keys())[0] == 'gross_income'
+    assert list(result.keys())[-1] == 'marginal_business_income_tax_rate'
+    house_result = taxsim.calc_house_2018_taxes(taxpayer, taxsim.house_2018_policy, mrate=False)
+    assert 'personal_credit' in house_result
+    assert 'marginal_income_tax_rate' not in house_result
+
+
+def test_result_dict_view():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 50000
+    result = taxsim.calc_federal_taxes(taxpayer, policy)
+    result_dict = result.to_dict()
+    assert result_dict == result
+    assert list(result_dict.keys()) == list(result.keys())
+    assert json.loads(json.dumps(result_dict)) == result_dict
+
+
+def test_records_pickle():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 50000
+    result = taxsim.calc_federal_taxes(taxpayer, policy, mrate=False)
+    assert pickle.loads(pickle.dumps(taxpayer)) == taxpayer
+    assert pickle.loads(pickle.dumps(result)) == result
+
+
+def test_records_smaller_than_dicts():
+    taxpayer = misc_funcs.create_taxpayer()
+    result = taxsim.calc_federal_taxes(taxpayer, policy)
+    assert sys.getsizeof(taxpayer) < sys.getsizeof(taxpayer.to_dict()) / 4
+    assert sys.getsizeof(result) < sys.getsizeof(result.to_dict()) / 4
+
+
+def test_plain_dict_taxpayer():
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = 50000
+    assert taxsim.calc_federal_taxes(taxpayer.to_dict(), policy) == taxsim.calc_federal_taxes(taxpayer, policy)
+
+
+def test_result_to_dict_fields():
+    result = records.Result([('agi', 1.0), ('tax_burden', 2.0)])
+    assert list(result.to_dict(['tax_burden', 'amt', 'agi']).items()) == [('tax_burden', 2.0), ('agi', 1.0)]
@@ -0,0 +1,158 @@
+from context import *
+import threading
+import time
+
+import pytest
+
+import taxsim.result_cache as result_cache
+
+policy = taxsim.current_law_policy
+
+
+def make_taxpayer(income):
+    taxpayer = misc_funcs.create_taxpayer()
+    taxpayer['ordinary_income1'] = income
+    return taxpayer
+
+
+def test_cache_hit_matches_calculation():
+    cache = result_cache.ResultCache(maxsize=8)
+    first = cache.calc(taxsim.calc_federal_taxes, make_taxpayer(50000), policy)
+    second = cache.calc(taxsim.calc_federal_taxes, make_taxpayer(50000), policy)
+    assert first == second == taxsim.calc_federal_taxes(make_taxpayer(50000), policy)
+    assert cache.info() == result_cache.CacheInfo(hits=1, misses=1, evictions=0, maxsize=8, currsize=1)
+
+
+def test_cache_key_includes_calc_policy_and_mrate():
+    cache = result_cache.ResultCache(maxsize=8)
+    taxpayer = make_taxpayer(50000)
+    cache.calc(taxsim.calc_federal_taxes, taxpayer, policy)
+    cache.calc(taxsim.calc_federal_taxes, taxpayer, policy, mrate=False)
+    cache.calc(taxsim.calc_senate_2018_taxes, taxpayer, taxsim.senate_2018_policy)
+    cache.calc(taxsim.calc_federal_taxes, taxpayer, taxsim.current_law_2019_policy)
+    assert cache.info().misses == 4
+    assert 'marginal_income_tax_rate' not in cache.calc(taxsim.calc_federal_taxes, taxpayer, policy, mrate=False)
+
+
+def test_cache_returns_copies():
+    cache = result_cache.ResultCache(maxsize=8)
+    result = cache.calc(taxsim.calc_federal_taxes, make_taxpayer(50000), policy)
+    tax_burden = result['tax_burden']
+    result['tax_burden'] = -1
+    assert cache.calc(taxsim.calc_federal_taxes, make_taxpayer(50000), policy)['tax_burden'] == tax_burden
+
+
+def test_cache_evicts_least_recently_used():
+    cache = result_cache.ResultCache(maxsize=2)
+    cache.calc(taxsim.calc_federal_taxes, make_taxpayer(10000), policy)
+    cache.calc(taxsim.calc_federal_taxes, make_taxpayer(20000), policy)
+    cache.calc(taxsim.calc_federal_taxes, make_taxpayer(10000), policy)
+    cache.calc(taxsim.calc_federal_taxes, make_taxpayer(30000), policy)  # evicts 20000
+    cache.calc(taxsim.calc_federal_taxes, make_taxpayer(10000), policy)
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (2, 3, 1, 2)
+
+
+def test_cache_invalidate_policy():
+    cache = result_cache.ResultCache(maxsize=8)
+    edited_policy = dict(policy)
+    cache.calc(taxsim.calc_federal_taxes, make_taxpayer(50000), edited_policy)
+    cache.calc(taxsim.calc_federal_taxes, make_taxpayer(50000), taxsim.current_law_2019_policy)
+    edited_policy['ctc_credit'] = 0
+    cache.invalidate(edited_policy)
+    assert cache.info().currsize == 1
+    cache.invalidate()
+    assert cache.info().currsize == 0
+
+
+def test_cache_does_not_store_invalid_taxpayers():
+    cache = result_cache.ResultCache(maxsize=8)
+    taxpayer = make_taxpayer(50000)
+    taxpayer['child_dep'] = 1
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.calc(taxsim.calc_federal_taxes, taxpayer, policy)
+    assert cache.info().currsize == 0
+
+
+def test_policy_fingerprint_is_stable():
+    reloaded = csv_parser.load_policy(taxsim.PARAMS_DIR + taxsim.CURRENT_LAW_FILE)
+    assert result_cache.policy_fingerprint(reloaded) == result_cache.policy_fingerprint(policy)
+    assert result_cache.policy_fingerprint(policy) != result_cache.policy_fingerprint(taxsim.current_law_2019_policy)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_response_cache_ttl_and_eviction():
+    clock = FakeClock()
+    cache = result_cache.ResponseCache(maxsize=2, ttl=10, clock=clock)
+    cache.put('a', b'1')
+    cache.put('b', b'2')
+    assert cache.get('a') == b'1'
+    cache.put('c', b'3')  # evicts b
+    assert cache.get('b') is None
+    clock.now = 10
+    assert cache.get('a') is None
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.expirations, info.currsize) == (1, 2, 1, 1, 1)
+    assert info.hit_rate == pytest.approx(1 / 3)
+
+
+def test_response_cache_invalidate_tag():
+    cache = result_cache.ResponseCache(maxsize=8)
+    cache.put('a', b'1', tags=[('tcja', 2018)])
+    cache.put('b', b'2', tags=[('tcja', 2019), ('ss2100', 2019)])
+    cache.invalidate(('ss2100', 2019))
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    cache.invalidate()
+    assert cache.info().currsize == 0
+
+
+def test_response_cache_latency():
+    cache = result_cache.ResponseCache(maxsize=8)
+    cache.record_latency(True, 0.001)
+    cache.record_latency(True, 0.003)
+    cache.record_latency(False, 0.01)
+    info = cache.info()
+    assert info.hit_latency == pytest.approx(0.002)
+    assert info.miss_latency == pytest.approx(0.01)
+
+
+def test_single_flight_shares_concurrent_calls():
+    single_flight = result_cache.SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return len(calls)
+
+    outcomes = []
+    threads = [threading.Thread(target=lambda: outcomes.append(single_flight.do('key', slow))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while single_flight.info().coalesced < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert sorted(outcomes) == [(1, False)] + [(1, True)] * 4
+    assert single_flight.info() == result_cache.SingleFlightInfo(calls=1, coalesced=4, in_flight=0)
+    assert single_flight.do('key', lambda: 2) == (2, False)
+
+
+def test_single_flight_shares_exceptions():
+    single_flight = result_cache.SingleFlight()
+    with pytest.raises(ValueError):
+        single_flight.do('key', lambda: int('x'))
+    assert single_flight.info().in_flight == 0
@@ -0,0 +1,42 @@
+from context import *
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from urllib.request import Request, urlopen
+
+import pytest
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="serve.py needs os.fork")
+def test_serve_prefork_workers():
+    server = subprocess.Popen([sys.executable, 'serve.py', '--port', '0', '--workers', '2'],
+                              cwd=REPO_DIR, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        banner = server.stdout.readline()
+        assert "with 2 workers" in banner
+        url = banner.split()[2]
+        submission = misc_funcs.create_taxpayer().to_dict()
+        submission.update(filing_status=1, ordinary_income1=50000)
+        request = Request(url + '/taxcalc/tcja_submit', data=json.dumps(submission).encode('utf-8'),
+                          headers={'content-type': 'application/json'})
+        for _ in range(4):
+            with urlopen(request, timeout=10) as response:
+                assert response.status == 200
+                assert len(json.loads(response.read().decode('utf-8'))) == 4
+    finally:
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=10) == 0
+
+
+def test_respawn_delay_backs_off_then_gives_up():
+    import serve
+    assert serve.respawn_delay(0) == 0
+    delays = [serve.respawn_delay(n) for n in range(1, serve.MAX_FAST_EXITS)]
+    assert delays == sorted(delays) and delays[0] == serve.RESPAWN_DELAY
+    assert max(delays) <= serve.RESPAWN_MAX_DELAY
+    assert serve.respawn_delay(serve.MAX_FAST_EXITS) is None